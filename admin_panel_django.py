@@ -9,6 +9,8 @@ import sys
 import requests
 from pathlib import Path
 
+from sessao_http import SessaoHTTP
+
 # Django imports
 import django
 from django.conf import settings
@@ -71,6 +73,26 @@ if not settings.configured:
 
 API_BASE_URL = "http://127.0.0.1:8000"
 
+# Padrões da SessaoHTTP (pool, retry e timeout)
+HTTP_POOL_MAXSIZE = int(os.getenv('ADMIN_HTTP_POOL', 10))
+HTTP_TENTATIVAS = int(os.getenv('ADMIN_HTTP_TENTATIVAS', 2))
+HTTP_TIMEOUT_CONEXAO = float(os.getenv('ADMIN_HTTP_TIMEOUT_CONEXAO', 5))
+HTTP_TIMEOUT_LEITURA = float(os.getenv('ADMIN_HTTP_TIMEOUT_LEITURA', 10))
+
+# ============================================
+# SESSÃO HTTP COMPARTILHADA
+# ============================================
+
+api_http = SessaoHTTP(
+    timeouts={
+        # Criação de instância do WhatsApp depende da Evolution API
+        '/api/clinicas/': (5, 30),
+    },
+    timeout_padrao=(HTTP_TIMEOUT_CONEXAO, HTTP_TIMEOUT_LEITURA),
+    tentativas=HTTP_TENTATIVAS,
+    pool_maxsize=HTTP_POOL_MAXSIZE,
+)
+
 # ============================================
 # HELPER FUNCTIONS
 # ============================================
@@ -86,18 +108,10 @@ def api_request(method, endpoint, token, data=None):
     }
     
     try:
-        if method == 'GET':
-            response = requests.get(url, headers=headers, timeout=10)
-        elif method == 'POST':
-            response = requests.post(url, headers=headers, json=data, timeout=10)
-        elif method == 'PUT':
-            response = requests.put(url, headers=headers, json=data, timeout=10)
-        # ▼▼▼ NOVA CONDIÇÃO ADICIONADA AQUI ▼▼▼
-        elif method == 'PATCH':
-            response = requests.patch(url, headers=headers, json=data, timeout=10)
-        # ▲▲▲ FIM DA NOVA CONDIÇÃO ▲▲▲
-        elif method == 'DELETE':
-            response = requests.delete(url, headers=headers, timeout=10)
+        if method in ('POST', 'PUT', 'PATCH'):
+            response = api_http.request(method, url, headers=headers, json=data)
+        else:
+            response = api_http.request(method, url, headers=headers)
         
         return response
     except Exception as e:
@@ -116,10 +130,30 @@ def render_template(request, template_name, context=None):
     Returns:
         HttpResponse com HTML renderizado
     """
-    template = Template(TEMPLATES[template_name])
+    template = obter_template(template_name)
     ctx = Context(context or {})
     return HttpResponse(template.render(ctx))
 
+# Templates compilados (um por nome, por processo)
+_templates_compilados = {}
+
+def obter_template(template_name):
+    """
+    Retorna o Template compilado de TEMPLATES[template_name], compilando
+    apenas no primeiro uso.
+    """
+    template = _templates_compilados.get(template_name)
+    if template is None:
+        template = Template(TEMPLATES[template_name])
+        _templates_compilados[template_name] = template
+    return template
+
+def aquecer_templates():
+    """Compila todos os templates de TEMPLATES antes de atender a primeira requisição."""
+    for template_name in TEMPLATES:
+        obter_template(template_name)
+    print(f"Templates compilados: {len(_templates_compilados)}")
+
 # ============================================
 # VIEWS - AUTENTICAÇÃO
 # ============================================
@@ -137,7 +171,7 @@ def login_view(request):
         password = request.POST.get('password')
         
         try:
-            response = requests.post(
+            response = api_http.post(
                 f"{API_BASE_URL}/login",
                 json={"email": email, "password": password},
                 timeout=10
@@ -2201,5 +2235,8 @@ if __name__ == '__main__':
     print("\nCertifique-se que o main.py esta rodando na porta 8000!")
     print("\nPressione CTRL+C para parar\n")
     
+    if os.getenv('TEMPLATE_WARMUP', 'True').lower() in ('true', '1', 'yes'):
+        aquecer_templates()
+    
     sys.argv = ['manage.py', 'runserver', '127.0.0.1:9000', '--noreload']
     execute_from_command_line(sys.argv)
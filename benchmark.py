@@ -0,0 +1,467 @@
+"""
+IntelliMed - Benchmark da API (main.py)
+
+Gera uma base sintética multi-clínica e executa cenários roteirizados contra a
+API, em processo (Django test Client), sem servidor e sem chamadas reais ao
+Gemini (IA_PROVEDOR=local). Para cada endpoint informa latência p50/p95/p99,
+vazão e número de queries, e compara com um arquivo de baseline.
+
+Uso:
+    python benchmark.py gerar  [--clinicas 3] [--pacientes 300] [--anos 2] [--agendamentos-dia 12]
+    python benchmark.py rodar  [--cenarios login,dashboard,...] [--repeticoes 30] [--concorrencia 4]
+    python benchmark.py rodar  --salvar-baseline
+    python benchmark.py rodar  --comparar [--tolerancia 0.25]   (código de saída 1 se houver regressão)
+
+Os dados ficam em ./benchmark_dados (BENCHMARK_DIR), separados do banco real.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import date, datetime, timedelta, time as dt_time
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCHMARK_DIR = os.path.abspath(os.getenv('BENCHMARK_DIR', os.path.join(BASE_DIR, 'benchmark_dados')))
+BASELINE_PADRAO = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+SENHA_PADRAO = 'benchmark123'
+
+
+# ============================================
+# AMBIENTE ISOLADO
+# ============================================
+
+def preparar_ambiente():
+    """
+    Importa o main.py apontando para o banco do benchmark e para o provedor de IA
+    local. O diretório de trabalho passa a ser BENCHMARK_DIR, para que o .env do
+    projeto (que sobrescreve variáveis de ambiente) não seja carregado.
+    """
+    os.makedirs(BENCHMARK_DIR, exist_ok=True)
+    os.chdir(BENCHMARK_DIR)
+    os.environ['DATABASE_NAME'] = os.path.join(BENCHMARK_DIR, 'benchmark.db')
+    os.environ['DEBUG'] = 'False'
+    os.environ['METRICAS_ARQUIVO'] = os.path.join(BENCHMARK_DIR, 'metricas.db')
+    os.environ.setdefault('IA_PROVEDOR', 'local')
+    os.environ.setdefault('IA_LOCAL_LATENCIA', 'fixa:50')
+    os.environ.setdefault('IA_CACHE_ATIVO', 'False')
+    os.environ.setdefault('AUDIO_PREPROCESSAMENTO', 'False')
+    os.environ.setdefault('IA_TAXA_POR_MINUTO', '100000')
+    os.environ.setdefault('IA_RAJADA', '1000')
+
+    sys.path.insert(0, BASE_DIR)
+    import main
+    return main
+
+
+# ============================================
+# GERADOR DE DADOS SINTÉTICOS
+# ============================================
+
+NOMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elisa', 'Fábio', 'Gabriela', 'Heitor', 'Isabela', 'João',
+         'Larissa', 'Marcos', 'Natália', 'Otávio', 'Paula', 'Rafael', 'Sofia', 'Tiago', 'Vanessa', 'William']
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Lima', 'Pereira', 'Costa', 'Rodrigues', 'Almeida', 'Nascimento',
+              'Carvalho', 'Gomes', 'Martins', 'Araújo', 'Ribeiro']
+CONVENIOS = ['PARTICULAR', 'SUS', 'UNIMED', 'BRADESCO SAUDE', 'SULAMERICA', 'AMIL', 'HAPVIDA']
+FORMAS_PAGAMENTO = ['Dinheiro', 'Cartão de Crédito', 'Cartão de Débito', 'PIX', 'Convênio']
+
+
+def gerar_cpf(rng):
+    """CPF sintético com dígitos verificadores válidos."""
+    numeros = [rng.randint(0, 9) for _ in range(9)]
+    for peso_inicial in (10, 11):
+        soma = sum(n * (peso_inicial - i) for i, n in enumerate(numeros))
+        digito = (soma * 10) % 11
+        numeros.append(0 if digito == 10 else digito)
+    s = ''.join(map(str, numeros))
+    return f"{s[:3]}.{s[3:6]}.{s[6:9]}-{s[9:]}"
+
+
+def nome_aleatorio(rng):
+    return f"{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}"
+
+
+def gerar_dados(main, clinicas=3, pacientes=300, anos=2, agendamentos_dia=12, seed=42):
+    """Cria clínicas com assinatura, usuários, pacientes, agenda, consultas e receitas."""
+    from django.db import transaction
+
+    rng = random.Random(seed)
+    main.inicializar_banco()
+    plano = main.Plano.objects.get(nome='Enterprise')
+    hoje = date.today()
+    inicio_historico = hoje - timedelta(days=365 * anos)
+
+    credenciais = []
+    for c in range(clinicas):
+        with transaction.atomic():
+            clinica = main.Clinica.objects.create(
+                nome=f"Clínica Benchmark {c + 1}", cnpj=f"{c + 1:02d}.000.000/0001-{c + 1:02d}",
+                telefone='(11) 3000-0000', email=f"clinica{c + 1}@benchmark.local",
+                logradouro='Rua do Teste', numero=str(c + 1), bairro='Centro', cidade='São Paulo', estado='SP',
+                cep='01000-000', responsavel_nome=nome_aleatorio(rng), responsavel_cpf=gerar_cpf(rng),
+                responsavel_telefone='(11) 90000-0000', responsavel_email=f"resp{c + 1}@benchmark.local",
+            )
+            main.AssinaturaClinica.objects.create(
+                clinica=clinica, plano=plano, data_inicio=hoje - timedelta(days=1),
+                data_fim=hoje + timedelta(days=365), status='ativa'
+            )
+
+            medicos = []
+            for m in range(3):
+                usuario = main.Usuario(
+                    clinica=clinica, nome_completo=f"Dr. {nome_aleatorio(rng)}",
+                    email=f"medico{m + 1}.c{c + 1}@benchmark.local", cpf=gerar_cpf(rng),
+                    data_nascimento=date(1980, 1, 1), telefone_celular='(11) 90000-0000',
+                    funcoes=['admin', 'medico'] if m == 0 else ['medico'],
+                    crm=f"{100000 + c * 10 + m}-SP", especialidade='Clínica Geral', status='ativo',
+                    precisa_alterar_senha=False,
+                )
+                usuario.set_password(SENHA_PADRAO)
+                usuario.save()
+                medicos.append(usuario)
+            credenciais.append({'clinica_id': clinica.id, 'email': medicos[0].email, 'senha': SENHA_PADRAO})
+
+            categoria = main.CategoriaReceita.objects.create(clinica_id=clinica.id, nome='Consultas')
+
+            main.Paciente.objects.bulk_create([
+                main.Paciente(
+                    clinica_id=clinica.id, nome_completo=nome_aleatorio(rng), cpf=gerar_cpf(rng),
+                    data_nascimento=date(rng.randint(1940, 2015), rng.randint(1, 12), rng.randint(1, 28)),
+                    sexo=rng.choice(['M', 'F']), convenio=rng.choice(CONVENIOS),
+                    telefone_celular=f"(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}",
+                    email=f"paciente{p}.c{c + 1}@benchmark.local", cep='01000-000', logradouro='Rua A',
+                    numero=str(p), bairro='Centro', cidade='São Paulo', estado='SP',
+                )
+                for p in range(pacientes)
+            ], batch_size=1000)
+            lista_pacientes = list(main.Paciente.objects.filter(clinica_id=clinica.id))
+
+            agendamentos = []
+            dia = inicio_historico
+            while dia <= hoje + timedelta(days=30):
+                if dia.weekday() < 5 or dia == hoje:
+                    for slot in range(agendamentos_dia):
+                        paciente = rng.choice(lista_pacientes)
+                        if dia < hoje:
+                            situacao = rng.choices(['Realizado', 'Cancelado', 'Faltou'], [80, 12, 8])[0]
+                        elif dia == hoje:
+                            situacao = 'Confirmado'
+                        else:
+                            situacao = rng.choice(['Agendado', 'Confirmado'])
+                        agendamentos.append(main.Agendamento(
+                            clinica_id=clinica.id, paciente=paciente, medico_responsavel=rng.choice(medicos),
+                            paciente_nome=paciente.nome_completo, paciente_cpf=paciente.cpf,
+                            convenio=paciente.convenio, servico='Consulta', tipo='Primeira Consulta',
+                            data=dia, hora=dt_time(8 + slot * 30 // 60, slot * 30 % 60),
+                            valor=Decimal(rng.choice([150, 200, 250, 300])), status=situacao,
+                        ))
+                dia += timedelta(days=1)
+            main.Agendamento.objects.bulk_create(agendamentos, batch_size=1000)
+
+            realizados = main.Agendamento.objects.filter(clinica_id=clinica.id, status='Realizado').select_related('medico_responsavel')
+            consultas, receitas = [], []
+            for agend in realizados.iterator():
+                data_hora = timezone_aware(datetime.combine(agend.data, agend.hora))
+                consultas.append(main.Consulta(
+                    clinica_id=clinica.id, paciente_id=agend.paciente_id, agendamento=agend,
+                    data_consulta=data_hora, tipo_consulta='primeira_consulta', status='finalizada',
+                    queixa_principal='Dor de cabeça', diagnostico='Cefaleia tensional', conduta='Analgésico',
+                    medico_responsavel=agend.medico_responsavel.nome_completo, medico_crm=agend.medico_responsavel.crm,
+                ))
+                recebida = rng.random() < 0.85
+                receitas.append(main.Receita(
+                    clinica_id=clinica.id, categoria=categoria, agendamento=agend, paciente_id=agend.paciente_id,
+                    descricao=f"Consulta - {agend.paciente_nome}", valor=agend.valor, data_vencimento=agend.data,
+                    data_recebimento=agend.data if recebida else None,
+                    status='recebida' if recebida else 'a_receber',
+                    forma_pagamento=rng.choice(FORMAS_PAGAMENTO) if recebida else None,
+                ))
+            main.Consulta.objects.bulk_create(consultas, batch_size=1000)
+            main.Receita.objects.bulk_create(receitas, batch_size=1000)
+
+            # Consulta de hoje com áudio, usada pelos cenários de IA
+            agend_hoje = main.Agendamento.objects.filter(clinica_id=clinica.id, data=hoje).first()
+            if agend_hoje:
+                main.Consulta.objects.create(
+                    clinica_id=clinica.id, paciente_id=agend_hoje.paciente_id, agendamento=agend_hoje,
+                    data_consulta=timezone_aware(datetime.combine(hoje, agend_hoje.hora)),
+                    status='em_atendimento', medico_responsavel=medicos[0].nome_completo, medico_crm=medicos[0].crm,
+                    audio_consulta='data:audio/webm;base64,' + 'A' * 4096, audio_formato='webm',
+                    transcricao_ia='MÉDICO: Bom dia. PACIENTE: Estou com dor de cabeça.',
+                )
+
+        print(f"✓ Clínica {c + 1}/{clinicas}: {len(lista_pacientes)} pacientes, {len(agendamentos)} agendamentos, "
+              f"{len(consultas)} consultas, {len(receitas)} receitas")
+
+    # Dados criados com bulk_create não passam pelos pontos que gravam a auditoria
+    main.popular_auditoria_historica()
+
+    with open(os.path.join(BENCHMARK_DIR, 'credenciais.json'), 'w', encoding='utf-8') as f:
+        json.dump(credenciais, f, indent=2)
+    print(f"✅ Base sintética gerada em {BENCHMARK_DIR}")
+
+
+def timezone_aware(valor):
+    from django.utils import timezone
+    return timezone.make_aware(valor)
+
+
+# ============================================
+# CENÁRIOS
+# ============================================
+
+def _consulta_ia(main, clinica_id):
+    return main.Consulta.objects.filter(clinica_id=clinica_id, audio_consulta__isnull=False).exclude(audio_consulta='').first()
+
+
+def _arquivo_exame():
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    return SimpleUploadedFile('exame.pdf', b'%PDF-1.4 benchmark ' + os.urandom(512), content_type='application/pdf')
+
+
+def montar_cenarios(main, sessao, rng):
+    """
+    Cada cenário devolve (método, url, kwargs do Client). `sessao` tem o token e a
+    clínica do usuário autenticado.
+    """
+    clinica_id = sessao['clinica_id']
+    paciente_ids = list(main.Paciente.objects.filter(clinica_id=clinica_id).values_list('id', flat=True)[:200])
+    nomes = list(main.Paciente.objects.filter(clinica_id=clinica_id).values_list('nome_completo', flat=True)[:200])
+    consulta = _consulta_ia(main, clinica_id)
+
+    return {
+        'login': lambda: ('post', '/login', {
+            'data': json.dumps({'email': sessao['email'], 'password': sessao['senha']}),
+            'content_type': 'application/json', 'autenticado': False,
+        }),
+        'dashboard': lambda: ('get', '/api/dashboard/', {}),
+        'painel': lambda: ('get', '/api/painel/', {'data': {'secoes': SECOES_PAINEL, 'atualizar': '1'}}),
+        'fila_hoje': lambda: ('get', '/api/consultas/fila-hoje/', {}),
+        'busca_pacientes': lambda: ('get', '/api/pacientes/', {'data': {'search': rng.choice(nomes).split()[0]}}),
+        'detalhe_paciente': lambda: ('get', f"/api/pacientes/{rng.choice(paciente_ids)}/", {}),
+        'dashboard_financeiro': lambda: ('get', '/api/faturamento/dashboard/', {}),
+        'backup': lambda: ('get', '/api/backup/criar/', {}),
+        'ia_documentos': lambda: ('post', f"/api/consultas/{consulta.id}/gerar-documentos/", {
+            'data': json.dumps({'tipos': ['atestado', 'evolucao', 'prescricao'], 'regerar': True}),
+            'content_type': 'application/json',
+        }),
+        'ia_transcricao': lambda: ('post', f"/api/consultas/{consulta.id}/transcrever-audio/", {}),
+        'ia_exame': lambda: ('post', '/api/exames/upload-ia/', {
+            'data': {'paciente': rng.choice(paciente_ids), 'tipo_exame': 'outros', 'arquivo': _arquivo_exame()},
+        }),
+    }
+
+
+SECOES_PAINEL = 'dashboard,dados_clinica,dashboard_financeiro,pacientes_inativos,auditoria_recente,auditoria_financeira,medicos'
+
+CENARIOS_PADRAO = [
+    'login', 'dashboard', 'painel', 'fila_hoje', 'busca_pacientes', 'detalhe_paciente',
+    'dashboard_financeiro', 'backup', 'ia_documentos', 'ia_transcricao', 'ia_exame',
+]
+# Cenários lentos por natureza rodam menos vezes
+REPETICOES_MAX = {'backup': 5, 'ia_transcricao': 10, 'ia_exame': 10, 'ia_documentos': 10}
+
+
+# ============================================
+# EXECUÇÃO E ESTATÍSTICAS
+# ============================================
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = (len(ordenados) - 1) * p / 100
+    inferior = int(indice)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (indice - inferior)
+
+
+def autenticar(client, credencial):
+    resposta = client.post('/login', data=json.dumps({'email': credencial['email'], 'password': credencial['senha']}),
+                           content_type='application/json')
+    if resposta.status_code != 200:
+        raise SystemExit(f"❌ Login falhou para {credencial['email']}: {resposta.status_code} {resposta.content[:200]}")
+    return resposta.json()['access_token']
+
+
+def executar_cenario(main, nome, fabrica, token, repeticoes, concorrencia):
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    amostras = []
+    erros = []
+    trava = threading.Lock()
+
+    def _uma_requisicao(_):
+        client = Client(HTTP_HOST='localhost')
+        metodo, url, kwargs = fabrica()
+        kwargs = dict(kwargs)
+        if kwargs.pop('autenticado', True):
+            kwargs['HTTP_AUTHORIZATION'] = f"Bearer {token}"
+        with CaptureQueriesContext(connection) as queries:
+            inicio = time.perf_counter()
+            resposta = getattr(client, metodo)(url, **kwargs)
+            duracao = time.perf_counter() - inicio
+        with trava:
+            amostras.append((duracao, len(queries)))
+            if resposta.status_code >= 400:
+                erros.append(resposta.status_code)
+            elif url.startswith('/api/painel/'):
+                # O painel responde 200 mesmo quando uma seção falha; o status real fica em cada seção
+                erros.extend(s['status'] for s in resposta.json().get('secoes', {}).values() if s['status'] >= 400)
+        connection.close()
+
+    inicio_total = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(_uma_requisicao, range(repeticoes)))
+    duracao_total = time.perf_counter() - inicio_total
+
+    latencias_ms = [d * 1000 for d, _ in amostras]
+    queries = [q for _, q in amostras]
+    return {
+        'requisicoes': len(amostras),
+        'erros': len(erros),
+        'status_erros': sorted(set(erros)),
+        'p50_ms': round(percentil(latencias_ms, 50), 2),
+        'p95_ms': round(percentil(latencias_ms, 95), 2),
+        'p99_ms': round(percentil(latencias_ms, 99), 2),
+        'vazao_rps': round(len(amostras) / duracao_total, 2) if duracao_total else 0.0,
+        'queries_media': round(sum(queries) / len(queries), 1) if queries else 0,
+        'queries_max': max(queries) if queries else 0,
+    }
+
+
+def imprimir_tabela(resultados):
+    print(f"\n{'cenário':<22}{'req':>6}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}{'queries':>9}")
+    print('-' * 83)
+    for nome, r in resultados.items():
+        print(f"{nome:<22}{r['requisicoes']:>6}{r['erros']:>7}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['p99_ms']:>10.1f}{r['vazao_rps']:>9.1f}{r['queries_media']:>9.1f}")
+
+
+def comparar_com_baseline(resultados, baseline, tolerancia):
+    """Regressão: p95 acima da baseline além da tolerância ou mais queries (erros são tratados em rodar)."""
+    regressoes = []
+    for nome, atual in resultados.items():
+        base = baseline.get('cenarios', {}).get(nome)
+        if not base:
+            continue
+        if atual['p95_ms'] > base['p95_ms'] * (1 + tolerancia) and atual['p95_ms'] - base['p95_ms'] > 5:
+            regressoes.append(f"{nome}: p95 {base['p95_ms']:.1f} → {atual['p95_ms']:.1f} ms")
+        if atual['queries_max'] > base['queries_max']:
+            regressoes.append(f"{nome}: queries {base['queries_max']} → {atual['queries_max']}")
+    return regressoes
+
+
+def rodar(main, args):
+    with open(os.path.join(BENCHMARK_DIR, 'credenciais.json'), 'r', encoding='utf-8') as f:
+        credencial = json.load(f)[0]
+
+    from django.test import Client
+    rng = random.Random(args.seed)
+    token = autenticar(Client(HTTP_HOST='localhost'), credencial)
+    fabricas = montar_cenarios(main, {**credencial, 'token': token}, rng)
+
+    nomes = args.cenarios.split(',') if args.cenarios else CENARIOS_PADRAO
+    desconhecidos = [n for n in nomes if n not in fabricas]
+    if desconhecidos:
+        raise SystemExit(f"❌ Cenário(s) desconhecido(s): {', '.join(desconhecidos)}")
+
+    resultados = {}
+    for nome in nomes:
+        repeticoes = min(args.repeticoes, REPETICOES_MAX.get(nome, args.repeticoes))
+        print(f"▶ {nome} ({repeticoes}x, concorrência {args.concorrencia})")
+        resultados[nome] = executar_cenario(main, nome, fabricas[nome], token, repeticoes, args.concorrencia)
+
+    imprimir_tabela(resultados)
+    relatorio = {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {'repeticoes': args.repeticoes, 'concorrencia': args.concorrencia, 'seed': args.seed},
+        'cenarios': resultados,
+    }
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Relatório salvo em {args.saida}")
+
+    # Qualquer 4xx/5xx invalida a execução: um cenário quebrado não pode virar baseline
+    com_erro = {nome: r for nome, r in resultados.items() if r['erros']}
+    if com_erro:
+        print("\n❌ CENÁRIOS COM ERRO (nada foi comparado nem salvo como baseline):")
+        for nome, r in com_erro.items():
+            print(f"   - {nome}: {r['erros']} erro(s), status {r['status_erros']}")
+        return 1
+
+    if args.salvar_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Baseline salva em {args.baseline}")
+        return 0
+
+    if args.comparar:
+        if not os.path.exists(args.baseline):
+            print(f"\n⚠️ Baseline não encontrada em {args.baseline}; rode com --salvar-baseline primeiro.")
+            return 0
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressoes = comparar_com_baseline(resultados, baseline, args.tolerancia)
+        if regressoes:
+            print("\n❌ REGRESSÕES EM RELAÇÃO À BASELINE:")
+            for r in regressoes:
+                print(f"   - {r}")
+            return 1
+        print("\n✅ Sem regressões em relação à baseline.")
+    return 0
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmark da API do IntelliMed')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p_gerar = sub.add_parser('gerar', help='Gera a base sintética')
+    p_gerar.add_argument('--clinicas', type=int, default=3)
+    p_gerar.add_argument('--pacientes', type=int, default=300, help='Pacientes por clínica')
+    p_gerar.add_argument('--anos', type=int, default=2, help='Anos de histórico de agenda')
+    p_gerar.add_argument('--agendamentos-dia', type=int, default=12)
+    p_gerar.add_argument('--seed', type=int, default=42)
+
+    p_rodar = sub.add_parser('rodar', help='Executa os cenários')
+    p_rodar.add_argument('--cenarios', help=f"Lista separada por vírgula (padrão: {','.join(CENARIOS_PADRAO)})")
+    p_rodar.add_argument('--repeticoes', type=int, default=30)
+    p_rodar.add_argument('--concorrencia', type=int, default=4)
+    p_rodar.add_argument('--seed', type=int, default=42)
+    p_rodar.add_argument('--saida', help='Arquivo JSON com o relatório desta execução')
+    p_rodar.add_argument('--baseline', default=BASELINE_PADRAO)
+    p_rodar.add_argument('--salvar-baseline', action='store_true')
+    p_rodar.add_argument('--comparar', action='store_true')
+    p_rodar.add_argument('--tolerancia', type=float, default=0.25, help='Aumento aceitável do p95 (0.25 = 25%%)')
+
+    args = parser.parse_args()
+    if getattr(args, 'saida', None):
+        args.saida = os.path.abspath(args.saida)
+    if getattr(args, 'baseline', None):
+        args.baseline = os.path.abspath(args.baseline)
+
+    banco = os.path.join(BENCHMARK_DIR, 'benchmark.db')
+    if args.comando == 'gerar' and os.path.exists(banco):
+        raise SystemExit(f"❌ {banco} já existe; apague-o para gerar uma nova base.")
+    if args.comando == 'rodar' and not os.path.exists(banco):
+        raise SystemExit("❌ Base do benchmark não encontrada; rode 'python benchmark.py gerar' primeiro.")
+
+    main = preparar_ambiente()
+
+    if args.comando == 'gerar':
+        gerar_dados(main, args.clinicas, args.pacientes, args.anos, args.agendamentos_dia, args.seed)
+        return 0
+    return rodar(main, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
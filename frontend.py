@@ -11,13 +11,15 @@ import requests
 from pathlib import Path
 from datetime import datetime, timedelta
 
+from sessao_http import SessaoHTTP
+
 # Configuração Django
 import django
 from django.conf import settings
 from django.core.management import execute_from_command_line
 from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
 from django.shortcuts import render, redirect
-from django.urls import path
+from django.urls import path, reverse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib import messages
@@ -88,6 +90,15 @@ class Config:
     
     # Session
     SESSION_COOKIE_AGE = 86400  # 24 horas
+    
+    # Sessão HTTP com o backend (SessaoHTTP)
+    HTTP_POOL_MAXSIZE = int(os.getenv('FRONTEND_HTTP_POOL', 32))
+    HTTP_TENTATIVAS = int(os.getenv('FRONTEND_HTTP_TENTATIVAS', 2))
+    HTTP_TIMEOUT_CONEXAO = float(os.getenv('FRONTEND_HTTP_TIMEOUT_CONEXAO', 5))
+    HTTP_TIMEOUT_LEITURA = float(os.getenv('FRONTEND_HTTP_TIMEOUT_LEITURA', 30))
+    
+    # Compilar todos os templates na inicialização
+    TEMPLATE_WARMUP = os.getenv('TEMPLATE_WARMUP', 'True').lower() in ('true', '1', 'yes')
 
 # ============================================
 # FUNÇÕES AUXILIARES
@@ -104,6 +115,57 @@ def format_currency_brl(value):
     except (ValueError, TypeError):
         return "0,00"
 
+# ============================================
+# CLIENTE HTTP DO BACKEND (SESSÃO COM POOL DE CONEXÕES)
+# ============================================
+
+backend_http = SessaoHTTP(
+    timeouts={
+        '/api/exames/upload-ia/': (5, 120),
+        '/api/backup/': (5, 300),
+        '/login': (5, 10),
+    },
+    timeout_padrao=(Config.HTTP_TIMEOUT_CONEXAO, Config.HTTP_TIMEOUT_LEITURA),
+    tentativas=Config.HTTP_TENTATIVAS,
+    pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+    pool_connections=4,
+)
+
+# Pool compartilhado para chamadas paralelas ao backend
+from concurrent.futures import ThreadPoolExecutor, wait
+_backend_executor = ThreadPoolExecutor(max_workers=int(os.getenv('FRONTEND_FETCH_WORKERS', 16)), thread_name_prefix='backend-fetch')
+
+def buscar_em_paralelo(chamadas, timeout_total=15):
+    """
+    Dispara várias chamadas GET independentes ao backend ao mesmo tempo.
+
+    `chamadas` é um dict {nome: (url, kwargs)}, onde kwargs vai direto para
+    backend_http.get (headers, params, ...). Todas compartilham um único orçamento
+    de tempo (`timeout_total`, em segundos): o tempo da página fica próximo ao
+    da chamada mais lenta, e não à soma de todas.
+
+    Retorna {nome: Response ou exceção}. Chamadas que não terminaram dentro do
+    orçamento retornam requests.Timeout.
+    """
+    futuros = {}
+    for nome, (url, kwargs) in chamadas.items():
+        kwargs = dict(kwargs)
+        kwargs['timeout'] = min(kwargs.get('timeout', timeout_total), timeout_total)
+        futuros[nome] = _backend_executor.submit(backend_http.get, url, **kwargs)
+
+    wait(futuros.values(), timeout=timeout_total)
+
+    resultados = {}
+    for nome, futuro in futuros.items():
+        if not futuro.done():
+            futuro.cancel()
+            resultados[nome] = requests.Timeout(f"Tempo esgotado ao buscar '{nome}'")
+        elif futuro.exception() is not None:
+            resultados[nome] = futuro.exception()
+        else:
+            resultados[nome] = futuro.result()
+    return resultados
+
 # Configurar Django
 if not settings.configured:
     settings.configure(
@@ -157,6 +219,39 @@ if not settings.configured:
     
     django.setup()
 
+# ============================================
+# REGISTRO DE TEMPLATES COMPILADOS
+# ============================================
+
+_templates_compilados = {}
+
+def obter_template(fonte):
+    """
+    Retorna o Template compilado para o código-fonte embutido (ex.: DASHBOARD_TEMPLATE).
+    Cada template é compilado uma única vez por processo e reutilizado nas
+    requisições seguintes.
+    """
+    template = _templates_compilados.get(fonte)
+    if template is None:
+        from django.template import Template
+        template = Template(fonte)
+        _templates_compilados[fonte] = template
+    return template
+
+def aquecer_templates():
+    """Pré-compila todos os *_TEMPLATE do módulo (usado na inicialização do servidor)."""
+    import time
+    inicio = time.perf_counter()
+    total = 0
+    for nome, valor in list(globals().items()):
+        if nome.endswith('_TEMPLATE') and isinstance(valor, str):
+            try:
+                obter_template(valor)
+                total += 1
+            except Exception as e:
+                print(f"⚠️  Falha ao compilar {nome}: {e}")
+    print(f"✓ {total} templates compilados em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
 # ============================================
 # TEMPLATES HTML
 # ============================================
@@ -6374,7 +6469,7 @@ BACKUP_TEMPLATE = """
                 </p>
                 <form class="restore-form" method="POST" enctype="multipart/form-data" onsubmit="handleRestoreSubmit(event)">
                     {% csrf_token %}
-                    <input type="file" name="backup_file" id="backup_file" accept=".json" required>
+                    <input type="file" name="backup_file" id="backup_file" accept=".tar,.json" required>
                     <button type="submit" class="btn btn-upload">Restaurar Dados do Arquivo</button>
                 </form>
             </div>
@@ -6422,7 +6517,7 @@ BACKUP_TEMPLATE = """
                 
                 const blob = await response.blob();
                 const contentDisposition = response.headers.get('content-disposition');
-                let filename = 'backup.json';
+                let filename = 'backup.tar';
                 if (contentDisposition) {
                     const filenameMatch = contentDisposition.match(/filename="(.+)"/);
                     if (filenameMatch && filenameMatch.length > 1) {
@@ -6655,7 +6750,7 @@ def login_view(request):
         remember = request.POST.get('remember')
         
         try:
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/login',
                 json={'email': email, 'password': password},
                 timeout=10
@@ -6691,9 +6786,9 @@ def login_view(request):
         except requests.exceptions.RequestException as e:
             messages.error(request, f'Erro: Não foi possível conectar ao servidor backend. ({e})')
     
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     
-    template = Template(LOGIN_TEMPLATE)
+    template = obter_template(LOGIN_TEMPLATE)
     context = RequestContext(request, {
         'messages': messages.get_messages(request),
         'debug': Config.DEBUG,
@@ -6718,7 +6813,7 @@ def definir_senha_view(request):
             'confirmacao_nova_senha': request.POST.get('confirmacao_nova_senha'),
         }
         try:
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/definir-nova-senha/',
                 json=payload,
                 timeout=10
@@ -6733,8 +6828,8 @@ def definir_senha_view(request):
         except requests.exceptions.RequestException:
             messages.error(request, "Erro de conexão ao tentar alterar a senha.")
 
-    from django.template import Template, RequestContext
-    template = Template(DEFINIR_SENHA_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(DEFINIR_SENHA_TEMPLATE)
     context = RequestContext(request, {
         'email': email,
         'messages': messages.get_messages(request)
@@ -6746,7 +6841,7 @@ def esqueci_senha_view(request):
     if request.method == 'POST':
         email = request.POST.get('email')
         try:
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/esqueci-senha/',
                 json={'email': email},
                 timeout=10
@@ -6760,8 +6855,8 @@ def esqueci_senha_view(request):
         except requests.exceptions.RequestException:
             messages.error(request, "Erro de conexão ao tentar recuperar a senha.")
 
-    from django.template import Template, RequestContext
-    template = Template(ESQUECI_SENHA_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(ESQUECI_SENHA_TEMPLATE)
     context = RequestContext(request, {'messages': messages.get_messages(request)})
     return HttpResponse(template.render(context))
 
@@ -6810,7 +6905,7 @@ def dashboard_view(request):
     }
     
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/dashboard/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -6835,8 +6930,8 @@ def dashboard_view(request):
     except Exception as e:
         context['error_message'] = f"Ocorreu um erro inesperado: {e}"
     
-    from django.template import Template, RequestContext
-    template = Template(DASHBOARD_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(DASHBOARD_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -6869,7 +6964,7 @@ def pacientes_view(request):
     pagination = {}
     
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/',
             headers={'Authorization': f'Bearer {token}'},
             params={'page': page},
@@ -6969,10 +7064,10 @@ def pacientes_view(request):
 
     pacientes_html = "".join(html_parts)
     
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     from django.utils.safestring import mark_safe
     
-    template = Template(PACIENTES_TEMPLATE)
+    template = obter_template(PACIENTES_TEMPLATE)
     context = RequestContext(request, {
         'user': user,
         'pacientes_html': mark_safe(pacientes_html),
@@ -7037,7 +7132,7 @@ def novo_paciente_view(request):
             print(f"Token: {token[:50]}...")
             print(f"Dados enviados: {dados_paciente}")
             
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/pacientes/',
                 headers={'Authorization': f'Bearer {token}'},
                 json=dados_paciente,
@@ -7062,9 +7157,9 @@ def novo_paciente_view(request):
             messages.error(request, f'Erro inesperado: {str(e)}')
             print(f"❌ Exception: {e}")
 
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     
-    template = Template(NOVO_PACIENTE_TEMPLATE)
+    template = obter_template(NOVO_PACIENTE_TEMPLATE)
     context = RequestContext(request, {
         'user': user,
         'messages': messages.get_messages(request)
@@ -7080,7 +7175,7 @@ def paciente_deletar_view(request, paciente_id):
     token = request.session.get('token')
     
     try:
-        response = requests.delete(
+        response = backend_http.delete(
             f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -7118,7 +7213,7 @@ def paciente_visualizar_view(request, paciente_id):
     # --- FIM DA ALTERAÇÃO ---
 
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/completo/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -7138,8 +7233,8 @@ def paciente_visualizar_view(request, paciente_id):
         
         data['user'] = user
 
-        from django.template import Template, RequestContext
-        template = Template(PACIENTE_VISUALIZAR_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(PACIENTE_VISUALIZAR_TEMPLATE)
         context = RequestContext(request, data)
         return HttpResponse(template.render(context))
 
@@ -7194,7 +7289,7 @@ def paciente_editar_view(request, paciente_id):
         }
         
         try:
-            response = requests.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=dados_paciente)
+            response = backend_http.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=dados_paciente)
             response.raise_for_status()
             
             messages.success(request, 'Paciente atualizado com sucesso!')
@@ -7207,13 +7302,13 @@ def paciente_editar_view(request, paciente_id):
         return redirect('paciente_editar', paciente_id=paciente_id)
 
     try:
-        response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'})
+        response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'})
         response.raise_for_status()
         
         paciente = response.json()
         
-        from django.template import Template, RequestContext
-        template = Template(EDITAR_PACIENTE_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(EDITAR_PACIENTE_TEMPLATE)
         context = RequestContext(request, {
             'paciente': paciente,
             'user': user  # Passa o usuário para o template
@@ -7250,14 +7345,14 @@ def pacientes_inativos_view(request):
     # --- FIM DA ALTERAÇÃO ---
 
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/inativos/',
             headers={'Authorization': f'Bearer {token}'}
         )
         inativos = response.json() if response.status_code == 200 else []
         
-        from django.template import Template, RequestContext
-        template = Template(INATIVOS_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(INATIVOS_TEMPLATE)
         context = RequestContext(request, {'inativos': inativos, 'user': user})
         return HttpResponse(template.render(context))
         
@@ -7273,7 +7368,7 @@ def paciente_reativar_view(request, paciente_id):
         
     token = request.session.get('token')
     try:
-        response = requests.post(
+        response = backend_http.post(
             f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/reativar/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -7301,8 +7396,8 @@ def placeholder_view(request, page_title="Em Desenvolvimento"):
     if user.get('funcao') == 'medico' and not user.get('nome_completo', '').startswith('Dr.'):
         user['nome_completo'] = f"Dr. {user.get('nome_completo', '')}"
     
-    from django.template import Template, RequestContext
-    template = Template(PLACEHOLDER_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(PLACEHOLDER_TEMPLATE)
     context = RequestContext(request, {'page_title': page_title, 'user': user})
     return HttpResponse(template.render(context))
 
@@ -7330,7 +7425,7 @@ def paciente_historico_view(request, paciente_id):
     }
 
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/historico_completo/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=15
@@ -7345,8 +7440,8 @@ def paciente_historico_view(request, paciente_id):
     except Exception as e:
         context['error_message'] = f"Ocorreu um erro inesperado: {e}"
 
-    from django.template import Template, RequestContext
-    template = Template(HISTORICO_PACIENTE_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(HISTORICO_PACIENTE_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -7387,7 +7482,7 @@ def paciente_exames_view(request, paciente_id):
                 "resultado_original": request.POST.get("resultado"),
                 "status": "finalizado"
             }
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/exames/',
                 headers={'Authorization': f'Bearer {token}'},
                 json=payload
@@ -7405,11 +7500,11 @@ def paciente_exames_view(request, paciente_id):
         return redirect('paciente_exames', paciente_id=paciente_id)
 
     try:
-        paciente_response = requests.get(f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/', headers={'Authorization': f'Bearer {token}'})
+        paciente_response = backend_http.get(f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/', headers={'Authorization': f'Bearer {token}'})
         paciente_response.raise_for_status()
         context['paciente'] = paciente_response.json()
 
-        exames_response = requests.get(f'{Config.BACKEND_URL}/api/exames/?paciente_id={paciente_id}&page_size=100', headers={'Authorization': f'Bearer {token}'})
+        exames_response = backend_http.get(f'{Config.BACKEND_URL}/api/exames/?paciente_id={paciente_id}&page_size=100', headers={'Authorization': f'Bearer {token}'})
         exames_response.raise_for_status()
         todos_exames = exames_response.json().get('results', [])
 
@@ -7430,15 +7525,15 @@ def paciente_exames_view(request, paciente_id):
     except Exception as e:
         context['error_message'] = f"Erro ao carregar dados do paciente ou exames: {e}"
 
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     context['messages'] = messages.get_messages(request)
     
     # --- LÓGICA DE PERMISSÃO ATUALIZADA ---
     # Se o usuário for APENAS secretária, mostra a view restrita
     if 'secretaria' in funcoes_usuario and not any(f in funcoes_usuario for f in ['medico', 'admin']):
-        template = Template(PACIENTE_EXAMES_SECRETARIA_TEMPLATE)
+        template = obter_template(PACIENTE_EXAMES_SECRETARIA_TEMPLATE)
     else:
-        template = Template(PACIENTE_EXAMES_TEMPLATE)
+        template = obter_template(PACIENTE_EXAMES_TEMPLATE)
     # --- FIM DA ATUALIZAÇÃO ---
         
     ctx = RequestContext(request, context)
@@ -7511,7 +7606,7 @@ def agendamentos_view(request):
             params['ano'] = filter_date.year
         
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/agendamentos/',
             headers={'Authorization': f'Bearer {token}'},
             params=params
@@ -7599,9 +7694,9 @@ def agendamentos_view(request):
         messages.error(request, f"Erro ao buscar agendamentos: {e}")
         agendamentos_html = "<p style='text-align:center; padding: 20px;'>Erro ao carregar agendamentos.</p>"
 
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     from django.utils.safestring import mark_safe
-    template = Template(AGENDAMENTOS_TEMPLATE)
+    template = obter_template(AGENDAMENTOS_TEMPLATE)
     context = RequestContext(request, {
         'user': user,
         'agendamentos_html': mark_safe(agendamentos_html),
@@ -7630,7 +7725,7 @@ def agendamento_visualizar_view(request, agendamento_id):
     try:
         # 1. Buscar os dados do agendamento específico
         agendamento_url = f'{Config.BACKEND_URL}/api/agendamentos/{agendamento_id}/'
-        response = requests.get(agendamento_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
+        response = backend_http.get(agendamento_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
         response.raise_for_status()
         agendamento_data = response.json()
 
@@ -7638,13 +7733,13 @@ def agendamento_visualizar_view(request, agendamento_id):
         paciente_id = agendamento_data.get('paciente')
         if paciente_id:
             paciente_url = f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/'
-            pac_response = requests.get(paciente_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
+            pac_response = backend_http.get(paciente_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
             if pac_response.status_code == 200:
                 # Adiciona os detalhes do paciente ao dicionário do agendamento
                 agendamento_data['paciente_detalhes'] = pac_response.json()
 
-        from django.template import Template, RequestContext
-        template = Template(AGENDAMENTO_VISUALIZAR_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(AGENDAMENTO_VISUALIZAR_TEMPLATE)
         context = RequestContext(request, {
             'user': user,
             'agendamento': agendamento_data,
@@ -7682,11 +7777,11 @@ def agendamento_form_view(request, agendamento_id=None):
     pacientes = []
     medicos = []
     try:
-        pac_res = requests.get(f'{Config.BACKEND_URL}/api/pacientes/?page_size=1000', headers={'Authorization': f'Bearer {token}'})
+        pac_res = backend_http.get(f'{Config.BACKEND_URL}/api/pacientes/?page_size=1000', headers={'Authorization': f'Bearer {token}'})
         if pac_res.status_code == 200:
             pacientes = pac_res.json().get('results', pac_res.json())
 
-        med_res = requests.get(f'{Config.BACKEND_URL}/api/medicos/', headers={'Authorization': f'Bearer {token}'})
+        med_res = backend_http.get(f'{Config.BACKEND_URL}/api/medicos/', headers={'Authorization': f'Bearer {token}'})
         if med_res.status_code == 200:
             medicos = med_res.json()
 
@@ -7696,14 +7791,14 @@ def agendamento_form_view(request, agendamento_id=None):
     agendamento_data = {}
     form_title = "Novo Agendamento"
     api_url = f'{Config.BACKEND_URL}/api/agendamentos/'
-    http_method = requests.post
+    http_method = backend_http.post
 
     if agendamento_id:
         form_title = "Editar Agendamento"
         api_url = f'{Config.BACKEND_URL}/api/agendamentos/{agendamento_id}/'
-        http_method = requests.put
+        http_method = backend_http.put
         try:
-            response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'})
+            response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'})
             if response.status_code == 200:
                 agendamento_data = response.json()
         except Exception as e:
@@ -7758,8 +7853,8 @@ def agendamento_form_view(request, agendamento_id=None):
                 'observacoes': request.POST.get('observacoes'),
             }
 
-            from django.template import Template, RequestContext
-            template = Template(AGENDAMENTO_FORM_TEMPLATE)
+            from django.template import RequestContext
+            template = obter_template(AGENDAMENTO_FORM_TEMPLATE)
             context = RequestContext(request, {
                 'form_title': form_title,
                 'pacientes': pacientes,
@@ -7772,8 +7867,8 @@ def agendamento_form_view(request, agendamento_id=None):
         except Exception as e:
             messages.error(request, f"Erro ao salvar agendamento: {e}")
 
-    from django.template import Template, RequestContext
-    template = Template(AGENDAMENTO_FORM_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(AGENDAMENTO_FORM_TEMPLATE)
     context = RequestContext(request, {
         'form_title': form_title,
         'pacientes': pacientes,
@@ -7792,7 +7887,7 @@ def agendamento_deletar_view(request, agendamento_id):
     
     try:
         # A URL agora aponta para o endpoint padrão de DELETE
-        response = requests.delete(
+        response = backend_http.delete(
             f'{Config.BACKEND_URL}/api/agendamentos/{agendamento_id}/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -7822,8 +7917,8 @@ def faturamento_view(request):
     # --- LÓGICA DE PERMISSÃO APLICADA AQUI ---
     # Verifica se o usuário NÃO é nem admin NEM secretária.
     if not any(f in funcoes_usuario for f in ['admin', 'secretaria']):
-        from django.template import Template, RequestContext
-        template = Template(EXAMES_ACCESS_DENIED_TEMPLATE) # Reutiliza o template de acesso negado
+        from django.template import RequestContext
+        template = obter_template(EXAMES_ACCESS_DENIED_TEMPLATE) # Reutiliza o template de acesso negado
         context = RequestContext(request, {
             'user': user,
             'error_message': f"Seu perfil de '{user.get('funcao_display')}' não tem permissão para acessar o módulo de Faturamento."
@@ -7887,8 +7982,20 @@ def faturamento_view(request):
     agendamentos_pendentes = []
     csrf_token = get_token(request)
 
+    headers = {'Authorization': f'Bearer {token}'}
+    respostas = buscar_em_paralelo({
+        'dashboard': (f'{Config.BACKEND_URL}/api/faturamento/dashboard/', {'headers': headers, 'params': params}),
+        'receitas': (f'{Config.BACKEND_URL}/api/faturamento/receitas/', {'headers': headers, 'params': params}),
+        'despesas': (f'{Config.BACKEND_URL}/api/faturamento/despesas/', {'headers': headers, 'params': params}),
+        'pendentes': (f'{Config.BACKEND_URL}/api/faturamento/receitas/agendamentos_pendentes/', {'headers': headers}),
+    })
+
     try:
-        dash_response = requests.get(f'{Config.BACKEND_URL}/api/faturamento/dashboard/', headers={'Authorization': f'Bearer {token}'}, params=params)
+        for resposta in respostas.values():
+            if isinstance(resposta, Exception):
+                raise resposta
+
+        dash_response = respostas['dashboard']
         if dash_response.status_code == 200:
             dashboard_data_raw = dash_response.json()
             dashboard_data = {
@@ -7917,13 +8024,13 @@ def faturamento_view(request):
                 'total_saldo_caixa_formatado': format_currency_brl(dashboard_data_raw.get('total_saldo_caixa', 0))
             }
 
-        rec_response = requests.get(f'{Config.BACKEND_URL}/api/faturamento/receitas/', headers={'Authorization': f'Bearer {token}'}, params=params)
+        rec_response = respostas['receitas']
         if rec_response.status_code == 200: receitas = rec_response.json().get('results', rec_response.json())
 
-        desp_response = requests.get(f'{Config.BACKEND_URL}/api/faturamento/despesas/', headers={'Authorization': f'Bearer {token}'}, params=params)
+        desp_response = respostas['despesas']
         if desp_response.status_code == 200: despesas = desp_response.json().get('results', desp_response.json())
         
-        pendentes_response = requests.get(f'{Config.BACKEND_URL}/api/faturamento/receitas/agendamentos_pendentes/', headers={'Authorization': f'Bearer {token}'})
+        pendentes_response = respostas['pendentes']
         if pendentes_response.status_code == 200:
             agendamentos_pendentes = pendentes_response.json().get('agendamentos', [])
 
@@ -8008,9 +8115,9 @@ def faturamento_view(request):
         </tr>
         """)
 
-    from django.template import Template, RequestContext
+    from django.template import RequestContext
     from django.utils.safestring import mark_safe
-    template = Template(FATURAMENTO_TEMPLATE)
+    template = obter_template(FATURAMENTO_TEMPLATE)
     context = RequestContext(request, {
         'user': user,
         'dashboard_data': dashboard_data,
@@ -8043,8 +8150,8 @@ def informacoes_view(request):
         user['nome_completo'] = f"Dr. {user.get('nome_completo', '')}"
     
     if 'admin' not in funcoes_usuario:
-        from django.template import Template, RequestContext
-        template = Template(EXAMES_ACCESS_DENIED_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(EXAMES_ACCESS_DENIED_TEMPLATE)
         context = RequestContext(request, { 'user': user, 'error_message': f"Seu perfil de '{user.get('funcao_display')}' não tem permissão para acessar o módulo de Informações." })
         return HttpResponse(template.render(context))
 
@@ -8059,7 +8166,7 @@ def informacoes_view(request):
                 'alerta_laudo_ia': int(request.POST.get('alerta_laudo_ia')),
                 'alerta_documento_ia': int(request.POST.get('alerta_documento_ia')),
             }
-            response = requests.patch(
+            response = backend_http.patch(
                 f'{Config.BACKEND_URL}/api/clinicas/{clinica_id}/',
                 headers={'Authorization': f'Bearer {token}'},
                 json=payload
@@ -8069,7 +8176,8 @@ def informacoes_view(request):
         except Exception as e:
             messages.error(request, f"Erro ao salvar alertas: {e}")
         
-        return redirect('informacoes')
+        # Recarrega sem o cache do painel para exibir os alertas recém-salvos
+        return HttpResponseRedirect(f"{reverse('informacoes')}?atualizar=1")
 
     from datetime import datetime
     current_year = datetime.now().year
@@ -8096,29 +8204,45 @@ def informacoes_view(request):
         'opcoes_alerta': opcoes_alerta # <<< Adicionado ao contexto
     }
 
+    # Todas as seções da página em uma única requisição ao backend (/api/painel/)
+    secoes = ['dados_clinica', 'pacientes_inativos', 'auditoria_recente', 'auditoria_financeira', 'medicos']
+    params = {'mes': selected_mes, 'ano': selected_ano}
+    if selected_medico_id:
+        secoes.append('estatisticas_medico')
+        params.update({'medico_id': selected_medico_id, 'periodo': selected_periodo_stats})
+    params['secoes'] = ','.join(secoes)
+    if request.GET.get('atualizar') == '1':
+        params['atualizar'] = '1'
+
     try:
-        response_dados = requests.get(f'{Config.BACKEND_URL}/api/dados-clinica/', headers={'Authorization': f'Bearer {token}'}, timeout=15)
-        response_dados.raise_for_status()
-        context['data'] = response_dados.json()
+        response_painel = backend_http.get(
+            f'{Config.BACKEND_URL}/api/painel/',
+            headers={'Authorization': f'Bearer {token}'},
+            params=params,
+            timeout=20
+        )
+        response_painel.raise_for_status()
+        painel = response_painel.json().get('secoes', {})
+
+        def secao(nome):
+            item = painel.get(nome) or {}
+            return item.get('status'), item.get('dados')
+
+        status_dados, dados = secao('dados_clinica')
+        if status_dados != 200:
+            raise requests.exceptions.HTTPError(f"{status_dados} ao carregar dados da clínica: {(dados or {}).get('erro', '') if isinstance(dados, dict) else ''}")
+        context['data'] = dados
 
-        response_inativos = requests.get(f'{Config.BACKEND_URL}/api/pacientes/inativos/', headers={'Authorization': f'Bearer {token}'}, timeout=10)
-        if response_inativos.status_code == 200: context['total_inativos'] = len(response_inativos.json())
+        status_inativos, inativos = secao('pacientes_inativos')
+        if status_inativos == 200: context['total_inativos'] = len(inativos)
 
-        response_auditoria = requests.get(f'{Config.BACKEND_URL}/api/auditoria/recente/', headers={'Authorization': f'Bearer {token}'}, timeout=15)
-        if response_auditoria.status_code == 200:
-            todos_eventos = response_auditoria.json()
+        status_auditoria, todos_eventos = secao('auditoria_recente')
+        if status_auditoria == 200:
             context['log_exames'] = [e for e in todos_eventos if 'Exame' in e['tipo_evento']]
             context['log_documentos'] = [e for e in todos_eventos if 'Documento' in e['tipo_evento']]
         
-        params_financeiro = {'mes': selected_mes, 'ano': selected_ano}
-        response_financeiro = requests.get(
-            f'{Config.BACKEND_URL}/api/auditoria/financeira/',
-            headers={'Authorization': f'Bearer {token}'},
-            params=params_financeiro,
-            timeout=15
-        )
-        if response_financeiro.status_code == 200:
-            dados_financeiros = response_financeiro.json()
+        status_financeiro, dados_financeiros = secao('auditoria_financeira')
+        if status_financeiro == 200:
             log_financeiro_processado = []
             for log in dados_financeiros.get('auditoria', []):
                 valor = log.get('valor', 0.0)
@@ -8128,28 +8252,23 @@ def informacoes_view(request):
                 log_financeiro_processado.append(log)
             context['log_financeiro'] = log_financeiro_processado
 
-        med_res = requests.get(f'{Config.BACKEND_URL}/api/medicos/', headers={'Authorization': f'Bearer {token}'})
-        if med_res.status_code == 200: context['medicos'] = med_res.json()
+        status_medicos, medicos = secao('medicos')
+        if status_medicos == 200: context['medicos'] = medicos
 
         if selected_medico_id:
-            params_stats = {'medico_id': selected_medico_id, 'periodo': selected_periodo_stats}
-            stats_res = requests.get(
-                f'{Config.BACKEND_URL}/api/estatisticas/medico/',
-                headers={'Authorization': f'Bearer {token}'},
-                params=params_stats
-            )
-            if stats_res.status_code == 200:
-                context['stats_medico'] = stats_res.json()
+            status_stats, stats = secao('estatisticas_medico')
+            if status_stats == 200:
+                context['stats_medico'] = stats
             else:
-                context['error_message'] = (context['error_message'] or "") + " Erro ao buscar estatísticas do médico: " + stats_res.json().get('erro', '')
+                context['error_message'] = (context['error_message'] or "") + " Erro ao buscar estatísticas do médico: " + (stats or {}).get('erro', '')
 
     except requests.exceptions.RequestException as e:
         context['error_message'] = f"Erro de comunicação: {e}"
     except Exception as e:
         context['error_message'] = f"Ocorreu um erro inesperado: {e}"
         
-    from django.template import Template, RequestContext
-    template = Template(INFORMACOES_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(INFORMACOES_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -8169,16 +8288,16 @@ def exames_view(request):
 
     if 'secretaria' in funcoes_usuario and not any(f in funcoes_usuario for f in ['medico', 'admin']):
     # --- FIM DA ALTERAÇÃO ---
-        from django.template import Template, RequestContext
-        template = Template(EXAMES_ACCESS_DENIED_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(EXAMES_ACCESS_DENIED_TEMPLATE)
         context = RequestContext(request, {
             'user': user,
             'error_message': f"Seu perfil de '{user.get('funcao_display')}' não tem permissão para acessar o módulo de Análise de Exames por iA."
         })
         return HttpResponse(template.render(context))
 
-    from django.template import Template, RequestContext
-    template = Template(EXAMES_IA_TERMOS_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(EXAMES_IA_TERMOS_TEMPLATE)
     context = RequestContext(request, {'user': user})
     return HttpResponse(template.render(context))
 
@@ -8213,11 +8332,11 @@ def exame_visualizar_view(request, exame_id):
             return redirect('exame_visualizar', exame_id=exame_id)
         
         try:
-            get_response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'})
+            get_response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'})
             get_response.raise_for_status()
             exame_data = get_response.json()
             exame_data['interpretacao_ia'] = laudo_editado
-            put_response = requests.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=exame_data)
+            put_response = backend_http.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=exame_data)
             put_response.raise_for_status()
             messages.success(request, "Laudo atualizado com sucesso!")
             # Mantém o paciente_id na URL ao redirecionar
@@ -8231,7 +8350,7 @@ def exame_visualizar_view(request, exame_id):
 
     # Lógica GET
     try:
-        response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
+        response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
         response.raise_for_status()
         
         exame_data = response.json()
@@ -8246,8 +8365,8 @@ def exame_visualizar_view(request, exame_id):
     except Exception as e:
         context['error_message'] = f'Erro ao carregar dados do exame: {str(e)}'
     
-    from django.template import Template, RequestContext
-    template = Template(EXAME_VISUALIZAR_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(EXAME_VISUALIZAR_TEMPLATE)
     context['messages'] = messages.get_messages(request)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
@@ -8268,7 +8387,7 @@ def exame_geral_visualizar_view(request, paciente_id, exame_id):
 
     try:
         # Busca o exame específico. Usamos o serializer completo (não o de lista)
-        exame_response = requests.get(
+        exame_response = backend_http.get(
             f'{Config.BACKEND_URL}/api/exames/{exame_id}/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -8285,7 +8404,7 @@ def exame_geral_visualizar_view(request, paciente_id, exame_id):
         context['exame'] = exame_data
         
         # Busca os dados do paciente para o link de "Voltar"
-        paciente_response = requests.get(
+        paciente_response = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/{paciente_id}/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -8295,8 +8414,8 @@ def exame_geral_visualizar_view(request, paciente_id, exame_id):
     except Exception as e:
         context['error_message'] = f"Erro ao carregar dados: {e}"
 
-    from django.template import Template, RequestContext
-    template = Template(EXAME_GERAL_VISUALIZAR_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(EXAME_GERAL_VISUALIZAR_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -8316,7 +8435,7 @@ def exame_geral_editar_view(request, paciente_id, exame_id):
                 "data_exame": request.POST.get("data_exame"),
                 "resultado_original": request.POST.get("resultado_original"),
             }
-            response = requests.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=payload)
+            response = backend_http.put(api_url, headers={'Authorization': f'Bearer {token}'}, json=payload)
             response.raise_for_status()
             messages.success(request, "Exame geral atualizado com sucesso!")
             return redirect('paciente_exames', paciente_id=paciente_id)
@@ -8326,12 +8445,12 @@ def exame_geral_editar_view(request, paciente_id, exame_id):
 
     # Lógica GET
     try:
-        response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'})
+        response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'})
         response.raise_for_status()
         exame_data = response.json()
         
-        from django.template import Template, RequestContext
-        template = Template(EXAME_GERAL_EDITAR_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(EXAME_GERAL_EDITAR_TEMPLATE)
         context = RequestContext(request, {'exame': exame_data})
         return HttpResponse(template.render(context))
     except Exception as e:
@@ -8345,7 +8464,7 @@ def exame_geral_deletar_view(request, paciente_id, exame_id):
         return redirect('login')
     
     try:
-        response = requests.delete(
+        response = backend_http.delete(
             f'{Config.BACKEND_URL}/api/exames/{exame_id}/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -8363,7 +8482,7 @@ def exame_deletar_view(request, exame_id):
         return redirect('login')
     
     try:
-        response = requests.delete(
+        response = backend_http.delete(
             f'{Config.BACKEND_URL}/api/exames/{exame_id}/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -8428,7 +8547,7 @@ def exames_analise_view(request):
                     'Authorization': f'Bearer {token}'
                 }
                 
-                response = requests.post(
+                response = backend_http.post(
                     f'{Config.BACKEND_URL}/api/exames/upload-ia/',
                     headers=headers,
                     data=data,
@@ -8466,7 +8585,7 @@ def exames_analise_view(request):
 
     # --- LÓGICA GET ---
     try:
-        pac_res = requests.get(
+        pac_res = backend_http.get(
             f'{Config.BACKEND_URL}/api/pacientes/?page_size=1000', 
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -8480,7 +8599,7 @@ def exames_analise_view(request):
 
     try:
         params = {'interpretado_ia': 'true'}
-        exames_res = requests.get(
+        exames_res = backend_http.get(
             f'{Config.BACKEND_URL}/api/exames/', 
             headers={'Authorization': f'Bearer {token}'},
             params=params,
@@ -8494,8 +8613,8 @@ def exames_analise_view(request):
     except Exception as e:
         print(f"⚠️ Erro ao carregar histórico de exames: {e}")
 
-    from django.template import Template, RequestContext
-    template = Template(EXAMES_IA_PRINCIPAL_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(EXAMES_IA_PRINCIPAL_TEMPLATE)
     context['messages'] = messages.get_messages(request)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
@@ -8518,7 +8637,7 @@ def receber_agendamento_view(request, agendamento_id):
         }
         
         try:
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/faturamento/receitas/receber_de_agendamento/',
                 headers={'Authorization': f'Bearer {token}'},
                 json=payload
@@ -8576,22 +8695,22 @@ def lancamento_form_view(request, tipo_lancamento, lancamento_id=None):
 
     categorias = []
     try:
-        cat_res = requests.get(api_categorias_url, headers={'Authorization': f'Bearer {token}'})
+        cat_res = backend_http.get(api_categorias_url, headers={'Authorization': f'Bearer {token}'})
         if cat_res.status_code == 200:
             categorias = cat_res.json().get('results', cat_res.json())
     except Exception as e:
         messages.error(request, f"Erro ao carregar categorias: {e}")
 
     lancamento_data = {}
-    http_method = requests.post
+    http_method = backend_http.post
     api_url = api_base_url
 
     if lancamento_id:
         form_title = f"Editar {tipo_lancamento.capitalize()}"
         api_url = f'{api_base_url}{lancamento_id}/'
-        http_method = requests.put
+        http_method = backend_http.put
         try:
-            response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'})
+            response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'})
             if response.status_code == 200:
                 lancamento_data = response.json()
         except Exception as e:
@@ -8630,8 +8749,8 @@ def lancamento_form_view(request, tipo_lancamento, lancamento_id=None):
         except Exception as e:
             messages.error(request, f"Erro ao salvar: {e}")
 
-    from django.template import Template, RequestContext
-    template = Template(LANCAMENTO_FORM_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(LANCAMENTO_FORM_TEMPLATE)
     context = RequestContext(request, {
         'form_title': form_title,
         'tipo_lancamento': tipo_lancamento,
@@ -8658,12 +8777,12 @@ def lancamento_visualizar_view(request, tipo_lancamento, lancamento_id):
         api_url = f'{Config.BACKEND_URL}/api/faturamento/despesas/{lancamento_id}/'
 
     try:
-        response = requests.get(api_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
+        response = backend_http.get(api_url, headers={'Authorization': f'Bearer {token}'}, timeout=10)
         response.raise_for_status()
         lancamento_data = response.json()
 
-        from django.template import Template, RequestContext
-        template = Template(LANCAMENTO_VISUALIZAR_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(LANCAMENTO_VISUALIZAR_TEMPLATE)
         context = RequestContext(request, {
             'user': user,
             'lancamento': lancamento_data,
@@ -8687,7 +8806,7 @@ def lancamento_deletar_view(request, tipo_lancamento, lancamento_id):
         api_url = f'{Config.BACKEND_URL}/api/faturamento/despesas/{lancamento_id}/'
 
     try:
-        response = requests.delete(api_url, headers={'Authorization': f'Bearer {token}'})
+        response = backend_http.delete(api_url, headers={'Authorization': f'Bearer {token}'})
         response.raise_for_status()
         messages.success(request, f"{tipo_lancamento.capitalize()} excluída com sucesso.")
     except Exception as e:
@@ -8707,7 +8826,7 @@ def setup_categorias_view(request):
 
     if token:
         try:
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/setup/',
                 headers={'Authorization': f'Bearer {token}'},
                 timeout=10
@@ -8734,8 +8853,8 @@ def setup_categorias_view(request):
                 'status': 'error'
             }
     
-    from django.template import Template, RequestContext
-    template = Template(SETUP_RESULTADO_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(SETUP_RESULTADO_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -8765,15 +8884,15 @@ def consultas_view(request):
             'is_permission_error': True,
             'error_message': f"Seu perfil de '{user.get('funcao_display')}' não tem permissão para acessar o módulo de Consultas."
         }
-        from django.template import Template, RequestContext
-        template = Template(CONSULTAS_TEMPLATE)
+        from django.template import RequestContext
+        template = obter_template(CONSULTAS_TEMPLATE)
         ctx = RequestContext(request, context)
         return HttpResponse(template.render(ctx))
 
     context = { 'user': user, 'data': {}, 'error_message': None, 'is_permission_error': False }
 
     try:
-        response = requests.get(
+        response = backend_http.get(
             f'{Config.BACKEND_URL}/api/consultas/fila-hoje/',
             headers={'Authorization': f'Bearer {token}'},
             timeout=10
@@ -8792,8 +8911,8 @@ def consultas_view(request):
     except requests.exceptions.RequestException as e:
         context['error_message'] = f"Erro de conexão ao carregar a fila de atendimento: {e}"
 
-    from django.template import Template, RequestContext
-    template = Template(CONSULTAS_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(CONSULTAS_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -8805,7 +8924,7 @@ def iniciar_consulta_view(request, agendamento_id):
 
     if request.method == 'POST':
         try:
-            agendamento_response = requests.get(
+            agendamento_response = backend_http.get(
                 f'{Config.BACKEND_URL}/api/agendamentos/{agendamento_id}/',
                 headers={'Authorization': f'Bearer {token}'}
             )
@@ -8821,7 +8940,7 @@ def iniciar_consulta_view(request, agendamento_id):
                 "data_consulta": data_hora_agendamento,
                 "tipo_consulta": "primeira_consulta"
             }
-            response = requests.post(
+            response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/consultas/',
                 headers={'Authorization': f'Bearer {token}'},
                 json=payload,
@@ -8834,7 +8953,7 @@ def iniciar_consulta_view(request, agendamento_id):
                 consulta_criada = response.json()
                 consulta_id = consulta_criada.get('id')
             elif response.status_code == 400:
-                consulta_response = requests.get(
+                consulta_response = backend_http.get(
                     f'{Config.BACKEND_URL}/api/consultas/?agendamento={agendamento_id}', 
                     headers={'Authorization': f'Bearer {token}'}
                 )
@@ -8850,7 +8969,7 @@ def iniciar_consulta_view(request, agendamento_id):
             if not consulta_id:
                 raise Exception("Não foi possível obter o ID da consulta.")
 
-            iniciar_response = requests.post(
+            iniciar_response = backend_http.post(
                 f'{Config.BACKEND_URL}/api/consultas/{consulta_id}/iniciar-atendimento/',
                 headers={'Authorization': f'Bearer {token}'}
             )
@@ -8897,7 +9016,7 @@ def workspace_view(request, consulta_id):
 
     try:
         # 1. Busca os dados principais da consulta
-        response_consulta = requests.get(
+        response_consulta = backend_http.get(
             f'{Config.BACKEND_URL}/api/consultas/{consulta_id}/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -8905,7 +9024,7 @@ def workspace_view(request, consulta_id):
         context['consulta'] = response_consulta.json()
 
         # 2. Busca a lista de documentos já salvos
-        response_docs = requests.get(
+        response_docs = backend_http.get(
             f'{Config.BACKEND_URL}/api/consultas/{consulta_id}/documentos/',
             headers={'Authorization': f'Bearer {token}'}
         )
@@ -8915,8 +9034,8 @@ def workspace_view(request, consulta_id):
     except Exception as e:
         context['error_message'] = f"Erro ao carregar dados da consulta: {e}"
 
-    from django.template import Template, RequestContext
-    template = Template(WORKSPACE_CONSULTA_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(WORKSPACE_CONSULTA_TEMPLATE)
     ctx = RequestContext(request, context)
     return HttpResponse(template.render(ctx))
 
@@ -8944,7 +9063,7 @@ def backup_view(request):
         if 'backup_file' in request.FILES:
             files = {'backup_file': request.FILES['backup_file']}
             try:
-                response = requests.post(
+                response = backend_http.post(
                     f'{Config.BACKEND_URL}/api/backup/restaurar/',
                     headers={'Authorization': f'Bearer {token}'},
                     files=files,
@@ -8963,7 +9082,7 @@ def backup_view(request):
                 'email_notificacao': request.POST.get('email_notificacao')
             }
             try:
-                response = requests.post(
+                response = backend_http.post(
                     config_api_url,
                     headers={'Authorization': f'Bearer {token}'},
                     json=payload
@@ -8979,14 +9098,14 @@ def backup_view(request):
 
     config_data = {}
     try:
-        response = requests.get(config_api_url, headers={'Authorization': f'Bearer {token}'})
+        response = backend_http.get(config_api_url, headers={'Authorization': f'Bearer {token}'})
         if response.status_code == 200:
             config_data = response.json()
     except Exception as e:
         messages.error(request, f"Não foi possível carregar as configurações de backup: {e}")
 
-    from django.template import Template, RequestContext
-    template = Template(BACKUP_TEMPLATE)
+    from django.template import RequestContext
+    template = obter_template(BACKUP_TEMPLATE)
     context = RequestContext(request, {
         'user': user,
         'backend_url': Config.BACKEND_URL,
@@ -9083,6 +9202,9 @@ def run_server():
     print("\nInicializando banco de sessões...")
     execute_from_command_line(['manage.py', 'migrate', '--run-syncdb'])
     
+    if Config.TEMPLATE_WARMUP:
+        aquecer_templates()
+    
     print("\n" + "="*70)
     print("FRONTEND INICIADO")
     print("="*70)
@@ -12,10 +12,13 @@ from datetime import datetime, date, timedelta
 from decimal import Decimal
 from typing import Optional, List, Dict, Any
 from pathlib import Path
+from contextlib import contextmanager
+from collections import OrderedDict
 import base64
 import asyncio
 import secrets
 import string
+import threading
 # ============================================
 # CARREGAR VARIÁVEIS DE AMBIENTE (.env)
 # ============================================
@@ -82,6 +85,52 @@ class Config:
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
     GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-pro')
     
+    # Cache persistente de resultados de IA (por clínica)
+    IA_CACHE_ATIVO = os.getenv('IA_CACHE_ATIVO', 'True').lower() in ('true', '1', 'yes')
+    IA_CACHE_TTL_HORAS = int(os.getenv('IA_CACHE_TTL_HORAS', 24 * 30))
+    # Se False, respostas servidas do cache não contam no limite do plano
+    IA_CACHE_HIT_CONSOME_COTA = os.getenv('IA_CACHE_HIT_CONSOME_COTA', 'False').lower() in ('true', '1', 'yes')
+    
+    # Instrumentação por requisição (log de tempos, contagem de queries, N+1); desligada por padrão
+    INSTRUMENTACAO_ATIVA = os.getenv('INSTRUMENTACAO_ATIVA', 'False').lower() in ('true', '1', 'yes')
+    # Server-Timing/X-Query-Count nas respostas revelam tempos internos a qualquer origem: só em desenvolvimento
+    INSTRUMENTACAO_CABECALHOS = os.getenv('INSTRUMENTACAO_CABECALHOS', 'False').lower() in ('true', '1', 'yes')
+    # 'todas', 'lentas' (acima de INSTRUMENTACAO_LENTA_MS ou com N+1) ou 'nenhuma'
+    INSTRUMENTACAO_LOG = os.getenv('INSTRUMENTACAO_LOG', 'lentas').lower()
+    INSTRUMENTACAO_LENTA_MS = float(os.getenv('INSTRUMENTACAO_LENTA_MS', 500))
+    # Quantas repetições da mesma query (mesmo formato) numa requisição caracterizam N+1; 0 desativa
+    INSTRUMENTACAO_N1_LIMIAR = int(os.getenv('INSTRUMENTACAO_N1_LIMIAR', 10))
+    
+    # Senhas e login
+    # Custo do PBKDF2-SHA256 por verificação de senha; hashes com outro valor são refeitos no próximo login
+    SENHA_PBKDF2_ITERACOES = int(os.getenv('SENHA_PBKDF2_ITERACOES', 390000))
+    # Verificações de senha simultâneas (o excedente espera na fila em vez de disputar CPU)
+    LOGIN_HASH_SIMULTANEOS = int(os.getenv('LOGIN_HASH_SIMULTANEOS', os.cpu_count() or 2))
+    # Por quanto tempo um login bem-sucedido dispensa o PBKDF2 para a mesma senha; 0 desativa
+    LOGIN_CACHE_SEGUNDOS = int(os.getenv('LOGIN_CACHE_SEGUNDOS', 300))
+    # Intervalo de gravação em lote do last_login
+    LAST_LOGIN_INTERVALO_SEGUNDOS = float(os.getenv('LAST_LOGIN_INTERVALO_SEGUNDOS', 15))
+    
+    # Clientes HTTP externos (SessaoHTTP): padrões de pool, retry e timeout
+    HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+    HTTP_TENTATIVAS = int(os.getenv('HTTP_TENTATIVAS', 2))
+    HTTP_TIMEOUT_CONEXAO = float(os.getenv('HTTP_TIMEOUT_CONEXAO', 3))
+    HTTP_TIMEOUT_LEITURA = float(os.getenv('HTTP_TIMEOUT_LEITURA', 10))
+    
+    # Secretária virtual (WhatsApp): respostas geradas fora do webhook
+    WHATSAPP_TRABALHADORES = int(os.getenv('WHATSAPP_TRABALHADORES', 4))
+    WHATSAPP_JANELA_SEGUNDOS = float(os.getenv('WHATSAPP_JANELA_SEGUNDOS', 4))  # silêncio antes de responder
+    WHATSAPP_ESPERA_MAXIMA_SEGUNDOS = float(os.getenv('WHATSAPP_ESPERA_MAXIMA_SEGUNDOS', 15))
+    WHATSAPP_RETOMAR_MINUTOS = int(os.getenv('WHATSAPP_RETOMAR_MINUTOS', 30))  # pendentes mais antigas não são respondidas após reinício
+    WHATSAPP_HISTORICO_MAXIMO = int(os.getenv('WHATSAPP_HISTORICO_MAXIMO', 16))  # mensagens mantidas na íntegra
+    WHATSAPP_AGENDA_DIAS = int(os.getenv('WHATSAPP_AGENDA_DIAS', 7))
+    WHATSAPP_AGENDA_HORARIOS_POR_DIA = int(os.getenv('WHATSAPP_AGENDA_HORARIOS_POR_DIA', 6))
+    
+    # Agenda: expediente usado para médicos sem horário de atendimento cadastrado
+    AGENDA_EXPEDIENTE_PADRAO = os.getenv('AGENDA_EXPEDIENTE_PADRAO', '08:00-12:00,14:00-18:00')
+    AGENDA_DIAS_PADRAO = os.getenv('AGENDA_DIAS_PADRAO', '0,1,2,3,4')  # 0 = segunda-feira
+    AGENDA_DURACAO_PADRAO_MINUTOS = int(os.getenv('AGENDA_DURACAO_PADRAO_MINUTOS', 30))
+    
     # Servidor
     HOST = os.getenv('HOST', '0.0.0.0')
     PORT = int(os.getenv('PORT', 8000))
@@ -107,7 +156,249 @@ class Config:
                 return False
         return False
 
+# ============================================
+# MÉTRICAS (FORMATO PROMETHEUS)
+# ============================================
+
+class Metricas:
+    """
+    Contadores, histogramas e gauges expostos em /metrics no formato texto do
+    Prometheus.
+
+    Cada processo acumula as medições em memória e a cada
+    METRICAS_INTERVALO_SEGUNDOS as soma num SQLite compartilhado
+    (METRICAS_ARQUIVO), de modo que qualquer worker responde /metrics com o
+    total de todos. Gauges são gravados por PID e só entram na soma os dos
+    processos que deram sinal de vida recentemente.
+    """
+
+    ATIVAS = os.getenv('METRICAS_ATIVAS', 'True').lower() in ('true', '1', 'yes')
+    ARQUIVO = os.path.join(Config.BASE_DIR, os.getenv('METRICAS_ARQUIVO', 'intellimed_metricas.db'))
+    INTERVALO_SEGUNDOS = float(os.getenv('METRICAS_INTERVALO_SEGUNDOS', 5))
+    # Se definido, /metrics exige "Authorization: Bearer <token>" (ou ?token=);
+    # sem token, /metrics só responde a conexões diretas de localhost
+    TOKEN = os.getenv('METRICAS_TOKEN', '')
+
+    BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    BUCKETS_LONGOS = (0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+    # nome -> (tipo, ajuda, buckets)
+    DEFINICOES = {
+        'intellimed_http_requisicoes_total': ('counter', 'Requisições HTTP atendidas por método, rota e status.', None),
+        'intellimed_http_requisicao_duracao_segundos': ('histogram', 'Latência das requisições HTTP por rota.', BUCKETS_PADRAO),
+        'intellimed_db_escrita_duracao_segundos': ('histogram', 'Duração das escritas no SQLite, incluindo a espera pelo lock.', BUCKETS_PADRAO),
+        'intellimed_db_bloqueios_total': ('counter', 'Queries que falharam com "database is locked".', None),
+        'intellimed_ia_chamadas_total': ('counter', 'Chamadas ao provedor de IA por finalidade e resultado.', None),
+        'intellimed_ia_chamada_duracao_segundos': ('histogram', 'Latência das chamadas ao provedor de IA por finalidade.', BUCKETS_LONGOS),
+        'intellimed_ia_funcao_total': ('counter', 'Execuções das funções de IA por função e resultado.', None),
+        'intellimed_ia_funcao_duracao_segundos': ('histogram', 'Duração das funções de IA (inclui fila, tentativas e pós-processamento).', BUCKETS_LONGOS),
+        'intellimed_ia_fila': ('gauge', 'Chamadas de IA aguardando vaga ou em andamento.', None),
+        'intellimed_websocket_conexoes': ('gauge', 'Conexões WebSocket abertas por consumer.', None),
+        'intellimed_whatsapp_fila': ('gauge', 'Mensagens de WhatsApp recebidas aguardando resposta da secretária virtual.', None),
+        'intellimed_backup_duracao_segundos': ('histogram', 'Duração da geração de backups por origem e resultado.', BUCKETS_LONGOS),
+    }
+
+    _RE_LE = re.compile(r'(?:^|,)le="([^"]*)"')
+
+    _lock = threading.Lock()
+    _pid = None
+    _contadores = {}
+    _gauges = {}
+    _tabelas_criadas = False
+
+    @staticmethod
+    def _rotulos(labels):
+        def escapar(valor):
+            return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return ','.join(f'{chave}="{escapar(valor)}"' for chave, valor in sorted(labels.items()))
+
+    @classmethod
+    def _preparar_processo(cls):
+        """Na primeira medição do processo (ou após um fork) zera o estado e sobe a thread de descarga. Chamar com _lock."""
+        pid = os.getpid()
+        if cls._pid == pid:
+            return
+        import atexit
+        cls._pid = pid
+        cls._contadores = {}
+        cls._gauges = {}
+        threading.Thread(target=cls._laco_descarga, name='metricas', daemon=True).start()
+        atexit.register(cls.descarregar)
+
+    @classmethod
+    def incrementar(cls, nome, valor=1, **labels):
+        if not cls.ATIVAS:
+            return
+        chave = (nome, cls._rotulos(labels))
+        with cls._lock:
+            cls._preparar_processo()
+            cls._contadores[chave] = cls._contadores.get(chave, 0) + valor
+
+    @classmethod
+    def observar(cls, nome, valor, **labels):
+        """Registra uma observação no histograma `nome` (buckets cumulativos, _sum e _count)."""
+        if not cls.ATIVAS:
+            return
+        buckets = cls.DEFINICOES[nome][2] or cls.BUCKETS_PADRAO
+        series = [(f'{nome}_bucket', cls._rotulos(dict(labels, le=f'{limite:g}')), int(valor <= limite)) for limite in buckets]
+        series.append((f'{nome}_bucket', cls._rotulos(dict(labels, le='+Inf')), 1))
+        rotulos = cls._rotulos(labels)
+        series.append((f'{nome}_sum', rotulos, valor))
+        series.append((f'{nome}_count', rotulos, 1))
+        with cls._lock:
+            cls._preparar_processo()
+            for serie, rotulos_serie, incremento in series:
+                chave = (serie, rotulos_serie)
+                cls._contadores[chave] = cls._contadores.get(chave, 0) + incremento
+
+    @classmethod
+    def ajustar_gauge(cls, nome, delta, **labels):
+        if not cls.ATIVAS:
+            return
+        chave = (nome, cls._rotulos(labels))
+        with cls._lock:
+            cls._preparar_processo()
+            cls._gauges[chave] = cls._gauges.get(chave, 0) + delta
+
+    @classmethod
+    @contextmanager
+    def cronometro(cls, nome, **labels):
+        """Observa a duração do bloco no histograma `nome`, com resultado='sucesso' ou 'erro'."""
+        import time
+        inicio = time.perf_counter()
+        resultado = 'erro'
+        try:
+            yield
+            resultado = 'sucesso'
+        finally:
+            cls.observar(nome, time.perf_counter() - inicio, resultado=resultado, **labels)
+
+    @classmethod
+    def medir_funcao_ia(cls, funcao):
+        """Decorador para as funções de IA: duração e resultado (dict com 'sucesso': False conta como erro)."""
+        import functools
+
+        @functools.wraps(funcao)
+        def envoltorio(*args, **kwargs):
+            import time
+            inicio = time.perf_counter()
+            resultado = 'erro'
+            try:
+                retorno = funcao(*args, **kwargs)
+                if not (isinstance(retorno, dict) and retorno.get('sucesso') is False):
+                    resultado = 'sucesso'
+                return retorno
+            finally:
+                cls.incrementar('intellimed_ia_funcao_total', funcao=funcao.__name__, resultado=resultado)
+                cls.observar('intellimed_ia_funcao_duracao_segundos', time.perf_counter() - inicio, funcao=funcao.__name__)
+        return envoltorio
+
+    @classmethod
+    def _conectar(cls):
+        import sqlite3
+        conexao = sqlite3.connect(cls.ARQUIVO, timeout=5)
+        if not cls._tabelas_criadas:
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS contadores ('
+                'nome TEXT NOT NULL, rotulos TEXT NOT NULL, valor REAL NOT NULL, '
+                'PRIMARY KEY (nome, rotulos))'
+            )
+            conexao.execute(
+                'CREATE TABLE IF NOT EXISTS gauges ('
+                'nome TEXT NOT NULL, rotulos TEXT NOT NULL, pid INTEGER NOT NULL, '
+                'valor REAL NOT NULL, atualizado_em REAL NOT NULL, '
+                'PRIMARY KEY (nome, rotulos, pid))'
+            )
+            conexao.commit()
+            cls._tabelas_criadas = True
+        return conexao
+
+    @classmethod
+    def descarregar(cls):
+        """Soma no arquivo compartilhado o que este processo acumulou e regrava seus gauges."""
+        import time
+        import sqlite3
+        with cls._lock:
+            if cls._pid != os.getpid():
+                return
+            contadores, cls._contadores = cls._contadores, {}
+            gauges = dict(cls._gauges)
+        if not contadores and not gauges:
+            return
+
+        agora = time.time()
+        try:
+            conexao = cls._conectar()
+            try:
+                with conexao:
+                    conexao.executemany(
+                        'INSERT INTO contadores (nome, rotulos, valor) VALUES (?, ?, ?) '
+                        'ON CONFLICT(nome, rotulos) DO UPDATE SET valor = valor + excluded.valor',
+                        [(nome, rotulos, valor) for (nome, rotulos), valor in contadores.items()]
+                    )
+                    conexao.executemany(
+                        'INSERT OR REPLACE INTO gauges (nome, rotulos, pid, valor, atualizado_em) VALUES (?, ?, ?, ?, ?)',
+                        [(nome, rotulos, cls._pid, valor, agora) for (nome, rotulos), valor in gauges.items()]
+                    )
+                    conexao.execute('DELETE FROM gauges WHERE atualizado_em < ?', (agora - 10 * cls.INTERVALO_SEGUNDOS,))
+            finally:
+                conexao.close()
+        except sqlite3.Error as e:
+            # Devolve ao acumulado para tentar de novo na próxima descarga
+            with cls._lock:
+                for chave, valor in contadores.items():
+                    cls._contadores[chave] = cls._contadores.get(chave, 0) + valor
+            print(f"⚠️ Métricas: falha ao gravar em {cls.ARQUIVO}: {e}")
+
+    @classmethod
+    def _laco_descarga(cls):
+        import time
+        while True:
+            time.sleep(cls.INTERVALO_SEGUNDOS)
+            cls.descarregar()
+
+    @classmethod
+    def _ordem_serie(cls, serie):
+        nome, rotulos, _ = serie
+        le = cls._RE_LE.search(rotulos)
+        return (cls._RE_LE.sub('', rotulos), nome, float(le.group(1)) if le else 0.0)
+
+    @classmethod
+    def exportar(cls):
+        """Texto no formato de exposição do Prometheus com o total de todos os processos."""
+        import time
+        cls.descarregar()
+        conexao = cls._conectar()
+        try:
+            linhas_db = conexao.execute('SELECT nome, rotulos, valor FROM contadores').fetchall()
+            linhas_db += conexao.execute(
+                'SELECT nome, rotulos, SUM(valor) FROM gauges WHERE atualizado_em >= ? GROUP BY nome, rotulos',
+                (time.time() - 3 * cls.INTERVALO_SEGUNDOS,)
+            ).fetchall()
+        finally:
+            conexao.close()
+
+        familias = {}
+        for nome, rotulos, valor in linhas_db:
+            base = nome
+            for sufixo in ('_bucket', '_sum', '_count'):
+                if nome.endswith(sufixo) and nome[:-len(sufixo)] in cls.DEFINICOES:
+                    base = nome[:-len(sufixo)]
+            familias.setdefault(base, []).append((nome, rotulos, valor))
+
+        linhas = []
+        for base in sorted(familias):
+            tipo, ajuda, _ = cls.DEFINICOES.get(base, ('untyped', '', None))
+            linhas.append(f'# HELP {base} {ajuda}')
+            linhas.append(f'# TYPE {base} {tipo}')
+            for nome, rotulos, valor in sorted(familias[base], key=cls._ordem_serie):
+                serie = f'{nome}{{{rotulos}}}' if rotulos else nome
+                linhas.append(f'{serie} {float(valor)!r}')
+        return '\n'.join(linhas) + '\n'
+
 import requests # Certifique-se de ter instalado: pip install requests
+from sessao_http import SessaoHTTP
 
 # ============================================
 # CONFIGURAÇÃO DO DJANGO (ANTES DOS IMPORTS DO DRF)
@@ -132,7 +423,7 @@ class CorsMiddleware:
             response = HttpResponse()
             response["Access-Control-Allow-Origin"] = "*"
             response["Access-Control-Allow-Methods"] = "GET, POST, PUT, PATCH, DELETE, OPTIONS"
-            response["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-CSRFToken"
+            response["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-CSRFToken, Upload-Offset, Upload-Checksum"
             response["Access-Control-Max-Age"] = "3600"
             return response
         
@@ -142,11 +433,155 @@ class CorsMiddleware:
 
         # ▼▼▼ CORREÇÃO APLICADA AQUI ▼▼▼
         # Expõe o cabeçalho Content-Disposition para que o JavaScript do frontend possa lê-lo
-        response["Access-Control-Expose-Headers"] = "Content-Disposition"
+        response["Access-Control-Expose-Headers"] = "Content-Disposition, Server-Timing, X-Query-Count, X-Proximo-Cursor"
         # ▲▲▲ FIM DA CORREÇÃO ▲▲▲
         
         return response
 
+class InstrumentacaoMiddleware:
+    """
+    Mede cada requisição: tempo total, tempo da view, tempo de serialização
+    (render da Response do DRF), quantidade e tempo das queries e tamanho da
+    resposta. Os números saem em uma linha de log JSON e, com
+    INSTRUMENTACAO_CABECALHOS, no cabeçalho Server-Timing (visível no DevTools).
+
+    Com INSTRUMENTACAO_N1_LIMIAR > 0, queries de mesmo formato (valores
+    trocados por '?') repetidas na mesma requisição são apontadas como N+1;
+    INSERTs de várias linhas (bulk_create em lotes) ficam de fora.
+    A view nunca é chamada pelo middleware: os tempos vêm dos ganchos
+    process_view/process_template_response e do callback pós-render.
+    Deve ser o último middleware da lista.
+    """
+
+    _RE_LITERAIS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+    _RE_LISTAS = re.compile(r"\((?:\s*\?\s*,)+\s*\?\s*\)")
+    _RE_INSERT_MULTIPLO = re.compile(r"^\s*INSERT\b.*\bVALUES\s*\(.*?\)\s*,\s*\(", re.IGNORECASE | re.DOTALL)
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    @classmethod
+    def formato_query(cls, sql):
+        """SQL com literais e listas IN(...) normalizados, para agrupar queries iguais."""
+        sql = cls._RE_LITERAIS.sub('?', sql or '')
+        sql = sql.replace('%s', '?')
+        return cls._RE_LISTAS.sub('(...)', sql)
+
+    @classmethod
+    def insert_em_lote(cls, sql, many):
+        """INSERT com várias linhas (executemany ou VALUES (...), (...)) não é N+1."""
+        if many:
+            return (sql or '').lstrip()[:6].upper() == 'INSERT'
+        return cls._RE_INSERT_MULTIPLO.match(sql or '') is not None
+
+    def __call__(self, request):
+        if not (Config.INSTRUMENTACAO_ATIVA or Metricas.ATIVAS):
+            return self.get_response(request)
+
+        import time
+        from django.db import connection, OperationalError
+
+        medicao = {'queries': 0, 'db_s': 0.0, 'view_s': 0.0, 'render_s': 0.0, 'formatos': {},
+                   'view_inicio': None, 'view_fim': None}
+        request._instrumentacao = medicao
+
+        def _registrar_query(execute, sql, params, many, context):
+            inicio = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            except OperationalError as e:
+                if 'locked' in str(e):
+                    Metricas.incrementar('intellimed_db_bloqueios_total')
+                raise
+            finally:
+                duracao = time.perf_counter() - inicio
+                medicao['queries'] += 1
+                medicao['db_s'] += duracao
+                if Config.INSTRUMENTACAO_N1_LIMIAR and not self.insert_em_lote(sql, many):
+                    formato = self.formato_query(sql)
+                    medicao['formatos'][formato] = medicao['formatos'].get(formato, 0) + 1
+                if (sql or '').lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+                    Metricas.observar('intellimed_db_escrita_duracao_segundos', duracao)
+
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(_registrar_query):
+            response = self.get_response(request)
+        fim = time.perf_counter()
+        total_s = fim - inicio
+        if medicao['view_inicio'] is not None:
+            # Sem render adiado (HttpResponse/JsonResponse), a view vai até o fim do get_response
+            medicao['view_s'] = (medicao['view_fim'] or fim) - medicao['view_inicio']
+
+        # Rota do resolver (padrão, não o caminho) para não explodir a cardinalidade
+        rota = getattr(getattr(request, 'resolver_match', None), 'route', None)
+        Metricas.incrementar(
+            'intellimed_http_requisicoes_total',
+            metodo=request.method, rota=rota or '<nao_encontrada>', status=response.status_code
+        )
+        Metricas.observar('intellimed_http_requisicao_duracao_segundos', total_s, rota=rota or '<nao_encontrada>')
+        if not Config.INSTRUMENTACAO_ATIVA:
+            return response
+
+        tamanho = None if getattr(response, 'streaming', False) else len(response.content)
+        suspeitas_n1 = []
+        if Config.INSTRUMENTACAO_N1_LIMIAR:
+            suspeitas_n1 = sorted(
+                ((qtd, formato) for formato, qtd in medicao['formatos'].items() if qtd >= Config.INSTRUMENTACAO_N1_LIMIAR),
+                reverse=True
+            )
+
+        if Config.INSTRUMENTACAO_CABECALHOS:
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={medicao["db_s"] * 1000:.1f};desc="{medicao["queries"]} queries"',
+                f'view;dur={medicao["view_s"] * 1000:.1f}',
+                f'render;dur={medicao["render_s"] * 1000:.1f}',
+                f'total;dur={total_s * 1000:.1f}',
+            ])
+            response['X-Query-Count'] = str(medicao['queries'])
+            response['Timing-Allow-Origin'] = '*'
+
+        lenta = total_s * 1000 >= Config.INSTRUMENTACAO_LENTA_MS
+        if Config.INSTRUMENTACAO_LOG == 'todas' or (Config.INSTRUMENTACAO_LOG == 'lentas' and (lenta or suspeitas_n1)):
+            registro = {
+                'evento': 'requisicao',
+                'metodo': request.method,
+                'rota': rota or request.path,
+                'status': response.status_code,
+                'total_ms': round(total_s * 1000, 1),
+                'view_ms': round(medicao['view_s'] * 1000, 1),
+                'render_ms': round(medicao['render_s'] * 1000, 1),
+                'db_ms': round(medicao['db_s'] * 1000, 1),
+                'queries': medicao['queries'],
+                'bytes': tamanho,
+            }
+            if suspeitas_n1:
+                registro['n_mais_1'] = [{'repeticoes': qtd, 'sql': formato[:300]} for qtd, formato in suspeitas_n1[:5]]
+            print(json.dumps(registro, ensure_ascii=False))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Marca o início da view; a view segue normalmente pelo handler do Django."""
+        medicao = getattr(request, '_instrumentacao', None)
+        if medicao is not None:
+            import time
+            medicao['view_inicio'] = time.perf_counter()
+        return None
+
+    def process_template_response(self, request, response):
+        """Chamado entre a view e o render (Response do DRF): separa os dois tempos."""
+        medicao = getattr(request, '_instrumentacao', None)
+        if medicao is None or medicao['view_inicio'] is None:
+            return response
+
+        import time
+        medicao['view_fim'] = time.perf_counter()
+
+        def _fim_render(resp):
+            medicao['render_s'] = time.perf_counter() - medicao['view_fim']
+
+        response.add_post_render_callback(_fim_render)
+        return response
+
 if not settings.configured:
     # ▼▼▼ CORREÇÃO APLICADA AQUI ▼▼▼
     # Garante que as variáveis do .env sejam lidas antes de serem usadas.
@@ -184,6 +619,7 @@ if not settings.configured:
             'django.middleware.security.SecurityMiddleware',
             'main.CorsMiddleware',
             'django.middleware.common.CommonMiddleware',
+            'main.InstrumentacaoMiddleware',
         ],
         
         DATABASES={
@@ -290,6 +726,317 @@ except ImportError:
 # ASGI
 from django.core.asgi import get_asgi_application
 
+# ============================================
+# CLIENTE DE IA CENTRALIZADO
+# ============================================
+
+class IASobrecarregadaError(Exception):
+    """Limite de chamadas simultâneas ou de taxa da IA esgotado dentro do tempo de espera."""
+
+
+class ErroIALocal(Exception):
+    """Falha simulada pelo provedor local (code=429 imita o limite de cota do Gemini)."""
+
+    def __init__(self, mensagem, code=500):
+        super().__init__(mensagem)
+        self.code = code
+
+
+class RespostaIALocal:
+    """Imita o objeto de resposta do Gemini (só o atributo `text` é usado)."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class ProvedorIALocal:
+    """
+    Backend de IA local e determinístico, para testes de carga e execução offline.
+
+    Ativado com IA_PROVEDOR=local. Devolve respostas prontas no mesmo formato que
+    os parsers esperam de cada finalidade, com latência e erros simulados:
+
+    - IA_LOCAL_LATENCIA: 'fixa:800', 'uniforme:300:1500' ou 'lognormal:800:0.5'
+      (mediana em ms e sigma). Padrão: lognormal:800:0.5
+    - IA_LOCAL_TAXA_ERRO: fração de chamadas que falham com erro genérico
+    - IA_LOCAL_TAXA_429: fração de chamadas que falham com limite de cota (429)
+    - IA_LOCAL_SEED: semente do gerador; a mesma sequência de chamadas produz
+      sempre as mesmas latências e falhas
+    - IA_LOCAL_RESPOSTAS: arquivo JSON opcional {finalidade: texto} que substitui
+      as respostas padrão
+    """
+
+    RESPOSTAS_PADRAO = {
+        'exames': json.dumps({
+            'tipo_exame_identificado': 'Hemograma completo',
+            'confianca': 0.9,
+            'tecnica': 'Contagem automatizada',
+            'achados': 'Série vermelha, branca e plaquetas dentro dos valores de referência.',
+            'impressao_diagnostica': 'Hemograma sem alterações significativas.',
+            'valores_alterados': [],
+            'recomendacoes': 'Correlacionar com a clínica.',
+            'fontes_consultadas': ['Sociedade Brasileira de Patologia Clínica'],
+            'observacoes': 'Resposta gerada pelo provedor de IA local (simulação).',
+            'requer_atencao_urgente': False,
+        }, ensure_ascii=False),
+        'transcricao': json.dumps({
+            'transcricao_completa': 'MÉDICO: Bom dia, o que o traz aqui hoje?\nPACIENTE: Estou com dor de cabeça há três dias.\nMÉDICO: Vamos examinar.',
+            'falas_medico': 'Bom dia, o que o traz aqui hoje? Vamos examinar.',
+            'falas_paciente': 'Estou com dor de cabeça há três dias.',
+            'falas': [
+                {'locutor': 'MÉDICO', 'texto': 'Bom dia, o que o traz aqui hoje?'},
+                {'locutor': 'PACIENTE', 'texto': 'Estou com dor de cabeça há três dias.'},
+                {'locutor': 'MÉDICO', 'texto': 'Vamos examinar.'},
+            ],
+            'confianca': 0.9,
+            'observacao': 'Transcrição simulada (provedor de IA local).',
+        }, ensure_ascii=False),
+        'transcricao_geral': 'Resultado do exame ditado: dentro dos limites da normalidade.',
+        'documentos': 'Paciente atendido em consulta nesta data. Documento gerado pelo provedor de IA local (simulação).',
+        'secretaria': 'Olá! Sou a secretária virtual da clínica. Como posso ajudar?',
+        'transcricao_legado': json.dumps({
+            'transcricao': 'Transcrição simulada.', 'resumo': '', 'sintomas': [],
+            'medicamentos': [], 'palavras_chave': [], 'diagnostico_sugerido': '',
+        }, ensure_ascii=False),
+    }
+
+    def __init__(self):
+        import random
+        self.latencia = os.getenv('IA_LOCAL_LATENCIA', 'lognormal:800:0.5')
+        self.taxa_erro = float(os.getenv('IA_LOCAL_TAXA_ERRO', 0))
+        self.taxa_429 = float(os.getenv('IA_LOCAL_TAXA_429', 0))
+        self._rng = random.Random(int(os.getenv('IA_LOCAL_SEED', 42)))
+        self._lock = threading.Lock()
+        self.respostas = dict(self.RESPOSTAS_PADRAO)
+        arquivo = os.getenv('IA_LOCAL_RESPOSTAS')
+        if arquivo:
+            with open(arquivo, 'r', encoding='utf-8') as f:
+                self.respostas.update(json.load(f))
+
+    def _sortear(self):
+        """Sorteia (latência em segundos, tipo de falha) para a próxima chamada."""
+        tipo, *params = self.latencia.split(':')
+        with self._lock:
+            if tipo == 'fixa':
+                latencia_ms = float(params[0])
+            elif tipo == 'uniforme':
+                latencia_ms = self._rng.uniform(float(params[0]), float(params[1]))
+            else:
+                import math
+                latencia_ms = self._rng.lognormvariate(math.log(float(params[0])), float(params[1]))
+            sorteio = self._rng.random()
+        if sorteio < self.taxa_429:
+            falha = 429
+        elif sorteio < self.taxa_429 + self.taxa_erro:
+            falha = 500
+        else:
+            falha = None
+        return latencia_ms / 1000, falha
+
+    def modelo(self, finalidade):
+        return ModeloIALocal(self, finalidade)
+
+
+class ModeloIALocal:
+    """Substituto de `genai.GenerativeModel` usado pelo ProvedorIALocal."""
+
+    def __init__(self, provedor, finalidade):
+        self.provedor = provedor
+        self.finalidade = finalidade
+
+    def generate_content(self, conteudo, generation_config=None, request_options=None, **kwargs):
+        import time
+        latencia, falha = self.provedor._sortear()
+        time.sleep(latencia)
+        if falha == 429:
+            raise ErroIALocal("429 Resource has been exhausted (simulação local)", code=429)
+        if falha:
+            raise ErroIALocal("500 Internal error (simulação local)")
+
+        partes = conteudo if isinstance(conteudo, list) else [conteudo]
+        prompt = '\n'.join(p for p in partes if isinstance(p, str))
+
+        texto = self.provedor.respostas.get(self.finalidade, '')
+        resposta_json = (generation_config or {}).get('response_mime_type') == 'application/json'
+        if self.finalidade == 'documentos' and resposta_json:
+            # Geração em lote: uma chave por documento pedido no prompt
+            tipos = re.findall(r"### DOCUMENTO '(\w+)'", prompt)
+            texto = json.dumps({tipo: texto for tipo in tipos}, ensure_ascii=False)
+        return RespostaIALocal(texto)
+
+
+class RegistroIA:
+    """
+    Ponto único de acesso ao Gemini.
+
+    Configura a API uma única vez, reaproveita os modelos por finalidade e limita
+    as chamadas ao provedor: no máximo IA_MAX_SIMULTANEAS em andamento (e
+    IA_MAX_SIMULTANEAS_CLINICA por clínica), com taxa controlada por token bucket
+    (IA_TAXA_POR_MINUTO, rajada de IA_RAJADA). Em picos as chamadas aguardam a vez
+    por até IA_ESPERA_MAXIMA_SEGUNDOS, em vez de acumular erros 429.
+    """
+
+    MODELOS = {
+        'exames': os.getenv('GEMINI_MODEL_EXAMS', 'gemini-2.5-flash'),
+        'transcricao': os.getenv('GEMINI_MODEL_TRANSCRIPTION', 'gemini-2.5-flash'),
+        'transcricao_geral': os.getenv('GEMINI_MODEL_TRANSCRICAO_GERAL', 'gemini-2.5-pro'),
+        'documentos': os.getenv('GEMINI_MODEL_DOCUMENTOS', 'gemini-2.5-flash'),
+        'secretaria': os.getenv('GEMINI_MODEL_SECRETARIA', 'gemini-2.5-flash'),
+        'transcricao_legado': Config.GEMINI_MODEL,
+    }
+
+    # 'gemini' (padrão) ou 'local' (ProvedorIALocal, para testes de carga e uso offline)
+    PROVEDOR = os.getenv('IA_PROVEDOR', 'gemini').lower()
+
+    MAX_SIMULTANEAS = int(os.getenv('IA_MAX_SIMULTANEAS', 8))
+    MAX_SIMULTANEAS_CLINICA = int(os.getenv('IA_MAX_SIMULTANEAS_CLINICA', 3))
+    TAXA_POR_MINUTO = float(os.getenv('IA_TAXA_POR_MINUTO', 60))
+    RAJADA = int(os.getenv('IA_RAJADA', 10))
+    ESPERA_MAXIMA_SEGUNDOS = float(os.getenv('IA_ESPERA_MAXIMA_SEGUNDOS', 30))
+    TENTATIVAS_COTA = 3
+
+    _lock = threading.Lock()
+    _configurado = False
+    _modelos = {}
+    _provedor_local = None
+    _semaforo_global = threading.BoundedSemaphore(MAX_SIMULTANEAS)
+    _semaforos_clinica = {}
+    _tokens = float(RAJADA)
+    _ultimo_abastecimento = None
+
+    @classmethod
+    def nome_modelo(cls, finalidade):
+        return cls.MODELOS.get(finalidade, finalidade)
+
+    @classmethod
+    def disponivel(cls):
+        return cls.PROVEDOR == 'local' or bool(Config.GEMINI_API_KEY and genai)
+
+    @classmethod
+    def modelo(cls, finalidade):
+        """Modelo (cacheado) para a finalidade ('exames', 'transcricao', ...)."""
+        if cls.PROVEDOR == 'local':
+            with cls._lock:
+                if cls._provedor_local is None:
+                    cls._provedor_local = ProvedorIALocal()
+                    print("⚠️  IA_PROVEDOR=local: respostas de IA simuladas (sem chamadas ao Gemini)")
+                return cls._provedor_local.modelo(finalidade)
+
+        if not Config.GEMINI_API_KEY:
+            raise Exception("GEMINI_API_KEY não configurada")
+        if not genai:
+            raise Exception("Biblioteca google-generativeai não instalada")
+
+        nome = cls.nome_modelo(finalidade)
+        with cls._lock:
+            if not cls._configurado:
+                genai.configure(api_key=Config.GEMINI_API_KEY)
+                cls._configurado = True
+            if nome not in cls._modelos:
+                cls._modelos[nome] = genai.GenerativeModel(nome)
+            return cls._modelos[nome]
+
+    @classmethod
+    def _semaforo_da_clinica(cls, clinica_id):
+        with cls._lock:
+            if clinica_id not in cls._semaforos_clinica:
+                cls._semaforos_clinica[clinica_id] = threading.BoundedSemaphore(cls.MAX_SIMULTANEAS_CLINICA)
+            return cls._semaforos_clinica[clinica_id]
+
+    @classmethod
+    def _consumir_token(cls, prazo):
+        import time
+        while True:
+            with cls._lock:
+                agora = time.monotonic()
+                if cls._ultimo_abastecimento is not None:
+                    decorrido = agora - cls._ultimo_abastecimento
+                    cls._tokens = min(float(cls.RAJADA), cls._tokens + decorrido * cls.TAXA_POR_MINUTO / 60)
+                cls._ultimo_abastecimento = agora
+                if cls._tokens >= 1:
+                    cls._tokens -= 1
+                    return
+                espera = (1 - cls._tokens) * 60 / cls.TAXA_POR_MINUTO
+            if agora + espera > prazo:
+                raise IASobrecarregadaError("Serviço de IA sobrecarregado no momento. Tente novamente em instantes.")
+            time.sleep(espera)
+
+    @classmethod
+    @contextmanager
+    def vaga(cls, clinica_id=None):
+        """Reserva uma vaga para uma chamada ao provedor (limites por clínica, global e de taxa)."""
+        import time
+        prazo = time.monotonic() + cls.ESPERA_MAXIMA_SEGUNDOS
+
+        Metricas.ajustar_gauge('intellimed_ia_fila', 1, estado='aguardando')
+        aguardando = True
+        try:
+            semaforo_clinica = cls._semaforo_da_clinica(clinica_id) if clinica_id else None
+            if semaforo_clinica and not semaforo_clinica.acquire(timeout=cls.ESPERA_MAXIMA_SEGUNDOS):
+                raise IASobrecarregadaError("Muitas chamadas de IA simultâneas para esta clínica. Tente novamente em instantes.")
+            try:
+                if not cls._semaforo_global.acquire(timeout=max(0.0, prazo - time.monotonic())):
+                    raise IASobrecarregadaError("Serviço de IA sobrecarregado no momento. Tente novamente em instantes.")
+                try:
+                    cls._consumir_token(prazo)
+                    Metricas.ajustar_gauge('intellimed_ia_fila', -1, estado='aguardando')
+                    aguardando = False
+                    Metricas.ajustar_gauge('intellimed_ia_fila', 1, estado='em_andamento')
+                    try:
+                        yield
+                    finally:
+                        Metricas.ajustar_gauge('intellimed_ia_fila', -1, estado='em_andamento')
+                finally:
+                    cls._semaforo_global.release()
+            finally:
+                if semaforo_clinica:
+                    semaforo_clinica.release()
+        finally:
+            if aguardando:
+                Metricas.ajustar_gauge('intellimed_ia_fila', -1, estado='aguardando')
+
+    @staticmethod
+    def _erro_de_cota(erro):
+        return (
+            getattr(erro, 'code', None) == 429
+            or type(erro).__name__ in ('ResourceExhausted', 'TooManyRequests')
+            or '429' in str(erro)
+        )
+
+    @classmethod
+    def gerar(cls, finalidade, conteudo, clinica_id=None, **kwargs):
+        """
+        `generate_content` do modelo da finalidade, dentro dos limites. Respostas 429
+        do provedor são repetidas com backoff exponencial (fora da vaga).
+        """
+        import time
+        import random
+        model = cls.modelo(finalidade)
+        for tentativa in range(cls.TENTATIVAS_COTA):
+            try:
+                with cls.vaga(clinica_id):
+                    inicio = time.perf_counter()
+                    try:
+                        resposta = model.generate_content(conteudo, **kwargs)
+                    except Exception as e:
+                        cota = cls._erro_de_cota(e)
+                        cls._medir_chamada(finalidade, 'cota' if cota else 'erro', time.perf_counter() - inicio)
+                        if not cota or tentativa == cls.TENTATIVAS_COTA - 1:
+                            raise
+                        print(f"⚠️ Gemini retornou limite de cota ({finalidade}); nova tentativa {tentativa + 2}/{cls.TENTATIVAS_COTA}")
+                    else:
+                        cls._medir_chamada(finalidade, 'sucesso', time.perf_counter() - inicio)
+                        return resposta
+            except IASobrecarregadaError:
+                Metricas.incrementar('intellimed_ia_chamadas_total', finalidade=finalidade, resultado='sobrecarregada')
+                raise
+            time.sleep(2 ** tentativa + random.random())
+
+    @staticmethod
+    def _medir_chamada(finalidade, resultado, duracao):
+        Metricas.incrementar('intellimed_ia_chamadas_total', finalidade=finalidade, resultado=resultado)
+        Metricas.observar('intellimed_ia_chamada_duracao_segundos', duracao, finalidade=finalidade)
+
 # ============================================
 # UTILITÁRIOS E VALIDADORES
 # ============================================
@@ -322,6 +1069,28 @@ class Validador:
         
         return cpf_numeros[9] == str(digito1) and cpf_numeros[10] == str(digito2)
     
+    _PESOS_CPF_1 = tuple(range(10, 1, -1))
+    _PESOS_CPF_2 = tuple(range(11, 1, -1))
+    
+    @classmethod
+    def validar_cpfs(cls, cpfs) -> list:
+        """
+        Valida uma lista de CPFs de uma vez (importações). Mesmo algoritmo de
+        validar_cpf, mas trabalhando sobre os bytes dos dígitos, sem regex nem
+        conversões int() por caractere.
+        """
+        resultado = []
+        for cpf in cpfs:
+            d = (cpf or '').encode('ascii', 'ignore').translate(None, b'.-/ ')
+            if len(d) != 11 or not d.isdigit() or d.count(d[:1]) == 11:
+                resultado.append(False)
+                continue
+            d = [c - 48 for c in d]
+            digito1 = sum(map(int.__mul__, d[:9], cls._PESOS_CPF_1)) * 10 % 11 % 10
+            digito2 = sum(map(int.__mul__, d[:10], cls._PESOS_CPF_2)) * 10 % 11 % 10
+            resultado.append(d[9] == digito1 and d[10] == digito2)
+        return resultado
+    
     @staticmethod
     def formatar_cpf(cpf: str) -> str:
         """Formata CPF para XXX.XXX.XXX-XX"""
@@ -435,6 +1204,8 @@ def verificar_limite_ia(tipo_consumo):
                 return Response({'erro': error_msg}, status=status.HTTP_403_FORBIDDEN)
                 # ▲▲▲ FIM DA ATUALIZAÇÃO ▲▲▲
 
+            # Endpoints que consomem várias unidades conferem o saldo antes de chamar a IA
+            request.cota_ia_restante = limite_total_periodo - consumo_total
             response = view_func(*args, **kwargs)
             
             if 200 <= response.status_code < 300:
@@ -443,7 +1214,9 @@ def verificar_limite_ia(tipo_consumo):
                     if 'consultas' in request.path: detalhes['consulta_id'] = kwargs['pk']
                     elif 'exames' in request.path: detalhes['exame_id'] = kwargs['pk']
                 
-                registrar_consumo_ia(clinica_id, tipo_consumo, **detalhes)
+                # Endpoints em lote informam quantas unidades de IA foram de fato consumidas
+                for _ in range(getattr(response, 'consumo_ia_unidades', 1)):
+                    registrar_consumo_ia(clinica_id, tipo_consumo, **detalhes)
             
             return response
         return _wrapped_view
@@ -520,8 +1293,123 @@ class AuthenticatedUser:
     def __getitem__(self, key):
         return self.payload[key]
     
+class RevogacaoTokens:
+    """
+    Épocas de token por usuário e por clínica (tabela tokens_epocas). Cada token
+    leva as épocas vigentes na emissão ('eu' e 'ec'); revogar incrementa a época
+    e invalida de uma vez todos os tokens emitidos antes.
+
+    As épocas ficam em memória (checagem O(1)) e só são relidas do banco quando
+    o arquivo-sinal muda, o que leva a revogação aos outros workers na hora sem
+    uma consulta por requisição.
+    """
+
+    ARQUIVO_SINAL = os.path.join(Config.BASE_DIR, os.getenv('TOKENS_ARQUIVO_SINAL', 'intellimed_tokens.sinal'))
+
+    _lock = threading.Lock()
+    _epocas = {}
+    _versao = None
+
+    @classmethod
+    def _versao_sinal(cls):
+        try:
+            info = os.stat(cls.ARQUIVO_SINAL)
+            return (info.st_mtime_ns, info.st_size)
+        except FileNotFoundError:
+            return (0, 0)
+
+    @classmethod
+    def _sincronizar(cls):
+        versao = cls._versao_sinal()
+        if versao == cls._versao:
+            return
+        from django.db import DatabaseError
+        try:
+            epocas = {(escopo, alvo_id): epoca for escopo, alvo_id, epoca in EpocaToken.objects.values_list('escopo', 'alvo_id', 'epoca')}
+        except DatabaseError as e:
+            print(f"⚠️ Não foi possível carregar as revogações de token: {e}")
+            epocas = {}
+        with cls._lock:
+            cls._epocas = epocas
+            cls._versao = versao
+
+    @classmethod
+    def epoca(cls, escopo, alvo_id):
+        cls._sincronizar()
+        return cls._epocas.get((escopo, int(alvo_id)), 0)
+
+    @classmethod
+    def revogar(cls, escopo, alvo_id):
+        """Invalida todos os tokens já emitidos para o usuário ou clínica."""
+        import time
+        from django.db.models import F
+        alvo_id = int(alvo_id)
+        registro, _ = EpocaToken.objects.get_or_create(escopo=escopo, alvo_id=alvo_id)
+        EpocaToken.objects.filter(pk=registro.pk).update(epoca=F('epoca') + 1)
+        registro.refresh_from_db(fields=['epoca'])
+        with cls._lock:
+            cls._epocas[(escopo, alvo_id)] = registro.epoca
+        with open(cls.ARQUIVO_SINAL, 'w') as f:
+            f.write(str(time.time_ns()))
+        print(f"🔒 Tokens revogados: {escopo} {alvo_id} (época {registro.epoca})")
+
+    @classmethod
+    def valido(cls, payload):
+        cls._sincronizar()
+        try:
+            usuario_id = int(payload.get('sub'))
+        except (TypeError, ValueError):
+            return False
+        if payload.get('eu', 0) != cls._epocas.get(('usuario', usuario_id), 0):
+            return False
+        clinica_id = payload.get('clinica_id')
+        if clinica_id and payload.get('ec', 0) != cls._epocas.get(('clinica', int(clinica_id)), 0):
+            return False
+        return True
+
 class JWTAuthentication(BaseAuthentication):
-    """Autenticação JWT customizada"""
+    """
+    Autenticação JWT customizada.
+
+    A assinatura de cada token é verificada uma única vez: tokens válidos ficam
+    num LRU (JWT_CACHE_MAXIMO entradas) até expirarem. A revogação
+    (RevogacaoTokens) é checada em toda requisição.
+    """
+
+    CACHE_MAXIMO = int(os.getenv('JWT_CACHE_MAXIMO', 4096))
+
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+
+    @classmethod
+    def validar_token(cls, token):
+        """Payload do token; levanta jwt.InvalidTokenError ou AuthenticationFailed (revogado)."""
+        import time
+        with cls._cache_lock:
+            payload = cls._cache.get(token)
+            if payload is not None:
+                cls._cache.move_to_end(token)
+
+        if payload is not None and payload['exp'] <= time.time():
+            with cls._cache_lock:
+                cls._cache.pop(token, None)
+            raise jwt.ExpiredSignatureError('Signature has expired')
+
+        if payload is None:
+            payload = jwt.decode(
+                token,
+                Config.JWT_SECRET_KEY,
+                algorithms=[Config.JWT_ALGORITHM]
+            )
+            if 'exp' in payload:
+                with cls._cache_lock:
+                    cls._cache[token] = payload
+                    if len(cls._cache) > cls.CACHE_MAXIMO:
+                        cls._cache.popitem(last=False)
+
+        if not RevogacaoTokens.valido(payload):
+            raise AuthenticationFailed('Token revogado')
+        return dict(payload)
     
     def authenticate(self, request):
         auth_header = request.headers.get('Authorization')
@@ -537,15 +1425,13 @@ class JWTAuthentication(BaseAuthentication):
             
             token = parts[1]
             
-            payload = jwt.decode(
-                token,
-                Config.JWT_SECRET_KEY,
-                algorithms=[Config.JWT_ALGORITHM]
-            )
+            payload = self.validar_token(token)
             
             user = AuthenticatedUser(payload)
             return (user, None)
             
+        except AuthenticationFailed:
+            raise
         except jwt.ExpiredSignatureError:
             raise AuthenticationFailed('Token expirado')
         except jwt.InvalidTokenError:
@@ -740,7 +1626,12 @@ class Paciente(TenantModel):
             raise ValidationError(errors)
     
     def save(self, *args, **kwargs):
-        # Formatar campos antes de salvar
+        self.formatar_campos()
+        self.full_clean()
+        super().save(*args, **kwargs)
+    
+    def formatar_campos(self):
+        """Normaliza CPF, telefones, CEP, nome e email (usado no save e na importação)"""
         if self.cpf:
             self.cpf = Validador.formatar_cpf(self.cpf)
         if self.telefone_celular:
@@ -753,9 +1644,6 @@ class Paciente(TenantModel):
             self.nome_completo = self.nome_completo.title()
         if self.email:
             self.email = self.email.lower()
-        
-        self.full_clean()
-        super().save(*args, **kwargs)
     
     @property
     def idade(self):
@@ -786,6 +1674,187 @@ class Paciente(TenantModel):
         """Retorna histórico de exames do paciente"""
         return self.exames.all().order_by('-data_exame')
 
+
+class ImportacaoPacientes:
+    """
+    Importação em massa de pacientes a partir de CSV ou XLSX (cadastro inicial
+    de uma clínica). O arquivo é lido em streaming e validado em lotes (os CPFs
+    de cada lote de uma vez, os já cadastrados a partir de uma única query feita
+    no início) sem escrever nada; só com o arquivo inteiro lido os pacientes
+    válidos são gravados com bulk_create, cada lote na sua própria transação
+    curta, para não segurar o lock de escrita do SQLite durante a leitura.
+    Erros são reportados pelo número da linha do arquivo.
+    """
+    
+    TAMANHO_LOTE = 1000
+    MAXIMO_ERROS_RELATORIO = 1000
+    FORMATOS_DATA = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y')
+    
+    # Cabeçalhos aceitos (já normalizados: minúsculas, sem acento, "_" no lugar de espaço)
+    COLUNAS = {
+        'nome_completo': 'nome_completo', 'nome': 'nome_completo', 'paciente': 'nome_completo',
+        'cpf': 'cpf',
+        'data_nascimento': 'data_nascimento', 'nascimento': 'data_nascimento', 'data_de_nascimento': 'data_nascimento', 'dt_nascimento': 'data_nascimento',
+        'sexo': 'sexo', 'genero': 'sexo',
+        'convenio': 'convenio', 'plano': 'convenio',
+        'profissao': 'profissao',
+        'telefone_celular': 'telefone_celular', 'celular': 'telefone_celular', 'telefone': 'telefone_celular', 'whatsapp': 'telefone_celular',
+        'telefone_fixo': 'telefone_fixo', 'fixo': 'telefone_fixo',
+        'email': 'email', 'e-mail': 'email', 'e_mail': 'email',
+        'cep': 'cep',
+        'logradouro': 'logradouro', 'endereco': 'logradouro', 'rua': 'logradouro',
+        'numero': 'numero', 'n': 'numero',
+        'complemento': 'complemento',
+        'bairro': 'bairro',
+        'cidade': 'cidade', 'municipio': 'cidade',
+        'estado': 'estado', 'uf': 'estado',
+    }
+    SEXOS = {'m': 'M', 'masculino': 'M', 'f': 'F', 'feminino': 'F', 'o': 'O', 'outro': 'O'}
+    
+    def __init__(self, clinica_id, simular=False):
+        self.clinica_id = clinica_id
+        self.simular = simular
+        self.convenios = {valor for valor, _ in Paciente.CONVENIO_CHOICES}
+        self.existentes = dict(Paciente.objects.filter(clinica_id=clinica_id).values_list('cpf', 'ativo'))
+        self.total_linhas = 0
+        self.importados = 0
+        self.duplicados = 0
+        self.invalidos = 0
+        self.erros = []
+        self.validos = []  # (numero_linha, Paciente) prontos para gravar
+        self.ultima_linha_gravada = None
+    
+    @staticmethod
+    def _normalizar_cabecalho(nome):
+        import unicodedata
+        nome = unicodedata.normalize('NFKD', str(nome or '')).encode('ascii', 'ignore').decode()
+        return re.sub(r'\s+', '_', nome.strip().lower())
+    
+    @classmethod
+    def linhas_csv(cls, arquivo, encoding='utf-8-sig'):
+        """Gera (numero_linha, {campo: valor}) de um CSV, detectando ';' ou ','"""
+        import csv
+        import io
+        texto = io.TextIOWrapper(arquivo, encoding=encoding, newline='')
+        primeira = texto.readline()
+        delimitador = ';' if primeira.count(';') > primeira.count(',') else ','
+        campos = [cls.COLUNAS.get(cls._normalizar_cabecalho(c)) for c in next(csv.reader([primeira], delimiter=delimitador), [])]
+        for numero, valores in enumerate(csv.reader(texto, delimiter=delimitador), start=2):
+            if any(v.strip() for v in valores):
+                yield numero, {campo: valor for campo, valor in zip(campos, valores) if campo}
+    
+    @classmethod
+    def linhas_xlsx(cls, arquivo):
+        """Gera (numero_linha, {campo: valor}) da primeira planilha de um XLSX (modo read_only)"""
+        import openpyxl
+        planilha = openpyxl.load_workbook(arquivo, read_only=True, data_only=True).worksheets[0]
+        linhas = planilha.iter_rows(values_only=True)
+        campos = [cls.COLUNAS.get(cls._normalizar_cabecalho(c)) for c in next(linhas, [])]
+        for numero, valores in enumerate(linhas, start=2):
+            if any(v not in (None, '') for v in valores):
+                yield numero, {campo: valor for campo, valor in zip(campos, valores) if campo}
+    
+    def _converter(self, dados):
+        """Valores crus da planilha -> kwargs do model (datas, sexo, convênio, números lidos como float)"""
+        campos = {}
+        for campo, valor in dados.items():
+            if isinstance(valor, float) and valor.is_integer():
+                valor = str(int(valor))
+            if isinstance(valor, datetime):
+                valor = valor.date()
+            if isinstance(valor, str):
+                valor = valor.strip()
+            campos[campo] = valor if valor not in ('', None) else None
+        
+        nascimento = campos.get('data_nascimento')
+        if isinstance(nascimento, str):
+            for formato in self.FORMATOS_DATA:
+                try:
+                    campos['data_nascimento'] = datetime.strptime(nascimento, formato).date()
+                    break
+                except ValueError:
+                    continue
+        if campos.get('sexo'):
+            campos['sexo'] = self.SEXOS.get(str(campos['sexo']).lower(), campos['sexo'])
+        # Convênio vazio vira Particular; nomes fora da lista viram Outro
+        convenio = str(campos.get('convenio') or 'PARTICULAR').upper()
+        campos['convenio'] = convenio if convenio in self.convenios else 'OUTRO'
+        if campos.get('cpf') and len(re.sub(r'[^0-9]', '', str(campos['cpf']))) < 11:
+            campos['cpf'] = re.sub(r'[^0-9]', '', str(campos['cpf'])).zfill(11)  # zeros à esquerda perdidos no Excel
+        return campos
+    
+    def _registrar_erro(self, numero, erros):
+        self.invalidos += 1
+        if len(self.erros) < self.MAXIMO_ERROS_RELATORIO:
+            self.erros.append({'linha': numero, 'erros': erros})
+    
+    def _processar_lote(self, lote):
+        cpf_valido = Validador.validar_cpfs([str(campos.get('cpf') or '') for _, campos in lote])
+        novos = []
+        for (numero, campos), valido in zip(lote, cpf_valido):
+            if not valido:
+                self._registrar_erro(numero, {'cpf': ['CPF inválido']})
+                continue
+            paciente = Paciente(clinica_id=self.clinica_id, **campos)
+            paciente.formatar_campos()
+            if paciente.cpf in self.existentes:
+                self.duplicados += 1
+                if len(self.erros) < self.MAXIMO_ERROS_RELATORIO:
+                    situacao = 'ativo' if self.existentes[paciente.cpf] else 'inativo (use reativar)'
+                    self.erros.append({'linha': numero, 'duplicado': True, 'erros': {'cpf': [f'CPF já cadastrado, paciente {situacao}']}})
+                continue
+            try:
+                # validate_unique/constraints fariam uma query por linha; a duplicidade
+                # já foi resolvida acima com o mapa de CPFs da clínica
+                paciente.clean_fields()
+                paciente.clean()
+            except ValidationError as e:
+                self._registrar_erro(numero, e.message_dict)
+                continue
+            self.existentes[paciente.cpf] = True  # duplicatas dentro do próprio arquivo
+            self.validos.append((numero, paciente))
+    
+    def _gravar(self):
+        """Grava os válidos em lotes, cada um em uma transação curta."""
+        for inicio in range(0, len(self.validos), self.TAMANHO_LOTE):
+            lote = self.validos[inicio:inicio + self.TAMANHO_LOTE]
+            with transaction.atomic():
+                Paciente.objects.bulk_create([paciente for _, paciente in lote])
+            self.importados += len(lote)
+            self.ultima_linha_gravada = lote[-1][0]
+    
+    def executar(self, linhas):
+        """
+        Lê e valida o arquivo inteiro antes de gravar: se a leitura falhar no meio
+        (encoding, planilha corrompida) nada fica gravado. Se a gravação falhar,
+        os lotes anteriores permanecem e `importados`/`ultima_linha_gravada`
+        dizem até onde o arquivo entrou.
+        """
+        lote = []
+        for numero, dados in linhas:
+            self.total_linhas += 1
+            lote.append((numero, self._converter(dados)))
+            if len(lote) >= self.TAMANHO_LOTE:
+                self._processar_lote(lote)
+                lote = []
+        if lote:
+            self._processar_lote(lote)
+        
+        if self.simular:
+            self.importados = len(self.validos)
+        else:
+            self._gravar()
+        return {
+            'total_linhas': self.total_linhas,
+            'importados': self.importados,
+            'ultima_linha_gravada': self.ultima_linha_gravada,
+            'duplicados': self.duplicados,
+            'invalidos': self.invalidos,
+            'simulacao': self.simular,
+            'erros': self.erros,
+            'erros_omitidos': max(self.invalidos + self.duplicados - len(self.erros), 0),
+        }
+
 # ============================================
 # MODEL AGENDAMENTO
 # ============================================
@@ -924,22 +1993,353 @@ class Agendamento(TenantModel):
         ).order_by('data', 'hora')[:limite]
 
 # ============================================
-# MODEL CONSULTA
+# MODEL HORÁRIO DE ATENDIMENTO E DISPONIBILIDADE
 # ============================================
 
-class Consulta(TenantModel):
-    """Model de Consulta"""
+class HorarioAtendimento(TenantModel):
+    """
+    Turno de atendimento de um médico em um dia da semana (pode haver mais de
+    um turno por dia, ex.: manhã e tarde). Médicos sem nenhum turno cadastrado
+    usam o expediente padrão (AGENDA_EXPEDIENTE_PADRAO / AGENDA_DIAS_PADRAO).
+    """
     
-    STATUS_CHOICES = [
-        ('agendada', 'Agendada'),
-        ('confirmada', 'Confirmada'),
-        ('em_atendimento', 'Em Atendimento'),
-        ('gravando', 'Gravando Consulta'),
-        ('transcrevendo', 'Transcrevendo'),
-        ('gerando_documentos', 'Gerando Documentos'),
-        ('aguardando_revisao', 'Aguardando Revisão'),
-        ('finalizada', 'Finalizada'),
-        ('cancelada', 'Cancelada'),
+    DIA_SEMANA_CHOICES = [
+        (0, 'Segunda-feira'),
+        (1, 'Terça-feira'),
+        (2, 'Quarta-feira'),
+        (3, 'Quinta-feira'),
+        (4, 'Sexta-feira'),
+        (5, 'Sábado'),
+        (6, 'Domingo'),
+    ]
+    
+    medico = models.ForeignKey(
+        "Usuario",
+        on_delete=models.CASCADE,
+        related_name='horarios_atendimento'
+    )
+    dia_semana = models.IntegerField(choices=DIA_SEMANA_CHOICES)
+    hora_inicio = models.TimeField()
+    hora_fim = models.TimeField()
+    duracao_minutos = models.IntegerField(default=30, help_text="Duração de cada horário da grade")
+    ativo = models.BooleanField(default=True)
+    
+    class Meta:
+        app_label = 'main'
+        db_table = 'horarios_atendimento'
+        ordering = ['medico', 'dia_semana', 'hora_inicio']
+        indexes = [
+            models.Index(fields=['clinica_id', 'medico']),
+        ]
+    
+    def __str__(self):
+        return f"{self.medico_id} - {self.get_dia_semana_display()} {self.hora_inicio}-{self.hora_fim}"
+    
+    def clean(self):
+        errors = {}
+        if self.hora_inicio and self.hora_fim and self.hora_fim <= self.hora_inicio:
+            errors['hora_fim'] = 'O fim do turno deve ser depois do início'
+        if not 5 <= (self.duracao_minutos or 0) <= 480:
+            errors['duracao_minutos'] = 'Duração deve estar entre 5 e 480 minutos'
+        if self.medico_id:
+            if self.medico.clinica_id != self.clinica_id:
+                errors['medico'] = 'Médico não pertence a esta clínica'
+            elif 'medico' not in (self.medico.funcoes or []):
+                errors['medico'] = 'O usuário selecionado não tem a função de médico.'
+        if errors:
+            raise ValidationError(errors)
+    
+    def save(self, *args, **kwargs):
+        self.full_clean()
+        super().save(*args, **kwargs)
+
+
+class AgendaDisponibilidade:
+    """
+    Horários livres de vários médicos num intervalo de datas, calculados em uma
+    passada: uma query para os turnos e outra para os agendamentos do período.
+    Cada (médico, dia) vira um bitmap com um bit por horário da grade do
+    expediente; os agendamentos marcam bits ocupados e os livres saem de
+    grade & ~ocupados.
+    """
+    
+    # Mesmos status que Agendamento.verificar_disponibilidade desconsidera
+    STATUS_QUE_LIBERAM = ['Cancelado', 'Realizado']
+    MAXIMO_DIAS = 31
+    
+    def __init__(self, clinica_id, medicos, data_inicio, data_fim):
+        self.clinica_id = clinica_id
+        self.medicos = list(medicos)
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+        self.grades = self._carregar_grades()
+        self.ocupados = self._carregar_ocupacao()
+    
+    @staticmethod
+    def _minutos(hora):
+        return hora.hour * 60 + hora.minute
+    
+    @staticmethod
+    def _montar_grade(turnos):
+        """[(inicio, fim, duracao)] em minutos -> [(inicio_slot, fim_slot)] ordenado, sem sobreposição."""
+        grade = []
+        for inicio, fim, duracao in sorted(turnos):
+            atual = max(inicio, grade[-1][1] if grade else 0)
+            while atual + duracao <= fim:
+                grade.append((atual, atual + duracao))
+                atual += duracao
+        return grade
+    
+    @classmethod
+    def expediente_padrao(cls):
+        """{dia_semana: [(inicio, fim, duracao)]} a partir da configuração."""
+        turnos = []
+        for faixa in Config.AGENDA_EXPEDIENTE_PADRAO.split(','):
+            if '-' not in faixa:
+                continue
+            inicio, fim = (datetime.strptime(h.strip(), '%H:%M') for h in faixa.split('-', 1))
+            turnos.append((inicio.hour * 60 + inicio.minute, fim.hour * 60 + fim.minute, Config.AGENDA_DURACAO_PADRAO_MINUTOS))
+        dias = [int(d) for d in Config.AGENDA_DIAS_PADRAO.split(',') if d.strip().isdigit()]
+        return {dia: turnos for dia in dias}
+    
+    def _carregar_grades(self):
+        """{medico_id: {dia_semana: [(inicio_slot, fim_slot)]}}"""
+        turnos_por_medico = {}
+        horarios = HorarioAtendimento.objects.filter(
+            clinica_id=self.clinica_id, medico_id__in=[m.id for m in self.medicos], ativo=True
+        ).values_list('medico_id', 'dia_semana', 'hora_inicio', 'hora_fim', 'duracao_minutos')
+        for medico_id, dia, inicio, fim, duracao in horarios:
+            turnos_por_medico.setdefault(medico_id, {}).setdefault(dia, []).append(
+                (self._minutos(inicio), self._minutos(fim), duracao)
+            )
+        
+        padrao = self.expediente_padrao()
+        grades = {}
+        for medico in self.medicos:
+            turnos = turnos_por_medico.get(medico.id, padrao)
+            grades[medico.id] = {dia: self._montar_grade(lista) for dia, lista in turnos.items()}
+        return grades
+    
+    def _carregar_ocupacao(self):
+        """{(medico_id, data): bitmap dos horários ocupados}"""
+        import bisect
+        ocupados = {}
+        agendamentos = Agendamento.objects.filter(
+            clinica_id=self.clinica_id,
+            medico_responsavel_id__in=[m.id for m in self.medicos],
+            data__range=[self.data_inicio, self.data_fim]
+        ).exclude(status__in=self.STATUS_QUE_LIBERAM).values_list('medico_responsavel_id', 'data', 'hora')
+        
+        for medico_id, dia, hora in agendamentos:
+            grade = self.grades.get(medico_id, {}).get(dia.weekday())
+            if not grade:
+                continue
+            minuto = self._minutos(hora)
+            indice = bisect.bisect_right(grade, (minuto, float('inf'))) - 1
+            if indice >= 0 and minuto < grade[indice][1]:
+                ocupados[(medico_id, dia)] = ocupados.get((medico_id, dia), 0) | (1 << indice)
+        return ocupados
+    
+    def horarios_livres(self, medico_id, dia, a_partir_de=None):
+        """Inícios ('HH:MM') dos horários livres do médico no dia."""
+        grade = self.grades.get(medico_id, {}).get(dia.weekday(), [])
+        livres = ((1 << len(grade)) - 1) & ~self.ocupados.get((medico_id, dia), 0)
+        resultado = []
+        indice = 0
+        while livres:
+            if livres & 1:
+                inicio = grade[indice][0]
+                if a_partir_de is None or inicio >= a_partir_de:
+                    resultado.append(f"{inicio // 60:02d}:{inicio % 60:02d}")
+            livres >>= 1
+            indice += 1
+        return resultado
+    
+    def livre(self, medico_id, dia, hora):
+        """True se o horário cai num slot livre da grade do médico."""
+        import bisect
+        grade = self.grades.get(medico_id, {}).get(dia.weekday(), [])
+        minuto = self._minutos(hora)
+        indice = bisect.bisect_right(grade, (minuto, float('inf'))) - 1
+        if indice < 0 or minuto >= grade[indice][1]:
+            return False
+        return not (self.ocupados.get((medico_id, dia), 0) >> indice) & 1
+    
+    def resumo(self):
+        """Disponibilidade de todos os médicos, dia a dia."""
+        agora = timezone.localtime()
+        medicos = []
+        for medico in self.medicos:
+            dias = []
+            dia = self.data_inicio
+            while dia <= self.data_fim:
+                if dia >= agora.date():
+                    a_partir_de = agora.hour * 60 + agora.minute + 1 if dia == agora.date() else None
+                    horarios = self.horarios_livres(medico.id, dia, a_partir_de)
+                    dias.append({
+                        'data': dia.isoformat(),
+                        'dia_semana': dia.weekday(),
+                        'horarios': horarios,
+                        'total_livres': len(horarios),
+                    })
+                dia += timedelta(days=1)
+            medicos.append({'medico_id': medico.id, 'medico_nome': medico.nome_completo, 'dias': dias})
+        return medicos
+
+
+class AgendamentoLote:
+    """
+    Criação de vários agendamentos numa única requisição (séries recorrentes ou
+    migração de agenda). Pacientes e médicos são carregados uma vez, os conflitos
+    de todo o lote saem de uma única query e a gravação é um bulk_create dentro
+    de uma transação. O resultado é devolvido item a item.
+    """
+    
+    MAXIMO_ITENS = 500
+    CAMPOS = ['paciente', 'medico_responsavel', 'convenio', 'servico', 'tipo', 'data', 'hora', 'valor', 'observacoes', 'status']
+    
+    def __init__(self, clinica_id, itens):
+        self.clinica_id = clinica_id
+        self.itens = itens
+        self.resultados = [{'indice': i, 'data': item.get('data'), 'hora': item.get('hora')} for i, item in enumerate(itens)]
+    
+    @classmethod
+    def expandir_recorrencia(cls, base, recorrencia):
+        """
+        Gera os itens de uma regra semanal, ex.: toda terça às 14:00 por 12 semanas
+        {"data_inicio": "2025-10-07", "dias_semana": [1], "hora": "14:00", "semanas": 12}
+        Aceita "intervalo_semanas" (quinzenal = 2) e "ocorrencias" no lugar de "semanas".
+        """
+        data_inicio = date.fromisoformat(str(recorrencia['data_inicio']))
+        dias_semana = {int(d) for d in recorrencia.get('dias_semana', [data_inicio.weekday()])}
+        if not dias_semana or not dias_semana <= set(range(7)):
+            raise ValueError('dias_semana deve conter valores de 0 (segunda) a 6 (domingo)')
+        horas = recorrencia.get('horas') or [recorrencia['hora']]
+        intervalo = max(int(recorrencia.get('intervalo_semanas', 1)), 1)
+        ocorrencias = int(recorrencia['ocorrencias']) if recorrencia.get('ocorrencias') else None
+        semanas = int(recorrencia.get('semanas', 0)) or None
+        if not ocorrencias and not semanas:
+            raise ValueError('Informe "semanas" ou "ocorrencias"')
+        data_fim = data_inicio + timedelta(weeks=semanas * intervalo) if semanas else None
+        
+        itens = []
+        dia = data_inicio
+        while len(itens) < cls.MAXIMO_ITENS + 1:
+            if data_fim and dia >= data_fim:
+                break
+            if ocorrencias and len(itens) >= ocorrencias * len(horas):
+                break
+            if dia.weekday() in dias_semana and ((dia - data_inicio).days // 7) % intervalo == 0:
+                for hora in horas:
+                    itens.append({**base, 'data': dia.isoformat(), 'hora': hora})
+            dia += timedelta(days=1)
+        return itens
+    
+    def _validar(self):
+        """Monta as instâncias e aplica as mesmas validações do model sem consultas por item."""
+        ids_pacientes = {self._inteiro(item.get('paciente')) for item in self.itens} - {None}
+        ids_medicos = {self._inteiro(item.get('medico_responsavel')) for item in self.itens} - {None}
+        pacientes = Paciente.objects.filter(clinica_id=self.clinica_id, id__in=ids_pacientes).in_bulk()
+        medicos = Usuario.objects.filter(clinica_id=self.clinica_id, id__in=ids_medicos).in_bulk()
+        
+        validos = []
+        for resultado, item in zip(self.resultados, self.itens):
+            paciente = pacientes.get(self._inteiro(item.get('paciente')))
+            medico_id = self._inteiro(item.get('medico_responsavel'))
+            if not paciente:
+                resultado.update(status='invalido', erros={'paciente': ['Paciente não encontrado nesta clínica']})
+                continue
+            if item.get('medico_responsavel') and medico_id not in medicos:
+                resultado.update(status='invalido', erros={'medico_responsavel': ['Médico não encontrado nesta clínica']})
+                continue
+            
+            agendamento = Agendamento(
+                clinica_id=self.clinica_id,
+                **{campo: item[campo] for campo in self.CAMPOS if campo in item and campo not in ('paciente', 'medico_responsavel')}
+            )
+            agendamento.paciente = paciente
+            agendamento.medico_responsavel = medicos.get(medico_id)
+            agendamento.paciente_nome = paciente.nome_completo
+            agendamento.paciente_cpf = paciente.cpf
+            if not agendamento.convenio:
+                agendamento.convenio = paciente.convenio
+            try:
+                # As FKs já foram conferidas acima; validá-las aqui faria uma query por item
+                agendamento.clean_fields(exclude=['paciente', 'medico_responsavel'])
+                agendamento.clean()
+            except ValidationError as e:
+                resultado.update(status='invalido', erros=e.message_dict)
+                continue
+            resultado.update(data=agendamento.data.isoformat(), hora=agendamento.hora.strftime('%H:%M'))
+            validos.append((resultado, agendamento))
+        return validos
+    
+    @staticmethod
+    def _inteiro(valor):
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            return None
+    
+    def _ocupados(self, agendamentos):
+        """Horários já ocupados (medico_id, data, hora) para todo o lote, em uma query."""
+        medicos = {a.medico_responsavel_id for a in agendamentos}
+        filtro_medico = Q(medico_responsavel_id__in=[m for m in medicos if m])
+        if None in medicos:
+            filtro_medico |= Q(medico_responsavel__isnull=True)
+        return set(Agendamento.objects.filter(
+            filtro_medico,
+            clinica_id=self.clinica_id,
+            data__in={a.data for a in agendamentos},
+        ).exclude(status__in=['Cancelado', 'Realizado']).values_list('medico_responsavel_id', 'data', 'hora'))
+    
+    def executar(self, parcial=False):
+        """
+        Valida e grava o lote. Com parcial=False (padrão) nada é gravado se algum
+        item for inválido ou conflitar; com parcial=True grava apenas os que passaram.
+        Retorna (quantidade criada, resultados por item).
+        """
+        validos = self._validar()
+        
+        with transaction.atomic():
+            ocupados = self._ocupados([a for _, a in validos]) if validos else set()
+            a_criar = []
+            for resultado, agendamento in validos:
+                chave = (agendamento.medico_responsavel_id, agendamento.data, agendamento.hora)
+                if chave in ocupados:
+                    resultado.update(status='conflito', erros={'hora': ['Horário indisponível para este médico']})
+                    continue
+                ocupados.add(chave)  # também impede duplicidade dentro do próprio lote
+                a_criar.append((resultado, agendamento))
+            
+            if not parcial and len(a_criar) < len(self.itens):
+                for resultado, _ in a_criar:
+                    resultado['status'] = 'nao_criado'
+                return 0, self.resultados
+            
+            criados = Agendamento.objects.bulk_create([a for _, a in a_criar], batch_size=200)
+        
+        for (resultado, _), agendamento in zip(a_criar, criados):
+            resultado.update(status='criado', id=agendamento.pk)
+        return len(criados), self.resultados
+
+# ============================================
+# MODEL CONSULTA
+# ============================================
+
+class Consulta(TenantModel):
+    """Model de Consulta"""
+    
+    STATUS_CHOICES = [
+        ('agendada', 'Agendada'),
+        ('confirmada', 'Confirmada'),
+        ('em_atendimento', 'Em Atendimento'),
+        ('gravando', 'Gravando Consulta'),
+        ('transcrevendo', 'Transcrevendo'),
+        ('gerando_documentos', 'Gerando Documentos'),
+        ('aguardando_revisao', 'Aguardando Revisão'),
+        ('finalizada', 'Finalizada'),
+        ('cancelada', 'Cancelada'),
         ('faltou', 'Faltou'),
     ]
     
@@ -1341,6 +2741,8 @@ class Receita(TenantModel):
     
     def marcar_como_recebida(self, data_recebimento=None, forma_pagamento=None, usuario_id=None, usuario_nome=None):
         """Marca a receita como recebida com auditoria"""
+        import copy
+        anterior = copy.copy(self)
         self.status = 'recebida'
         self.data_recebimento = data_recebimento or date.today()
         if forma_pagamento:
@@ -1352,6 +2754,7 @@ class Receita(TenantModel):
         self.data_operacao_recebimento = timezone.now()
         
         self.save()
+        registrar_alteracao_financeira(anterior, self, usuario_id, usuario_nome)
     
     @classmethod
     def atualizar_status_vencidos(cls, clinica_id):
@@ -1451,6 +2854,8 @@ class Despesa(TenantModel):
     
     def marcar_como_paga(self, data_pagamento=None, forma_pagamento=None, usuario_id=None, usuario_nome=None):
         """Marca a despesa como paga com auditoria"""
+        import copy
+        anterior = copy.copy(self)
         self.status = 'paga'
         self.data_pagamento = data_pagamento or date.today()
         if forma_pagamento:
@@ -1462,6 +2867,7 @@ class Despesa(TenantModel):
         self.data_operacao_pagamento = timezone.now()
         
         self.save()
+        registrar_alteracao_financeira(anterior, self, usuario_id, usuario_nome)
     
     @classmethod
     def atualizar_status_vencidos(cls, clinica_id):
@@ -1606,11 +3012,11 @@ class Transcricao(TenantModel):
             self.marcar_como_processando()
             
             # Verificar se Gemini está configurado
-            if not Config.configure_gemini():
+            if not RegistroIA.disponivel():
                 raise Exception("API Gemini não configurada")
             
             # Preparar o modelo
-            model = genai.GenerativeModel(Config.GEMINI_MODEL)
+            model = RegistroIA.modelo('transcricao_legado')
             
             # Preparar prompt para contexto médico
             prompt = """
@@ -1781,6 +3187,97 @@ class Clinica(models.Model):
     def __str__(self):
         return self.nome
 
+# ============================================
+# HASH DE SENHAS (PBKDF2)
+# ============================================
+
+class HashSenha:
+    """
+    Senhas em PBKDF2-SHA256 no formato do Django (pbkdf2_sha256$iteracoes$sal$hash),
+    com custo definido por SENHA_PBKDF2_ITERACOES. Hashes SHA-256 antigos (sem sal)
+    continuam aceitos e são convertidos no primeiro login bem-sucedido.
+
+    Verificações bem-sucedidas ficam num cache em memória por LOGIN_CACHE_SEGUNDOS,
+    guardando apenas um HMAC da senha com uma chave aleatória do processo; trocar a
+    senha muda o hash gravado e invalida a entrada.
+    """
+
+    _semaforo = threading.BoundedSemaphore(max(1, Config.LOGIN_HASH_SIMULTANEOS))
+    _lock = threading.Lock()
+    _chave_cache = secrets.token_bytes(32)
+    _cache = {}
+    CACHE_MAXIMO = 2048
+
+    @staticmethod
+    def _hasher():
+        from django.contrib.auth.hashers import PBKDF2PasswordHasher
+        return PBKDF2PasswordHasher()
+
+    @classmethod
+    def gerar(cls, senha):
+        hasher = cls._hasher()
+        with cls._semaforo:
+            return hasher.encode(senha, hasher.salt(), iterations=Config.SENHA_PBKDF2_ITERACOES)
+
+    @staticmethod
+    def legado(codificado):
+        return bool(re.fullmatch(r'[0-9a-f]{64}', codificado or ''))
+
+    @classmethod
+    def precisa_atualizar(cls, codificado):
+        if cls.legado(codificado):
+            return True
+        try:
+            algoritmo, iteracoes, _, _ = codificado.split('$', 3)
+            return algoritmo != 'pbkdf2_sha256' or int(iteracoes) != Config.SENHA_PBKDF2_ITERACOES
+        except ValueError:
+            return True
+
+    @classmethod
+    def _marca(cls, senha, codificado):
+        import hmac
+        import hashlib
+        return hmac.new(cls._chave_cache, f'{codificado}\x00{senha}'.encode(), hashlib.sha256).digest()
+
+    @classmethod
+    def verificar(cls, senha, codificado):
+        import hmac
+        import hashlib
+        import time
+
+        if not codificado:
+            return False
+
+        if Config.LOGIN_CACHE_SEGUNDOS > 0:
+            marca = cls._marca(senha, codificado)
+            with cls._lock:
+                validade = cls._cache.get(marca)
+            if validade and validade > time.monotonic():
+                return True
+
+        if cls.legado(codificado):
+            ok = hmac.compare_digest(codificado, hashlib.sha256(senha.encode()).hexdigest())
+        else:
+            with cls._semaforo:
+                ok = cls._hasher().verify(senha, codificado)
+
+        if ok and Config.LOGIN_CACHE_SEGUNDOS > 0:
+            with cls._lock:
+                if len(cls._cache) >= cls.CACHE_MAXIMO:
+                    agora = time.monotonic()
+                    cls._cache = {m: v for m, v in cls._cache.items() if v > agora}
+                    if len(cls._cache) >= cls.CACHE_MAXIMO:
+                        cls._cache.clear()
+                cls._cache[marca] = time.monotonic() + Config.LOGIN_CACHE_SEGUNDOS
+        return ok
+
+    @classmethod
+    def simular_verificacao(cls, senha):
+        """Gasta o mesmo tempo de uma verificação real (login com e-mail inexistente)."""
+        hasher = cls._hasher()
+        with cls._semaforo:
+            hasher.encode(senha, 'intellimed', iterations=Config.SENHA_PBKDF2_ITERACOES)
+
 class Usuario(models.Model):
     """Model de Usuário"""
     
@@ -1881,14 +3378,16 @@ class Usuario(models.Model):
         super().save(*args, **kwargs)
     
     def set_password(self, raw_password):
-        """Define senha com hash"""
-        import hashlib
-        self.password = hashlib.sha256(raw_password.encode()).hexdigest()
+        """Define senha com hash (PBKDF2-SHA256)"""
+        self.password = HashSenha.gerar(raw_password)
     
     def check_password(self, raw_password):
-        """Verifica senha"""
-        import hashlib
-        return self.password == hashlib.sha256(raw_password.encode()).hexdigest()
+        """Verifica senha; hashes antigos ou com outro custo são refeitos e gravados na hora"""
+        ok = HashSenha.verificar(raw_password, self.password)
+        if ok and self.pk and HashSenha.precisa_atualizar(self.password):
+            self.set_password(raw_password)
+            Usuario.objects.filter(pk=self.pk).update(password=self.password)
+        return ok
     
     def generate_jwt_token(self):
         """Gera token JWT para o usuário"""
@@ -1903,12 +3402,131 @@ class Usuario(models.Model):
             'funcoes': self.funcoes,  # Usando o novo campo de lista
             # --- FIM DA ALTERAÇÃO ---
             'clinica_id': self.clinica_id if self.clinica else None,
-            'exp': agora + timedelta(hours=24), 'iat': agora
+            'exp': agora + timedelta(hours=24), 'iat': agora,
+            # Épocas de revogação vigentes (ver RevogacaoTokens)
+            'eu': RevogacaoTokens.epoca('usuario', self.id),
         }
+        if self.clinica_id:
+            payload['ec'] = RevogacaoTokens.epoca('clinica', self.clinica_id)
     
         token = jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm=Config.JWT_ALGORITHM)
         return token
 
+class EpocaToken(models.Model):
+    """Época atual dos tokens de um usuário ou clínica; incrementada a cada revogação."""
+
+    ESCOPO_CHOICES = [
+        ('usuario', 'Usuário'),
+        ('clinica', 'Clínica'),
+    ]
+
+    escopo = models.CharField(max_length=20, choices=ESCOPO_CHOICES)
+    alvo_id = models.IntegerField()
+    epoca = models.IntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'tokens_epocas'
+        unique_together = [('escopo', 'alvo_id')]
+
+    def __str__(self):
+        return f"{self.get_escopo_display()} {self.alvo_id} - época {self.epoca}"
+
+class MensagemWhatsApp(TenantModel):
+    """
+    Mensagem recebida pelo webhook da Evolution. O id da mensagem (key.id) é
+    único, o que torna o webhook idempotente frente aos reenvios da Evolution.
+    """
+
+    STATUS_CHOICES = [
+        ('pendente', 'Pendente'),
+        ('respondida', 'Respondida'),
+        ('erro', 'Erro'),
+    ]
+
+    mensagem_id = models.CharField(max_length=128, unique=True)
+    instancia = models.CharField(max_length=100)
+    remote_jid = models.CharField(max_length=100)
+    texto = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
+    processo = models.IntegerField(null=True, blank=True, help_text="PID do processo que tem a mensagem na fila")
+    recebida_em = models.DateTimeField(auto_now_add=True)
+    respondida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'whatsapp_mensagens'
+        indexes = [
+            models.Index(fields=['clinica_id', 'remote_jid', 'recebida_em']),
+        ]
+
+    def __str__(self):
+        return f"{self.remote_jid} - {self.get_status_display()}"
+
+class ConversaWhatsApp(TenantModel):
+    """
+    Memória da secretária virtual por (clínica, número): as últimas mensagens na
+    íntegra (no máximo WHATSAPP_HISTORICO_MAXIMO) e um resumo do que ficou para
+    trás. Quando a janela estoura, a metade mais antiga é incorporada ao resumo.
+    """
+
+    numero = models.CharField(max_length=30)
+    resumo = models.TextField(blank=True, default='')
+    historico = models.JSONField(default=list, blank=True, help_text="[{'papel': 'paciente'|'secretaria', 'texto': ..., 'em': ISO}]")
+    atualizada_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'whatsapp_conversas'
+        unique_together = [('clinica_id', 'numero')]
+
+    def __str__(self):
+        return f"{self.numero} ({len(self.historico)} mensagens)"
+
+    def adicionar(self, papel, texto):
+        self.historico.append({'papel': papel, 'texto': texto, 'em': timezone.localtime().isoformat(timespec='minutes')})
+
+    def historico_formatado(self):
+        nomes = {'paciente': 'Paciente', 'secretaria': 'Secretária'}
+        return '\n'.join(
+            f"[{m['em'][:16].replace('T', ' ')}] {nomes.get(m['papel'], m['papel'])}: {m['texto']}" for m in self.historico
+        )
+
+    def compactar(self):
+        """Se a janela passou do limite, resume a metade mais antiga (uma chamada de IA) e salva."""
+        if len(self.historico) <= Config.WHATSAPP_HISTORICO_MAXIMO:
+            return
+        lidas = len(self.historico)
+        corte = lidas - Config.WHATSAPP_HISTORICO_MAXIMO // 2
+        antigas = ConversaWhatsApp(historico=self.historico[:corte])
+        prompt = f"""
+    Atualize o resumo de uma conversa de WhatsApp entre a secretária de uma clínica e um paciente.
+    Mantenha apenas o que for útil para continuar o atendimento: nome do paciente, o que ele
+    deseja, médico/especialidade, datas e horários propostos ou aceitos, pendências.
+    No máximo 6 linhas, sem inventar nada.
+    
+    Resumo atual:
+    {self.resumo or '(vazio)'}
+    
+    Mensagens a incorporar:
+    {antigas.historico_formatado()}
+    
+    Novo resumo:
+    """
+        try:
+            self.resumo = RegistroIA.gerar('secretaria', prompt, clinica_id=self.clinica_id).text.strip()
+        except Exception as e:
+            # Sem resumo novo a janela continua limitada; só se perde o detalhe das mensagens antigas
+            print(f"⚠️ Falha ao resumir conversa de {self.numero}: {e}")
+        with transaction.atomic():
+            # Uma resposta pode ter sido gravada durante o resumo: preserva o que chegou depois da leitura
+            atual = ConversaWhatsApp.objects.select_for_update().filter(pk=self.pk).values_list('historico', flat=True).first()
+            if atual and len(atual) > lidas:
+                self.historico = self.historico + atual[lidas:]
+            self.historico = self.historico[corte:]
+            self.save(update_fields=['resumo', 'historico', 'atualizada_em'])
+
 class Plano(models.Model):
     """
     Model para definir os planos de assinatura do sistema.
@@ -2012,6 +3630,326 @@ class ConsumoIA(models.Model):
     
 ConsumoIA.TIPO_CONSUMO_CHOICES_DICT = dict(ConsumoIA.TIPO_CONSUMO_CHOICES)
 
+class CacheResultadoIA(TenantModel):
+    """
+    Resposta bruta de uma chamada de IA, indexada pelo hash do que foi enviado
+    (arquivo, prompt, versão do prompt e modelo). Cada clínica tem seu próprio cache.
+    """
+    chave = models.CharField(max_length=64)
+    tipo = models.CharField(max_length=50)
+    modelo_ia = models.CharField(max_length=100)
+    versao_prompt = models.CharField(max_length=20)
+    resposta = models.TextField()
+    acertos = models.IntegerField(default=0)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    expira_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'cache_resultados_ia'
+        unique_together = [('clinica_id', 'chave')]
+
+    def __str__(self):
+        return f"Cache IA {self.tipo} ({self.chave[:12]}) - Clínica {self.clinica_id}"
+
+# ============================================
+# MODEL EVENTO DE AUDITORIA
+# ============================================
+
+class EventoAuditoria(TenantModel):
+    """
+    Log de auditoria append-only. Cada evento é gravado no momento em que
+    acontece (exame cadastrado/revisado, documento gerado/editado, receita
+    recebida, despesa paga) já com os dados exibidos nas telas, e nunca é
+    alterado. Recebimento/pagamento desfeito, excluído ou com valor alterado
+    gera um estorno (valor negativo), para que as somas reflitam o saldo real. As telas de auditoria leem apenas esta tabela, paginando por
+    cursor sobre o índice (clinica_id, timestamp).
+    """
+
+    TIPO_CHOICES = [
+        ('exame_gerado', 'Exame Gerado'),
+        ('exame_editado', 'Exame Editado'),
+        ('documento_gerado', 'Documento Gerado'),
+        ('documento_editado', 'Documento Editado'),
+        ('receita_recebida', 'Receita'),
+        ('despesa_paga', 'Despesa'),
+        ('receita_estornada', 'Estorno de Receita'),
+        ('despesa_estornada', 'Estorno de Despesa'),
+    ]
+
+    CATEGORIA_CHOICES = [
+        ('clinico', 'Clínico'),
+        ('financeiro', 'Financeiro'),
+    ]
+
+    CATEGORIA_POR_TIPO = {
+        'exame_gerado': 'clinico',
+        'exame_editado': 'clinico',
+        'documento_gerado': 'clinico',
+        'documento_editado': 'clinico',
+        'receita_recebida': 'financeiro',
+        'despesa_paga': 'financeiro',
+        'receita_estornada': 'financeiro',
+        'despesa_estornada': 'financeiro',
+    }
+
+    TIPOS_RECEITA = ('receita_recebida', 'receita_estornada')
+    TIPOS_DESPESA = ('despesa_paga', 'despesa_estornada')
+
+    ROTULOS_DOCUMENTO = {
+        'atestado': 'Atestado',
+        'anamnese': 'Anamnese',
+        'evolucao': 'Evolução',
+        'prescricao': 'Prescrição',
+        'relatorio': 'Relatório',
+    }
+
+    timestamp = models.DateTimeField(default=timezone.now)
+    categoria = models.CharField(max_length=20, choices=CATEGORIA_CHOICES)
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES)
+
+    # Objeto auditado (exame, consulta, receita, despesa)
+    objeto_tipo = models.CharField(max_length=30)
+    objeto_id = models.IntegerField(null=True, blank=True)
+
+    # Cópia dos dados no momento do evento
+    paciente_id = models.IntegerField(null=True, blank=True)
+    paciente_nome = models.CharField(max_length=255, blank=True, default='')
+    usuario_id = models.IntegerField(null=True, blank=True)
+    usuario_nome = models.CharField(max_length=255, blank=True, default='')
+    detalhes = models.CharField(max_length=500, blank=True, default='')
+    valor = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    data_referencia = models.DateField(null=True, blank=True, help_text="Data de recebimento/pagamento (filtros por mês)")
+    dados = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        app_label = 'main'
+        db_table = 'auditoria_eventos'
+        indexes = [
+            models.Index(fields=['clinica_id', 'timestamp']),
+            models.Index(fields=['clinica_id', 'categoria', 'timestamp']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError("Eventos de auditoria não podem ser alterados")
+        if not self.categoria:
+            self.categoria = self.CATEGORIA_POR_TIPO.get(self.tipo, '')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.objeto_tipo} {self.objeto_id} - Clínica {self.clinica_id}"
+
+
+def _data_hora_consciente(valor):
+    """datetime (ou string ISO) com fuso; None se não for possível interpretar."""
+    if valor is None:
+        return None
+    if isinstance(valor, str):
+        try:
+            valor = datetime.fromisoformat(valor.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(valor, datetime):
+        valor = datetime.combine(valor, datetime.min.time())
+    if timezone.is_naive(valor):
+        valor = timezone.make_aware(valor)
+    return valor
+
+
+def _evento_auditoria_exame(exame, tipo):
+    """Campos do evento 'exame_gerado' ou 'exame_editado' a partir do exame."""
+    tipo_exame = exame.tipo_exame_identificado_ia or exame.get_tipo_exame_display()
+    if tipo == 'exame_gerado':
+        usuario_nome = exame.medico_solicitante or 'Sistema'
+        detalhes = f"Tipo: {tipo_exame}"
+        if exame.status == 'erro_ia':
+            detalhes += " (falha na interpretação por IA)"
+        momento = exame.data_cadastro
+    else:
+        usuario_nome = exame.medico_revisor_nome or 'Não identificado'
+        detalhes = f"Revisão do Laudo de {tipo_exame}"
+        momento = exame.data_revisao
+    return {
+        'clinica_id': exame.clinica_id,
+        'tipo': tipo,
+        'timestamp': _data_hora_consciente(momento) or timezone.now(),
+        'objeto_tipo': 'exame',
+        'objeto_id': exame.id,
+        'paciente_id': exame.paciente_id,
+        'paciente_nome': exame.paciente.nome_completo if exame.paciente_id else 'N/A',
+        'usuario_nome': usuario_nome,
+        'detalhes': detalhes,
+    }
+
+
+def _evento_auditoria_documento(consulta, tipo_documento, editado, usuario_nome=None, momento=None):
+    """Campos do evento 'documento_gerado' ou 'documento_editado' de uma consulta."""
+    rotulo = EventoAuditoria.ROTULOS_DOCUMENTO.get(tipo_documento, tipo_documento)
+    return {
+        'clinica_id': consulta.clinica_id,
+        'tipo': 'documento_editado' if editado else 'documento_gerado',
+        'timestamp': _data_hora_consciente(momento) or timezone.now(),
+        'objeto_tipo': 'consulta',
+        'objeto_id': consulta.id,
+        'paciente_id': consulta.paciente_id,
+        'paciente_nome': consulta.paciente.nome_completo if consulta.paciente_id else 'N/A',
+        'usuario_nome': usuario_nome or consulta.medico_responsavel or 'Sistema',
+        'detalhes': f"Tipo: {rotulo}",
+        'dados': {'tipo_documento': tipo_documento},
+    }
+
+
+def _evento_auditoria_financeiro(lancamento, estorno=False, usuario_id=None, usuario_nome=None):
+    """
+    Campos do evento 'receita_recebida' ou 'despesa_paga' de um lançamento.
+    Com estorno=True, o evento '*_estornada' com o valor negativo, na mesma data
+    de referência do recebimento/pagamento estornado e com o usuário que desfez.
+    """
+    if isinstance(lancamento, Receita):
+        tipo, objeto_tipo = 'receita_recebida', 'receita'
+        data_referencia = lancamento.data_recebimento
+        momento = lancamento.data_operacao_recebimento
+        usuario_original = (lancamento.usuario_recebimento_id, lancamento.usuario_recebimento_nome)
+        extras = {'paciente': lancamento.paciente.nome_completo if lancamento.paciente_id else 'N/A'}
+    else:
+        tipo, objeto_tipo = 'despesa_paga', 'despesa'
+        data_referencia = lancamento.data_pagamento
+        momento = lancamento.data_operacao_pagamento
+        usuario_original = (lancamento.usuario_pagamento_id, lancamento.usuario_pagamento_nome)
+        extras = {'fornecedor': lancamento.fornecedor or 'N/A'}
+
+    if isinstance(data_referencia, str):
+        data_referencia = date.fromisoformat(data_referencia[:10])
+
+    valor = lancamento.valor
+    if estorno:
+        tipo = 'receita_estornada' if objeto_tipo == 'receita' else 'despesa_estornada'
+        valor = -Decimal(str(valor or 0))
+        momento = timezone.now()
+    else:
+        usuario_id, usuario_nome = usuario_original
+
+    return {
+        'clinica_id': lancamento.clinica_id,
+        'tipo': tipo,
+        'timestamp': _data_hora_consciente(momento or data_referencia) or timezone.now(),
+        'objeto_tipo': objeto_tipo,
+        'objeto_id': lancamento.id,
+        'paciente_id': getattr(lancamento, 'paciente_id', None),
+        'paciente_nome': extras.get('paciente', ''),
+        'usuario_id': usuario_id,
+        'usuario_nome': usuario_nome or '',
+        'detalhes': lancamento.descricao,
+        'valor': valor,
+        'data_referencia': data_referencia,
+        'dados': dict(
+            extras,
+            categoria=lancamento.categoria.nome if lancamento.categoria_id else None,
+            categoria_cor=lancamento.categoria.cor if lancamento.categoria_id else None,
+            forma_pagamento=lancamento.forma_pagamento or '',
+            observacoes=lancamento.observacoes or '',
+            # Lançamentos antigos não registravam a hora da operação
+            hora_registrada=momento is not None,
+        ),
+    }
+
+
+def registrar_evento_auditoria(**campos):
+    """
+    Grava um evento no log de auditoria. Uma falha aqui é apenas logada: nunca
+    interrompe a operação que está sendo auditada.
+    """
+    try:
+        EventoAuditoria.objects.create(**campos)
+    except Exception as e:
+        print(f"⚠️ Auditoria: falha ao registrar '{campos.get('tipo')}' da clínica {campos.get('clinica_id')}: {e}")
+
+
+def _quitado(lancamento):
+    return lancamento.status == ('recebida' if isinstance(lancamento, Receita) else 'paga')
+
+
+def _data_quitacao(lancamento):
+    return str(lancamento.data_recebimento if isinstance(lancamento, Receita) else lancamento.data_pagamento)
+
+
+def registrar_alteracao_financeira(anterior, atual, usuario_id=None, usuario_nome=None):
+    """
+    Eventos de uma alteração de lançamento (cópia de antes e depois de salvar):
+    estorna o recebimento/pagamento anterior se ele foi desfeito ou mudou de
+    valor/data, e registra o novo se o lançamento está quitado agora.
+    """
+    antes, depois = _quitado(anterior), _quitado(atual)
+    mudou = Decimal(str(anterior.valor or 0)) != Decimal(str(atual.valor or 0)) or _data_quitacao(anterior) != _data_quitacao(atual)
+    if antes and (not depois or mudou):
+        registrar_evento_auditoria(**_evento_auditoria_financeiro(anterior, estorno=True, usuario_id=usuario_id, usuario_nome=usuario_nome))
+    if depois and (not antes or mudou):
+        registrar_evento_auditoria(**_evento_auditoria_financeiro(atual))
+
+
+def excluir_lancamentos_com_estorno(queryset, usuario_id=None, usuario_nome=None):
+    """Exclui receitas/despesas registrando o estorno das que estavam recebidas/pagas."""
+    if queryset.model is Receita:
+        quitados = queryset.filter(status='recebida').select_related('categoria', 'paciente')
+    else:
+        quitados = queryset.filter(status='paga').select_related('categoria')
+    for lancamento in quitados:
+        registrar_evento_auditoria(**_evento_auditoria_financeiro(lancamento, estorno=True, usuario_id=usuario_id, usuario_nome=usuario_nome))
+    return queryset.delete()
+
+
+def popular_auditoria_historica(clinica_id=None):
+    """
+    Preenche o log de auditoria a partir dos exames, documentos e lançamentos
+    já existentes. Sem clinica_id roda apenas enquanto a tabela estiver vazia;
+    com clinica_id refaz o histórico só dessa clínica (usado na restauração de
+    backup, depois de apagar os eventos antigos dela).
+    """
+    if clinica_id is None and EventoAuditoria.objects.exists():
+        return 0
+
+    def da_clinica(queryset):
+        return queryset if clinica_id is None else queryset.filter(clinica_id=clinica_id)
+
+    print("📦 Montando histórico de auditoria a partir dos dados existentes...")
+    lote = []
+    total = 0
+
+    def adicionar(campos):
+        nonlocal total
+        campos.setdefault('categoria', EventoAuditoria.CATEGORIA_POR_TIPO[campos['tipo']])
+        lote.append(EventoAuditoria(**campos))
+        if len(lote) >= 500:
+            EventoAuditoria.objects.bulk_create(lote)
+            total += len(lote)
+            lote.clear()
+
+    for exame in da_clinica(Exame.objects.select_related('paciente')).iterator(chunk_size=500):
+        adicionar(_evento_auditoria_exame(exame, 'exame_gerado'))
+        if exame.revisado_por_medico and exame.data_revisao:
+            adicionar(_evento_auditoria_exame(exame, 'exame_editado'))
+
+    consultas = da_clinica(Consulta.objects.select_related('paciente')).exclude(documentos_gerados=[])
+    for consulta in consultas.iterator(chunk_size=500):
+        for doc in consulta.documentos_gerados or []:
+            if isinstance(doc, dict) and doc.get('tipo'):
+                adicionar(_evento_auditoria_documento(
+                    consulta, doc['tipo'], doc.get('editado', False),
+                    usuario_nome=doc.get('medico'), momento=doc.get('data_geracao') or consulta.data_atualizacao
+                ))
+
+    for receita in da_clinica(Receita.objects.filter(status='recebida')).select_related('categoria', 'paciente').iterator(chunk_size=500):
+        adicionar(_evento_auditoria_financeiro(receita))
+    for despesa in da_clinica(Despesa.objects.filter(status='paga')).select_related('categoria').iterator(chunk_size=500):
+        adicionar(_evento_auditoria_financeiro(despesa))
+
+    if lote:
+        EventoAuditoria.objects.bulk_create(lote)
+        total += len(lote)
+    print(f"✅ {total} evento(s) de auditoria importado(s)\n")
+    return total
+
 # ============================================
 # SERIALIZERS - CLÍNICAS E USUÁRIOS
 # ============================================
@@ -2050,8 +3988,59 @@ class ClinicaSerializer(serializers.ModelSerializer):
         # Token e Instance ID não devem ser expostos publicamente sem necessidade, ou devem ser read_only
         read_only_fields = ['id', 'data_cadastro', 'data_atualizacao', 'backup_ultimo_realizado', 'evolution_instance_name', 'evolution_status']
     
+    TIPOS_CONSUMO_IA = ['transcricao_consulta', 'transcricao_exame_geral', 'laudo_exame_ia', 'documento_medico_ia']
+
+    @classmethod
+    def estatisticas_em_lote(cls, clinicas):
+        """
+        Calcula, para várias clínicas de uma vez, o consumo de IA (dia/semana/período
+        da assinatura), o total de usuários e os médicos ativos.
+        Usa um número fixo de consultas (agregação condicional), independente da
+        quantidade de clínicas. O resultado vai no context do serializer em
+        'estatisticas_clinicas'.
+        """
+        from django.db.models import F
+
+        ids = [c.id for c in clinicas]
+        estatisticas = {'ids': set(ids), 'consumo_ia': {}, 'total_usuarios': {}, 'medicos_ativos': {}}
+        if not ids:
+            return estatisticas
+
+        hoje = timezone.now().date()
+        inicio_semana = hoje - timedelta(days=hoje.weekday())
+
+        consumo = ConsumoIA.objects.filter(clinica_id__in=ids).values('clinica_id', 'tipo_consumo').annotate(
+            usado_dia=Count('id', filter=Q(data_consumo__date=hoje)),
+            usado_semana=Count('id', filter=Q(data_consumo__date__range=[inicio_semana, hoje])),
+            usado_mes=Count('id', filter=Q(
+                data_consumo__date__gte=F('clinica__assinatura__data_inicio'),
+                data_consumo__date__lte=F('clinica__assinatura__data_fim'),
+            )),
+        )
+        for linha in consumo:
+            estatisticas['consumo_ia'].setdefault(linha['clinica_id'], {})[linha['tipo_consumo']] = linha
+
+        for linha in Usuario.objects.filter(clinica_id__in=ids).values('clinica_id').annotate(total=Count('id')):
+            estatisticas['total_usuarios'][linha['clinica_id']] = linha['total']
+
+        # 'funcoes' é uma lista JSON (sem lookup 'contains' no SQLite): conta em Python, numa única consulta
+        for clinica_id, funcoes in Usuario.objects.filter(clinica_id__in=ids, status='ativo').values_list('clinica_id', 'funcoes'):
+            if 'medico' in (funcoes or []):
+                estatisticas['medicos_ativos'][clinica_id] = estatisticas['medicos_ativos'].get(clinica_id, 0) + 1
+
+        return estatisticas
+
+    def _estatisticas(self, obj):
+        estatisticas = self.context.get('estatisticas_clinicas')
+        if estatisticas is None or obj.id not in estatisticas['ids']:
+            # Serialização sem o lote pré-calculado: calcula para esta clínica e
+            # guarda no context para os outros campos do mesmo objeto
+            estatisticas = self.estatisticas_em_lote([obj])
+            self.context['estatisticas_clinicas'] = estatisticas
+        return estatisticas
+
     def get_total_usuarios(self, obj):
-        return obj.usuarios.count()
+        return self._estatisticas(obj)['total_usuarios'].get(obj.id, 0)
 
     def get_assinatura_info(self, obj):
         try:
@@ -2073,12 +4062,7 @@ class ClinicaSerializer(serializers.ModelSerializer):
             'usado_dia': 0, 'usado_semana': 0, 'usado_mes': 0,
             'limite_mes': 0, 'restante_mes': 0
         }
-        consumo_final = {
-            'transcricao_consulta': consumo_template.copy(),
-            'transcricao_exame_geral': consumo_template.copy(),
-            'laudo_exame_ia': consumo_template.copy(),
-            'documento_medico_ia': consumo_template.copy(),
-        }
+        consumo_final = {tipo: consumo_template.copy() for tipo in self.TIPOS_CONSUMO_IA}
 
         try:
             assinatura = obj.assinatura
@@ -2088,9 +4072,6 @@ class ClinicaSerializer(serializers.ModelSerializer):
             return consumo_final
 
         plano = assinatura.plano
-        hoje = timezone.now().date()
-        inicio_semana = hoje - timedelta(days=hoje.weekday())
-        
         limites_mes = {
             'transcricao_consulta': plano.limite_transcricao_consulta_mes,
             'transcricao_exame_geral': plano.limite_transcricao_exame_mes,
@@ -2098,16 +4079,13 @@ class ClinicaSerializer(serializers.ModelSerializer):
             'documento_medico_ia': plano.limite_documento_ia_mes,
         }
 
+        consumo_clinica = self._estatisticas(obj)['consumo_ia'].get(obj.id, {})
         for tipo_consumo, limite_mensal in limites_mes.items():
-            consumo_base = ConsumoIA.objects.filter(clinica=obj, tipo_consumo=tipo_consumo)
-            
-            usado_dia = consumo_base.filter(data_consumo__date=hoje).count()
-            usado_semana = consumo_base.filter(data_consumo__date__range=[inicio_semana, hoje]).count()
-            usado_mes = consumo_base.filter(data_consumo__date__range=[assinatura.data_inicio, assinatura.data_fim]).count()
-            
+            usado = consumo_clinica.get(tipo_consumo, {})
+            usado_mes = usado.get('usado_mes', 0)
             consumo_final[tipo_consumo] = {
-                'usado_dia': usado_dia,
-                'usado_semana': usado_semana,
+                'usado_dia': usado.get('usado_dia', 0),
+                'usado_semana': usado.get('usado_semana', 0),
                 'usado_mes': usado_mes,
                 'limite_mes': limite_mensal,
                 'restante_mes': max(0, limite_mensal - usado_mes)
@@ -2124,8 +4102,7 @@ class ClinicaSerializer(serializers.ModelSerializer):
         except AssinaturaClinica.DoesNotExist:
             return limites
         
-        usuarios_da_clinica = Usuario.objects.filter(clinica=obj, status='ativo')
-        medicos_usados = sum(1 for u in usuarios_da_clinica if 'medico' in u.funcoes)
+        medicos_usados = self._estatisticas(obj)['medicos_ativos'].get(obj.id, 0)
         
         limites['usados'] = medicos_usados
         limites['restantes'] = max(0, limites['limite'] - medicos_usados)
@@ -2272,6 +4249,66 @@ class AssinaturaClinicaSerializer(serializers.ModelSerializer):
 # NO ARQUIVO: main.py
 # Substitua a função 'interpretar_exame_com_gemini' inteira
 
+# ============================================
+# CACHE PERSISTENTE DE RESULTADOS DE IA
+# ============================================
+
+# Incrementar sempre que o prompt de interpretação de exames mudar,
+# para que respostas antigas deixem de ser reaproveitadas.
+PROMPT_INTERPRETACAO_EXAME_VERSAO = '1'
+
+def gerar_chave_cache_ia(*partes):
+    """Hash SHA-256 das partes (bytes ou texto) que determinam a resposta da IA."""
+    import hashlib
+    h = hashlib.sha256()
+    for parte in partes:
+        if not isinstance(parte, (bytes, bytearray)):
+            parte = str(parte).encode('utf-8')
+        h.update(len(parte).to_bytes(8, 'big'))
+        h.update(parte)
+    return h.hexdigest()
+
+def obter_cache_ia(clinica_id, chave):
+    """Retorna a resposta em cache (ou None se ausente, expirada ou cache desativado)."""
+    from django.db.models import F
+    if not Config.IA_CACHE_ATIVO:
+        return None
+    registro = CacheResultadoIA.objects.filter(clinica_id=clinica_id, chave=chave).first()
+    if not registro:
+        return None
+    if registro.expira_em <= timezone.now():
+        registro.delete()
+        return None
+    CacheResultadoIA.objects.filter(pk=registro.pk).update(acertos=F('acertos') + 1)
+    return registro.resposta
+
+def salvar_cache_ia(clinica_id, chave, tipo, modelo_ia, versao_prompt, resposta):
+    """Grava (ou renova) uma resposta da IA no cache da clínica."""
+    if not Config.IA_CACHE_ATIVO:
+        return
+    try:
+        CacheResultadoIA.objects.update_or_create(
+            clinica_id=clinica_id,
+            chave=chave,
+            defaults={
+                'tipo': tipo,
+                'modelo_ia': modelo_ia,
+                'versao_prompt': versao_prompt,
+                'resposta': resposta,
+                'expira_em': timezone.now() + timedelta(hours=Config.IA_CACHE_TTL_HORAS),
+            }
+        )
+    except Exception as e:
+        print(f"⚠️ Não foi possível gravar o cache de IA: {e}")
+
+def limpar_cache_ia_expirado():
+    """Remove entradas expiradas do cache de IA (executado pelo agendador)."""
+    removidos, _ = CacheResultadoIA.objects.filter(expira_em__lte=timezone.now()).delete()
+    if removidos:
+        print(f"🧹 Cache de IA: {removidos} entrada(s) expirada(s) removida(s)")
+    return removidos
+
+@Metricas.medir_funcao_ia
 def interpretar_exame_com_gemini(exame_id):
     """
     Interpreta exame médico usando Google Gemini Vision (versão síncrona)
@@ -2298,16 +4335,7 @@ def interpretar_exame_com_gemini(exame_id):
         exame.status = 'processando_ia'
         exame.save(update_fields=['status'])
         
-        if not Config.GEMINI_API_KEY:
-            raise Exception("GEMINI_API_KEY não configurada no .env")
-        
-        if not genai:
-            raise Exception("Biblioteca google-generativeai não instalada")
-        
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        
-        model_name = os.getenv('GEMINI_MODEL_EXAMS', 'gemini-2.5-flash')
-        model = genai.GenerativeModel(model_name)
+        model_name = RegistroIA.nome_modelo('exames')
         
         prompt = f"""
 Você é um sistema de apoio diagnóstico médico especializado. Sua função é interpretar exames médicos com rigor científico.
@@ -2368,30 +4396,38 @@ Baseie sua análise em:
 PROCEDA COM A ANÁLISE:
 """
         
-        if exame.arquivo_exame:
-            if exame.arquivo_exame.startswith('data:'):
-                parts = exame.arquivo_exame.split(',', 1)
-                base64_string = parts[1] if len(parts) > 1 else parts[0]
-                arquivo_bytes = base64.b64decode(base64_string)
-            else:
-                arquivo_bytes = base64.b64decode(exame.arquivo_exame)
-            
-            mime_type = exame.arquivo_tipo or 'image/jpeg'
-            
+        if not exame.arquivo_exame:
+            raise Exception("Nenhum arquivo de exame disponível")
+        
+        if exame.arquivo_exame.startswith('data:'):
+            parts = exame.arquivo_exame.split(',', 1)
+            base64_string = parts[1] if len(parts) > 1 else parts[0]
+            arquivo_bytes = base64.b64decode(base64_string)
+        else:
+            arquivo_bytes = base64.b64decode(exame.arquivo_exame)
+        
+        mime_type = exame.arquivo_tipo or 'image/jpeg'
+        
+        # O prompt já inclui o contexto do paciente e do exame
+        chave_cache = gerar_chave_cache_ia(arquivo_bytes, mime_type, prompt, PROMPT_INTERPRETACAO_EXAME_VERSAO, model_name)
+        response_text = obter_cache_ia(exame.clinica_id, chave_cache)
+        from_cache = response_text is not None
+        
+        if from_cache:
+            print(f"✓ Interpretação do exame {exame.id} servida do cache de IA")
+        else:
             request_options = {"timeout": 120}
             
             if 'image' in mime_type:
                 from PIL import Image
                 import io
                 image = Image.open(io.BytesIO(arquivo_bytes))
-                response = model.generate_content([prompt, image], request_options=request_options)
+                response = RegistroIA.gerar('exames', [prompt, image], clinica_id=exame.clinica_id, request_options=request_options)
             else:
                 arquivo_blob = {"mime_type": mime_type, "data": arquivo_bytes}
-                response = model.generate_content([prompt, arquivo_blob], request_options=request_options)
-        else:
-            raise Exception("Nenhum arquivo de exame disponível")
-        
-        response_text = response.text
+                response = RegistroIA.gerar('exames', [prompt, arquivo_blob], clinica_id=exame.clinica_id, request_options=request_options)
+            
+            response_text = response.text
         
         try:
             json_str = response_text
@@ -2401,6 +4437,10 @@ PROCEDA COM A ANÁLISE:
             json_str = json_str.strip()
             resultado = json.loads(json_str)
             
+            # Só respostas estruturadas válidas são reaproveitadas
+            if not from_cache:
+                salvar_cache_ia(exame.clinica_id, chave_cache, 'laudo_exame_ia', model_name, PROMPT_INTERPRETACAO_EXAME_VERSAO, response_text)
+            
             medico_nome = f"Dr. {exame.medico_solicitante or '[Não informado]'}"
             medico_funcao = "Médico"
             
@@ -2535,7 +4575,8 @@ Data: {timezone.now().strftime('%d/%m/%Y às %H:%M')}
             'sucesso': True,
             'exame_id': exame.id,
             'tempo_processamento': tempo_total,
-            'status': exame.status
+            'status': exame.status,
+            'from_cache': from_cache
         }
         
     except Exception as e:
@@ -2552,10 +4593,369 @@ Data: {timezone.now().strftime('%d/%m/%Y às %H:%M')}
             'erro': str(e)
         }
 
+# ============================================
+# PRÉ-PROCESSAMENTO DE ÁUDIO (FFMPEG)
+# ============================================
+
+AUDIO_PREPROCESSAMENTO = os.getenv('AUDIO_PREPROCESSAMENTO', 'True').lower() in ('true', '1', 'yes')
+AUDIO_TAXA_AMOSTRAGEM = int(os.getenv('AUDIO_TAXA_AMOSTRAGEM', 16000))
+AUDIO_BITRATE = os.getenv('AUDIO_BITRATE', '24k')
+# Pausas mais longas que isto (em segundos, abaixo do limiar em dB) são removidas
+AUDIO_SILENCIO_MIN_SEGUNDOS = float(os.getenv('AUDIO_SILENCIO_MIN_SEGUNDOS', 1.0))
+AUDIO_SILENCIO_LIMIAR_DB = os.getenv('AUDIO_SILENCIO_LIMIAR_DB', '-45dB')
+
+def ffmpeg_disponivel():
+    """True se ffmpeg e ffprobe estiverem no PATH."""
+    import shutil
+    return bool(shutil.which('ffmpeg') and shutil.which('ffprobe'))
+
+def sondar_duracao_audio(caminho):
+    """Duração real do arquivo de áudio em segundos (via ffprobe), ou None."""
+    import subprocess
+    try:
+        saida = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', caminho],
+            capture_output=True, text=True, timeout=60, check=True
+        ).stdout.strip()
+        return float(saida) if saida and saida != 'N/A' else None
+    except Exception as e:
+        print(f"⚠️ ffprobe não conseguiu ler a duração do áudio: {e}")
+        return None
+
+def preprocessar_audio_para_transcricao(audio_bytes, audio_formato='webm'):
+    """
+    Prepara o áudio para envio ao Gemini: converte para mono, reamostra para a taxa
+    de fala (16 kHz), remove pausas longas e recodifica em Opus de baixo bitrate.
+
+    Sem ffmpeg (ou com AUDIO_PREPROCESSAMENTO desativado) o áudio original é
+    devolvido sem alterações.
+
+    Returns:
+        dict com 'audio_bytes', 'mime_type', 'duracao_segundos' (do áudio original,
+        ou None se não foi possível medir) e 'processado'
+    """
+    import subprocess
+    import tempfile
+
+    original = {
+        'audio_bytes': audio_bytes,
+        'mime_type': f"audio/{audio_formato or 'webm'}",
+        'duracao_segundos': None,
+        'processado': False,
+    }
+    if not AUDIO_PREPROCESSAMENTO or not ffmpeg_disponivel():
+        return original
+
+    with tempfile.TemporaryDirectory(prefix='intellimed_audio_') as pasta:
+        entrada = os.path.join(pasta, f"entrada.{audio_formato or 'webm'}")
+        saida = os.path.join(pasta, 'saida.ogg')
+        with open(entrada, 'wb') as f:
+            f.write(audio_bytes)
+
+        original['duracao_segundos'] = sondar_duracao_audio(entrada)
+
+        filtro_silencio = (
+            f"silenceremove=start_periods=1:start_threshold={AUDIO_SILENCIO_LIMIAR_DB}"
+            f":stop_periods=-1:stop_duration={AUDIO_SILENCIO_MIN_SEGUNDOS}:stop_threshold={AUDIO_SILENCIO_LIMIAR_DB}"
+        )
+        comando = [
+            'ffmpeg', '-v', 'error', '-y', '-i', entrada,
+            '-vn', '-ac', '1', '-ar', str(AUDIO_TAXA_AMOSTRAGEM),
+            '-af', filtro_silencio,
+            '-c:a', 'libopus', '-b:a', AUDIO_BITRATE, '-application', 'voip',
+            saida
+        ]
+        try:
+            subprocess.run(comando, capture_output=True, timeout=600, check=True)
+        except subprocess.CalledProcessError as e:
+            print(f"⚠️ ffmpeg falhou; enviando o áudio original. {e.stderr.decode('utf-8', 'ignore')[:300]}")
+            return original
+        except Exception as e:
+            print(f"⚠️ ffmpeg falhou; enviando o áudio original. {e}")
+            return original
+
+        with open(saida, 'rb') as f:
+            processado = f.read()
+
+    if not processado:
+        # Áudio composto só de silêncio: o original é enviado para o Gemini responder SEM_FALA
+        return original
+
+    print(f"✓ Áudio pré-processado: {len(audio_bytes) / 1024:.0f} KB → {len(processado) / 1024:.0f} KB (mono, {AUDIO_TAXA_AMOSTRAGEM} Hz, Opus {AUDIO_BITRATE})")
+    return {
+        'audio_bytes': processado,
+        'mime_type': 'audio/ogg',
+        'duracao_segundos': original['duracao_segundos'],
+        'processado': True,
+    }
+
+AUDIO_SEGMENTO_MINUTOS = float(os.getenv('AUDIO_SEGMENTO_MINUTOS', 8))
+AUDIO_SEGMENTO_SOBREPOSICAO_SEGUNDOS = float(os.getenv('AUDIO_SEGMENTO_SOBREPOSICAO_SEGUNDOS', 3))
+# Distância máxima (em segundos) do corte ideal em que se procura um silêncio
+AUDIO_SEGMENTO_JANELA_SEGUNDOS = 60
+
+def detectar_silencios(caminho, limiar_db='-35dB', duracao_min=0.5):
+    """Lista de (início, fim) em segundos dos silêncios encontrados pelo silencedetect do ffmpeg."""
+    import subprocess
+    processo = subprocess.run(
+        ['ffmpeg', '-hide_banner', '-nostats', '-i', caminho,
+         '-af', f"silencedetect=noise={limiar_db}:d={duracao_min}", '-f', 'null', '-'],
+        capture_output=True, text=True, timeout=600
+    )
+    silencios = []
+    inicio = None
+    for linha in processo.stderr.splitlines():
+        if 'silence_start:' in linha:
+            inicio = float(linha.split('silence_start:')[1].split()[0])
+        elif 'silence_end:' in linha and inicio is not None:
+            fim = float(linha.split('silence_end:')[1].split()[0])
+            silencios.append((inicio, fim))
+            inicio = None
+    return silencios
+
+def _pontos_de_corte_audio(duracao, silencios, alvo):
+    """Escolhe, para cada múltiplo de `alvo`, o meio de silêncio mais próximo como ponto de corte."""
+    cortes = []
+    inicio = 0.0
+    # O último trecho pode ficar até 25% maior que o alvo, evitando um trecho final minúsculo
+    while duracao - inicio > alvo * 1.25:
+        ideal = inicio + alvo
+        candidatos = [
+            (s_ini + s_fim) / 2 for s_ini, s_fim in silencios
+            if abs((s_ini + s_fim) / 2 - ideal) <= AUDIO_SEGMENTO_JANELA_SEGUNDOS
+            and (s_ini + s_fim) / 2 > inicio + alvo / 2
+            # um corte adiantado até a janela não pode deixar um resto menor que 25% do alvo
+            and duracao - (s_ini + s_fim) / 2 >= alvo * 0.25
+        ]
+        corte = min(candidatos, key=lambda meio: abs(meio - ideal)) if candidatos else ideal
+        cortes.append(corte)
+        inicio = corte
+    return cortes
+
+def segmentar_audio(audio_bytes, mime_type):
+    """
+    Divide áudios longos em trechos de ~AUDIO_SEGMENTO_MINUTOS, cortando em silêncios.
+    Cada trecho começa alguns segundos antes do corte anterior (sobreposição), para
+    que uma fala cortada não se perca; a repetição é removida na junção.
+
+    Returns:
+        lista de dicts {'indice', 'inicio', 'fim', 'audio_bytes', 'mime_type'}. Sem
+        ffmpeg, ou para áudios curtos, a lista tem um único trecho com o áudio inteiro.
+    """
+    import subprocess
+    import tempfile
+
+    inteiro = [{'indice': 0, 'inicio': 0.0, 'fim': None, 'audio_bytes': audio_bytes, 'mime_type': mime_type}]
+    alvo = AUDIO_SEGMENTO_MINUTOS * 60
+    if alvo <= 0 or not ffmpeg_disponivel():
+        return inteiro
+
+    extensao = mime_type.split('/')[-1] or 'webm'
+    with tempfile.TemporaryDirectory(prefix='intellimed_seg_') as pasta:
+        entrada = os.path.join(pasta, f"entrada.{extensao}")
+        with open(entrada, 'wb') as f:
+            f.write(audio_bytes)
+
+        duracao = sondar_duracao_audio(entrada)
+        if not duracao or duracao <= alvo * 1.25:
+            return inteiro
+
+        try:
+            cortes = _pontos_de_corte_audio(duracao, detectar_silencios(entrada), alvo)
+        except Exception as e:
+            print(f"⚠️ Falha ao detectar silêncios ({e}); cortando em intervalos fixos.")
+            cortes = _pontos_de_corte_audio(duracao, [], alvo)
+
+        limites = [0.0] + cortes + [duracao]
+        segmentos = []
+        for indice in range(len(limites) - 1):
+            inicio = max(0.0, limites[indice] - (AUDIO_SEGMENTO_SOBREPOSICAO_SEGUNDOS if indice else 0))
+            fim = limites[indice + 1]
+            saida = os.path.join(pasta, f"trecho_{indice}.ogg")
+            try:
+                subprocess.run(
+                    ['ffmpeg', '-v', 'error', '-y', '-ss', f"{inicio:.3f}", '-i', entrada, '-t', f"{fim - inicio:.3f}",
+                     '-vn', '-ac', '1', '-ar', str(AUDIO_TAXA_AMOSTRAGEM), '-c:a', 'libopus', '-b:a', AUDIO_BITRATE, saida],
+                    capture_output=True, timeout=300, check=True
+                )
+            except Exception as e:
+                print(f"⚠️ Falha ao segmentar o áudio ({e}); enviando em um único trecho.")
+                return inteiro
+            with open(saida, 'rb') as f:
+                segmentos.append({'indice': indice, 'inicio': inicio, 'fim': fim, 'audio_bytes': f.read(), 'mime_type': 'audio/ogg'})
+
+    print(f"✓ Áudio de {duracao / 60:.1f} min dividido em {len(segmentos)} trecho(s)")
+    return segmentos
+
 # ============================================
 # FUNÇÃO DE TRANSCRIÇÃO DE CONSULTA COM IA
 # ============================================
 
+TRANSCRICAO_MAX_PARALELO = int(os.getenv('TRANSCRICAO_MAX_PARALELO', 4))
+# Tempo total que um trecho aguarda vaga na IA (limite da clínica/global) antes de desistir
+TRANSCRICAO_ESPERA_VAGA_SEGUNDOS = float(os.getenv('TRANSCRICAO_ESPERA_VAGA_SEGUNDOS', 900))
+
+def _interpretar_json_transcricao(texto):
+    json_str = texto.strip()
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[1].split('```')[0]
+    elif '```' in json_str:
+        json_str = json_str.split('```')[1].split('```')[0]
+    return json.loads(json_str.strip())
+
+def _transcrever_trecho_audio(prompt, audio_bytes, mime_type, clinica_id=None):
+    """Uma chamada ao Gemini para um trecho (ou o áudio inteiro) da consulta."""
+    response = RegistroIA.gerar('transcricao', [
+        prompt,
+        {"mime_type": mime_type, "data": audio_bytes}
+    ], clinica_id=clinica_id, request_options={"timeout": 300})
+    
+    print(f"✓ Resposta recebida!")
+    print(f"Resposta completa do Gemini:")
+    print(response.text)
+    print(f"")
+    
+    return _interpretar_json_transcricao(response.text)
+
+def _palavras_normalizadas(texto):
+    return re.findall(r'\w+', (texto or '').lower())
+
+def _remover_sobreposicao_falas(falas_anteriores, falas_novas, max_palavras=80):
+    """
+    Remove do início de `falas_novas` o que repete o fim de `falas_anteriores`
+    (efeito da sobreposição entre trechos). A repetição é localizada pela maior
+    sequência de palavras em comum entre o fim de um trecho e o início do seguinte.
+    """
+    from difflib import SequenceMatcher
+
+    cauda = [p for fala in falas_anteriores[-5:] for p in _palavras_normalizadas(fala['texto'])][-max_palavras:]
+    cabeca = [p for fala in falas_novas[:5] for p in _palavras_normalizadas(fala['texto'])][:max_palavras]
+    if not cauda or not cabeca:
+        return falas_novas
+
+    m = SequenceMatcher(None, cauda, cabeca, autojunk=False).find_longest_match(0, len(cauda), 0, len(cabeca))
+    # Só é sobreposição se terminar no fim do trecho anterior e começar perto do início do seguinte
+    if m.size < 4 or m.a + m.size < len(cauda) - 3 or m.b > 15:
+        return falas_novas
+
+    a_remover = m.b + m.size
+    resultado = []
+    for fala in falas_novas:
+        if a_remover:
+            ocorrencias = list(re.finditer(r'\w+', fala['texto']))
+            if a_remover >= len(ocorrencias):
+                a_remover -= len(ocorrencias)
+                continue
+            fala = {**fala, 'texto': fala['texto'][ocorrencias[a_remover - 1].end():].lstrip(' ,.;:!?-')}
+            a_remover = 0
+        resultado.append(fala)
+    return resultado
+
+def _normalizar_locutor(locutor):
+    locutor = (locutor or '').strip().upper()
+    if locutor.startswith('M'):
+        return 'MÉDICO'
+    if locutor.startswith('P'):
+        return 'PACIENTE'
+    return locutor
+
+def _juntar_transcricoes_trechos(resultados, segmentos):
+    """Junta as transcrições dos trechos (em ordem) no formato da transcrição única."""
+    falas = []
+    observacoes = []
+    soma_confianca = 0.0
+    soma_duracao = 0.0
+
+    for resultado, segmento in zip(resultados, segmentos):
+        novas = [
+            {'locutor': _normalizar_locutor(f.get('locutor')), 'texto': str(f.get('texto', '')).strip()}
+            for f in (resultado.get('falas') or []) if isinstance(f, dict) and str(f.get('texto', '')).strip()
+        ]
+        completa = (resultado.get('transcricao_completa') or '').strip()
+        if not novas and completa and completa != 'SEM_FALA':
+            novas = [{'locutor': '', 'texto': completa}]
+
+        if falas:
+            novas = _remover_sobreposicao_falas(falas, novas)
+        if novas and falas and novas[0]['locutor'] and novas[0]['locutor'] == falas[-1]['locutor']:
+            falas[-1] = {**falas[-1], 'texto': f"{falas[-1]['texto']} {novas[0]['texto']}"}
+            novas = novas[1:]
+        falas.extend(novas)
+
+        duracao = max((segmento['fim'] or 0) - segmento['inicio'], 1.0)
+        soma_confianca += float(resultado.get('confianca', 0) or 0) * duracao
+        soma_duracao += duracao
+        if resultado.get('observacao'):
+            observacoes.append(f"Trecho {segmento['indice'] + 1}: {resultado['observacao']}")
+
+    return {
+        'transcricao_completa': '\n'.join(
+            f"{f['locutor']}: {f['texto']}" if f['locutor'] else f['texto'] for f in falas
+        ) or 'SEM_FALA',
+        'falas_medico': ' '.join(f['texto'] for f in falas if f['locutor'] == 'MÉDICO'),
+        'falas_paciente': ' '.join(f['texto'] for f in falas if f['locutor'] == 'PACIENTE'),
+        'confianca': soma_confianca / soma_duracao if soma_duracao else 0.0,
+        'observacao': ' | '.join(observacoes),
+    }
+
+def transcrever_trechos_em_paralelo(prompt, segmentos, clinica_id=None):
+    """
+    Transcreve os trechos simultaneamente (no máximo TRANSCRICAO_MAX_PARALELO por vez,
+    e nunca mais que o limite de chamadas simultâneas da clínica) e junta o resultado.
+    Um trecho que falhar duas vezes vira uma marcação no texto, sem derrubar a
+    transcrição inteira. Falta de vaga na IA não conta como tentativa: o trecho
+    continua aguardando, e só depois de TRANSCRICAO_ESPERA_VAGA_SEGUNDOS a
+    transcrição inteira falha (nunca um trecho some em silêncio por fila cheia).
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+
+    base = prompt.rsplit("TRANSCREVA AGORA:", 1)[0]
+    total = len(segmentos)
+
+    def _mmss(segundos):
+        return f"{int(segundos // 60):02d}:{int(segundos % 60):02d}"
+
+    def _tarefa(segmento):
+        numero = segmento['indice'] + 1
+        prompt_trecho = f"""{base}TRECHO: este áudio é o trecho {numero} de {total} da consulta (de {_mmss(segmento['inicio'])} a {_mmss(segmento['fim'])}).
+Os trechos se sobrepõem por alguns segundos; transcreva este trecho inteiro normalmente.
+Inclua também no JSON o campo "falas": lista em ordem cronológica de objetos {{"locutor": "MÉDICO" ou "PACIENTE", "texto": "..."}}.
+
+TRANSCREVA AGORA:"""
+        erro = None
+        tentativa = 0
+        prazo_vaga = time.monotonic() + TRANSCRICAO_ESPERA_VAGA_SEGUNDOS
+        while tentativa < 2:
+            try:
+                return _transcrever_trecho_audio(prompt_trecho, segmento['audio_bytes'], segmento['mime_type'], clinica_id)
+            except IASobrecarregadaError as e:
+                if time.monotonic() >= prazo_vaga:
+                    raise
+                print(f"⏳ Trecho {numero}/{total} aguardando vaga na IA: {e}")
+            except Exception as e:
+                erro = e
+                tentativa += 1
+                print(f"⚠️ Trecho {numero}/{total} falhou (tentativa {tentativa}): {e}")
+        return {
+            'falas': [{'locutor': '', 'texto': f"[trecho {numero} não transcrito]"}],
+            'confianca': 0.0,
+            'observacao': f"falha na transcrição: {erro}",
+            'erro': True,
+        }
+
+    paralelo = min(TRANSCRICAO_MAX_PARALELO, total)
+    if clinica_id:
+        paralelo = min(paralelo, RegistroIA.MAX_SIMULTANEAS_CLINICA)
+    with ThreadPoolExecutor(max_workers=max(1, paralelo)) as executor:
+        resultados = list(executor.map(_tarefa, segmentos))
+
+    if all(r.get('erro') for r in resultados):
+        raise Exception(f"Nenhum dos {total} trechos pôde ser transcrito: {resultados[0]['observacao']}")
+
+    return _juntar_transcricoes_trechos(resultados, segmentos)
+
+@Metricas.medir_funcao_ia
 def transcrever_consulta_com_gemini(consulta_id):
     """
     Transcreve consulta identificando falas do médico e paciente
@@ -2585,40 +4985,23 @@ def transcrever_consulta_com_gemini(consulta_id):
         consulta.save(update_fields=['status'])
         
         # Verificar Gemini
-        if not Config.GEMINI_API_KEY:
-            raise Exception("GEMINI_API_KEY não configurada")
-        
-        print(f"✓ API Key OK: {Config.GEMINI_API_KEY[:20]}...")
+        RegistroIA.modelo('transcricao')
+        model_name = RegistroIA.nome_modelo('transcricao')
         
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        model_name = os.getenv('GEMINI_MODEL_TRANSCRIPTION', 'gemini-2.5-flash')
-        model = genai.GenerativeModel(model_name)
-        
-        # Decodificar áudio
-        if consulta.audio_consulta.startswith('data:'):
-            partes = consulta.audio_consulta.split(',', 1)
-            print(f"✓ Header do data URL: {partes[0]}")
-            audio_bytes = base64.b64decode(partes[1])
-        else:
-            audio_bytes = base64.b64decode(consulta.audio_consulta)
+        # Decodificar áudio (base64, data URL ou arquivo gravado pelo upload em partes)
+        audio_bytes = ler_audio_consulta(consulta.audio_consulta, consulta.clinica_id)
         
         audio_kb = len(audio_bytes) / 1024
         audio_mb = audio_kb / 1024
-        duracao_estimada = len(audio_bytes) / (16000 * 2)  # Estimativa aproximada
         
         print(f"✓ Áudio decodificado:")
         print(f"  - Tamanho: {len(audio_bytes)} bytes ({audio_kb:.2f} KB / {audio_mb:.2f} MB)")
-        print(f"  - Duração estimada: {duracao_estimada:.1f} segundos")
         print(f"  - Formato: {consulta.audio_formato or 'webm'}")
         
-        # SALVAR ÁUDIO PARA DEBUG (OPCIONAL - REMOVER DEPOIS)
-        debug_audio_path = f"debug_audio_{consulta_id}.webm"
-        try:
-            with open(debug_audio_path, 'wb') as f:
-                f.write(audio_bytes)
-            print(f"✓ Áudio salvo em: {debug_audio_path}")
-        except:
-            pass
+        audio_preparado = preprocessar_audio_para_transcricao(audio_bytes, consulta.audio_formato or 'webm')
+        if audio_preparado['duracao_segundos'] is not None:
+            consulta.audio_duracao_segundos = int(round(audio_preparado['duracao_segundos']))
+            print(f"  - Duração: {audio_preparado['duracao_segundos']:.1f} segundos")
         
         # Prompt MUITO mais detalhado
         prompt = f"""Você é um transcritor médico especializado em português brasileiro.
@@ -2658,28 +5041,17 @@ Se o áudio estiver vazio ou corrompido, retorne:
 
 TRANSCREVA AGORA:"""
         
+        segmentos = segmentar_audio(audio_preparado['audio_bytes'], audio_preparado['mime_type'])
+        
         print(f"📤 Enviando para Gemini API...")
-        print(f"  - Modelo: gemini-2.5-pro")
+        print(f"  - Modelo: {model_name}")
+        print(f"  - Trechos: {len(segmentos)}")
         print(f"  - Timeout: 300 segundos")
         
-        response = model.generate_content([
-            prompt,
-            {"mime_type": f"audio/{consulta.audio_formato or 'webm'}", "data": audio_bytes}
-        ], request_options={"timeout": 300})
-        
-        print(f"✓ Resposta recebida!")
-        print(f"Resposta completa do Gemini:")
-        print(response.text)
-        print(f"")
-        
-        # Parse JSON
-        json_str = response.text.strip()
-        if '```json' in json_str:
-            json_str = json_str.split('```json')[1].split('```')[0]
-        elif '```' in json_str:
-            json_str = json_str.split('```')[1].split('```')[0]
-        
-        resultado = json.loads(json_str.strip())
+        if len(segmentos) > 1:
+            resultado = transcrever_trechos_em_paralelo(prompt, segmentos, consulta.clinica_id)
+        else:
+            resultado = _transcrever_trecho_audio(prompt, audio_preparado['audio_bytes'], audio_preparado['mime_type'], consulta.clinica_id)
         
         transcricao = resultado.get('transcricao_completa', '').strip()
         
@@ -2736,94 +5108,53 @@ TRANSCREVA AGORA:"""
 # FUNÇÃO DE GERAÇÃO DE DOCUMENTOS MÉDICOS
 # ============================================
 
-# NO ARQUIVO: main.py
-# Substitua a função 'gerar_documento_medico_sync' inteira
+TIPOS_DOCUMENTO_MEDICO = ('atestado', 'anamnese', 'evolucao', 'prescricao', 'relatorio')
 
-def gerar_documento_medico_sync(consulta_id, tipo_documento, medico_nome, medico_crm):
+TITULOS_DOCUMENTO_MEDICO = {
+    'atestado': 'ATESTADO MÉDICO',
+    'anamnese': 'ANAMNESE',
+    'evolucao': 'EVOLUÇÃO MÉDICA',
+    'prescricao': 'PRESCRIÇÃO MÉDICA',
+    'relatorio': 'RELATÓRIO MÉDICO'
+}
+
+
+def _contexto_documento_medico(consulta, medico_nome, medico_crm):
     """
-    Gera documento médico baseado na consulta - VERSÃO SÍNCRONA
-    
-    Args:
-        consulta_id: ID da consulta
-        tipo_documento: 'atestado', 'anamnese', 'evolucao', 'prescricao', 'relatorio'
-        medico_nome: Nome do médico (com Dr.)
-        medico_crm: CRM do médico
-    
-    Returns:
-        dict com documento gerado
+    Monta uma única vez os dados compartilhados por todos os documentos de uma
+    consulta (clínica, data por extenso, bloco de assinatura e prompts por tipo).
     """
-    import time
-    import re
-    
-    print(f"⏳ Aguardando 2 segundos antes de gerar documento...")
-    time.sleep(2)
-    
+    paciente = consulta.paciente
+
     try:
-        consulta = Consulta.objects.get(id=consulta_id)
-        paciente = consulta.paciente
-        
-        try:
-            clinica = Clinica.objects.get(id=consulta.clinica_id)
-            nome_clinica_upper = clinica.nome.upper()
-            cidade_clinica = clinica.cidade
-        except Clinica.DoesNotExist:
-            nome_clinica_upper = "NOME DA CLÍNICA"
-            cidade_clinica = "Cidade"
-
-        titulos = {
-            'atestado': 'ATESTADO MÉDICO',
-            'anamnese': 'ANAMNESE',
-            'evolucao': 'EVOLUÇÃO MÉDICA',
-            'prescricao': 'PRESCRIÇÃO MÉDICA',
-            'relatorio': 'RELATÓRIO MÉDICO'
-        }
-        titulo_documento_upper = titulos.get(tipo_documento.lower(), "DOCUMENTO MÉDICO")
+        clinica = Clinica.objects.get(id=consulta.clinica_id)
+        nome_clinica_upper = clinica.nome.upper()
+        cidade_clinica = clinica.cidade
+    except Clinica.DoesNotExist:
+        nome_clinica_upper = "NOME DA CLÍNICA"
+        cidade_clinica = "Cidade"
 
-        largura_total = 80
-        
-        # --- CORREÇÃO APLICADA AQUI: Removidas as barras invertidas duplas ---
-        cabecalho = (
-            f"{'=' * largura_total}\n\n"
-            f"{nome_clinica_upper.center(largura_total)}\n\n"
-            f"{'=' * largura_total}\n\n\n"
-            f"{titulo_documento_upper.center(largura_total)}\n\n\n"
-        )
-        # --- FIM DA CORREÇÃO ---
+    largura_total = 80
 
-        if consulta.documentos_gerados:
-            for doc in consulta.documentos_gerados:
-                if doc.get('tipo') == tipo_documento:
-                    return { 'sucesso': True, 'tipo': tipo_documento, 'conteudo': doc.get('conteudo'), 'data_geracao': doc.get('data_geracao'), 'from_cache': True }
-        
-        if not Config.GEMINI_API_KEY or not genai:
-            raise Exception("Gemini não configurado")
-        
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        from datetime import datetime
-        meses = ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro']
-        data_extenso = f"{consulta.data_consulta.day} de {meses[consulta.data_consulta.month-1]} de {consulta.data_consulta.year}"
+    meses = ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho', 'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro']
+    data_extenso = f"{consulta.data_consulta.day} de {meses[consulta.data_consulta.month-1]} de {consulta.data_consulta.year}"
 
-        medico_funcao = "Médico"
-        try:
-            if medico_crm:
-                medico_obj = Usuario.objects.filter(crm=medico_crm, clinica_id=consulta.clinica_id).first()
-                if medico_obj and medico_obj.especialidade:
-                    medico_funcao = f"Médico - {medico_obj.especialidade}"
-        except Usuario.DoesNotExist:
-            pass
+    medico_funcao = "Médico"
+    if medico_crm:
+        medico_obj = Usuario.objects.filter(crm=medico_crm, clinica_id=consulta.clinica_id).only('especialidade').first()
+        if medico_obj and medico_obj.especialidade:
+            medico_funcao = f"Médico - {medico_obj.especialidade}"
 
-        local_e_data = f"{cidade_clinica}, {data_extenso}."
-        
-        assinatura_bloco = f"""
+    local_e_data = f"{cidade_clinica}, {data_extenso}."
+
+    assinatura_bloco = f"""
 {("_" * (len(medico_nome) + 8)).center(largura_total).rstrip()}
 {medico_nome.center(largura_total).rstrip()}
 {medico_funcao.center(largura_total).rstrip()}
 {f'CRM: {medico_crm}'.center(largura_total).rstrip()}
 """
-        prompts = {
-            'atestado': f"""
+    prompts = {
+        'atestado': f"""
 REGRAS CRÍTICAS:
 1. Gere o documento em TEXTO PURO. NÃO use HTML ou Markdown.
 2. Analise a transcrição da consulta para encontrar menções a dias de afastamento, repouso e CID.
@@ -2848,14 +5179,14 @@ Exemplo de corpo se encontrar informações:
 Exemplo de corpo se NÃO encontrar informações:
 "Atesto para os devidos fins que o(a) paciente {paciente.nome_completo}, portador(a) do CPF {paciente.cpf}, esteve sob meus cuidados médicos nesta data."
 """,
-            
-            'anamnese': f"""Gere uma anamnese em TEXTO PURO. Use títulos (ex: "1. Identificação:") e parágrafos. Use "Não informado" para campos vazios. Transcrição: {consulta.transcricao_ia or '[Sem transcrição]'}. Dados: Paciente: {paciente.nome_completo}, Idade: {paciente.idade}. Estrutura: 1.Identificação, 2.Queixa Principal, 3.História da Doença Atual, 4.Antecedentes, 5.Exame Físico, 6.Hipótese Diagnóstica.""",
-            
-            'evolucao': f"""Gere uma evolução médica em TEXTO PURO no formato SOAP. Use os títulos "S (Subjetivo):", "O (Objetivo):", etc. Dados: Paciente: {paciente.nome_completo}, Data/Hora: {consulta.data_consulta.strftime('%d/%m/%Y %H:%M')}. Transcrição: {consulta.transcricao_ia or '[Sem transcrição]'}. Dados estruturados: Queixa:{consulta.queixa_principal}, Ex.Físico:{consulta.exame_fisico}, Diag.:{consulta.diagnostico}.""",
-            
-            'prescricao': f"""Gere uma prescrição médica em TEXTO PURO. Se encontrar medicamentos na transcrição: {consulta.transcricao_ia or '[Sem transcrição]'} ou na conduta: {consulta.conduta}, liste nome, dosagem e posologia. Se não, escreva "Sem medicamentos prescritos". Dados: Paciente: {paciente.nome_completo}, Data: {data_extenso}.""",
-            
-            'relatorio': f"""
+        
+        'anamnese': f"""Gere uma anamnese em TEXTO PURO. Use títulos (ex: "1. Identificação:") e parágrafos. Use "Não informado" para campos vazios. Transcrição: {consulta.transcricao_ia or '[Sem transcrição]'}. Dados: Paciente: {paciente.nome_completo}, Idade: {paciente.idade}. Estrutura: 1.Identificação, 2.Queixa Principal, 3.História da Doença Atual, 4.Antecedentes, 5.Exame Físico, 6.Hipótese Diagnóstica.""",
+        
+        'evolucao': f"""Gere uma evolução médica em TEXTO PURO no formato SOAP. Use os títulos "S (Subjetivo):", "O (Objetivo):", etc. Dados: Paciente: {paciente.nome_completo}, Data/Hora: {consulta.data_consulta.strftime('%d/%m/%Y %H:%M')}. Transcrição: {consulta.transcricao_ia or '[Sem transcrição]'}. Dados estruturados: Queixa:{consulta.queixa_principal}, Ex.Físico:{consulta.exame_fisico}, Diag.:{consulta.diagnostico}.""",
+        
+        'prescricao': f"""Gere uma prescrição médica em TEXTO PURO. Se encontrar medicamentos na transcrição: {consulta.transcricao_ia or '[Sem transcrição]'} ou na conduta: {consulta.conduta}, liste nome, dosagem e posologia. Se não, escreva "Sem medicamentos prescritos". Dados: Paciente: {paciente.nome_completo}, Data: {data_extenso}.""",
+        
+        'relatorio': f"""
 REGRAS CRÍTICAS:
 1. Gere o documento em TEXTO PURO. NÃO use HTML ou Markdown.
 2. Sua principal fonte de informação é a TRANSCRIÇÃO COMPLETA da consulta. Use-a para preencher todos os campos do relatório de forma detalhada.
@@ -2894,78 +5225,273 @@ HISTÓRIA DA DOENÇA ATUAL (HDA):
 ANTECEDENTES:
 (Liste todos os antecedentes pessoais e familiares mencionados na transcrição)
 
-EXAME FÍSICO:
-(Descreva todos os achados do exame físico mencionados pelo médico na transcrição)
+EXAME FÍSICO:
+(Descreva todos os achados do exame físico mencionados pelo médico na transcrição)
+
+HIPÓTESE DIAGNÓSTICA / CONCLUSÃO:
+(Liste as hipóteses ou conclusões discutidas durante a consulta, conforme a transcrição)
+
+PLANO / CONDUTA:
+(Descreva as recomendações, prescrições e planos de tratamento mencionados pelo médico)
+"""
+    }
+
+    return {
+        'nome_clinica_upper': nome_clinica_upper,
+        'largura_total': largura_total,
+        'local_e_data': local_e_data,
+        'assinatura_bloco': assinatura_bloco,
+        'prompts': prompts,
+    }
+
+
+def _limpar_markdown_documento(texto):
+    """Remove cercas de código e negrito/itálico em markdown do texto gerado."""
+    import re
+    texto = re.sub(r'```[\w]*\n?', '', texto or '')
+    texto = re.sub(r'\*\*(.*?)\*\*', r'\1', texto)
+    texto = re.sub(r'\*(.*?)\*', r'\1', texto)
+    return texto
+
+
+def _montar_documento_medico(contexto, tipo_documento, corpo_documento):
+    """Aplica cabeçalho da clínica, local/data e assinatura ao corpo gerado pela IA."""
+    largura_total = contexto['largura_total']
+    titulo_documento_upper = TITULOS_DOCUMENTO_MEDICO.get(tipo_documento.lower(), "DOCUMENTO MÉDICO")
+
+    cabecalho = (
+        f"{'=' * largura_total}\n\n"
+        f"{contexto['nome_clinica_upper'].center(largura_total)}\n\n"
+        f"{'=' * largura_total}\n\n\n"
+        f"{titulo_documento_upper.center(largura_total)}\n\n\n"
+    )
+
+    documento_final = (
+        f"{cabecalho}"
+        f"{_limpar_markdown_documento(corpo_documento)}\n\n\n"
+        f"{contexto['local_e_data']}\n\n"
+        f"{contexto['assinatura_bloco']}"
+    )
+    return documento_final.strip()
+
+
+def _gerar_corpo_documento(prompt, clinica_id=None):
+    """Uma chamada ao Gemini para um único documento."""
+    response = RegistroIA.gerar('documentos', prompt, clinica_id=clinica_id, request_options={"timeout": 180})
+    return response.text
+
+
+def _gerar_corpos_documentos_lote(prompts, tipos, clinica_id=None):
+    """
+    Pede ao Gemini vários documentos em uma única requisição estruturada (JSON
+    com uma chave por tipo). Tipos ausentes ou vazios na resposta não entram no
+    retorno e ficam para o fallback individual.
+    """
+    instrucoes = "\n\n".join(
+        f"### DOCUMENTO '{tipo}'\n{prompts[tipo].strip()}" for tipo in tipos
+    )
+    chaves = ', '.join(f'"{tipo}"' for tipo in tipos)
+    prompt_lote = f"""Você vai redigir {len(tipos)} documentos médicos referentes à MESMA consulta.
+Siga as instruções específicas de cada documento abaixo, de forma independente.
+
+Responda APENAS com um objeto JSON válido, sem texto adicional, contendo exatamente as chaves {chaves}.
+O valor de cada chave é o texto puro do respectivo documento (use \\n para quebras de linha).
+
+{instrucoes}
+"""
+    response = RegistroIA.gerar(
+        'documentos',
+        prompt_lote,
+        clinica_id=clinica_id,
+        generation_config={"response_mime_type": "application/json"},
+        request_options={"timeout": 240}
+    )
+
+    json_str = response.text.strip()
+    if '```json' in json_str:
+        json_str = json_str.split('```json')[1].split('```')[0]
+    elif '```' in json_str:
+        json_str = json_str.split('```')[1].split('```')[0]
+
+    try:
+        resultado = json.loads(json_str.strip())
+    except json.JSONDecodeError:
+        print(f"⚠️ Resposta em lote não é um JSON válido; gerando documentos individualmente.")
+        return {}
+    if not isinstance(resultado, dict):
+        return {}
+
+    return {
+        tipo: resultado[tipo]
+        for tipo in tipos
+        if isinstance(resultado.get(tipo), str) and resultado[tipo].strip()
+    }
+
+
+@Metricas.medir_funcao_ia
+def gerar_documentos_medicos_lote(consulta_id, tipos, medico_nome, medico_crm, forcar=False, maximo_novos=None):
+    """
+    Gera vários documentos médicos de uma consulta de uma só vez.
+
+    O contexto (clínica, paciente, assinatura) é montado uma única vez; os tipos
+    pendentes são pedidos ao Gemini em uma só requisição estruturada e, se algum
+    faltar na resposta, ele é gerado em paralelo com chamadas individuais.
+    Os documentos novos são gravados em `Consulta.documentos_gerados` em um único save.
+
+    Args:
+        consulta_id: ID da consulta
+        tipos: lista de tipos ('atestado', 'anamnese', 'evolucao', 'prescricao', 'relatorio')
+        medico_nome: Nome do médico (com Dr.)
+        medico_crm: CRM do médico
+        forcar: ignora os documentos já gerados e gera novamente
+        maximo_novos: saldo de cota do plano; se houver mais documentos a gerar que
+            isso, nada é gerado e o retorno traz 'limite_excedido'
+
+    Returns:
+        dict com 'documentos' (por tipo), 'erros' (por tipo) e 'gerados' (quantidade
+        de documentos efetivamente produzidos pela IA nesta chamada)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    tipos = list(dict.fromkeys(t.lower() for t in tipos if t))
+    invalidos = [t for t in tipos if t not in TIPOS_DOCUMENTO_MEDICO]
+    if invalidos:
+        return {'sucesso': False, 'erro': f"Tipo de documento inválido: {', '.join(invalidos)}"}
+    if not tipos:
+        return {'sucesso': False, 'erro': 'Nenhum tipo de documento informado'}
+
+    try:
+        consulta = Consulta.objects.select_related('paciente').get(id=consulta_id)
+
+        documentos = {}
+        erros = {}
+
+        if not forcar:
+            for doc in consulta.documentos_gerados or []:
+                tipo = doc.get('tipo')
+                if tipo in tipos and doc.get('conteudo'):
+                    documentos[tipo] = {
+                        'tipo': tipo,
+                        'conteudo': doc['conteudo'],
+                        'data_geracao': doc.get('data_geracao'),
+                        'from_cache': True
+                    }
+
+        pendentes = [t for t in tipos if t not in documentos]
+        if not pendentes:
+            return {'sucesso': True, 'documentos': documentos, 'erros': erros, 'gerados': 0}
+        if maximo_novos is not None and len(pendentes) > maximo_novos:
+            return {
+                'sucesso': False, 'limite_excedido': True,
+                'erro': f"Limite do plano insuficiente: {len(pendentes)} documento(s) a gerar, saldo de {max(maximo_novos, 0)}."
+            }
+
+        if not RegistroIA.disponivel():
+            raise Exception("Gemini não configurado")
 
-HIPÓTESE DIAGNÓSTICA / CONCLUSÃO:
-(Liste as hipóteses ou conclusões discutidas durante a consulta, conforme a transcrição)
+        contexto = _contexto_documento_medico(consulta, medico_nome, medico_crm)
+        prompts = contexto['prompts']
 
-PLANO / CONDUTA:
-(Descreva as recomendações, prescrições e planos de tratamento mencionados pelo médico)
-"""
-        }
-        
-        prompt = prompts.get(tipo_documento, '')
-        if not prompt:
-            raise Exception(f"Tipo de documento inválido: {tipo_documento}")
-        
-        request_options = {"timeout": 180}
-        response = model.generate_content(prompt, request_options=request_options)
-        corpo_documento = response.text
-        
-        corpo_documento = re.sub(r'```[\w]*\n?', '', corpo_documento)
-        # --- CORREÇÃO APLICADA AQUI: Corrigida a expressão regular ---
-        corpo_documento = re.sub(r'\*\*(.*?)\*\*', r'\1', corpo_documento)
-        corpo_documento = re.sub(r'\*(.*?)\*', r'\1', corpo_documento)
-        # --- FIM DA CORREÇÃO ---
+        corpos = {}
+        if len(pendentes) > 1:
+            try:
+                corpos = _gerar_corpos_documentos_lote(prompts, pendentes, consulta.clinica_id)
+                print(f"✓ Geração em lote: {len(corpos)}/{len(pendentes)} documento(s) na mesma requisição")
+            except Exception as e:
+                print(f"⚠️ Falha na geração em lote ({e}); gerando documentos individualmente.")
+
+        faltantes = [t for t in pendentes if t not in corpos]
+        if faltantes:
+            with ThreadPoolExecutor(max_workers=len(faltantes)) as executor:
+                futuros = {t: executor.submit(_gerar_corpo_documento, prompts[t], consulta.clinica_id) for t in faltantes}
+                for tipo, futuro in futuros.items():
+                    try:
+                        corpos[tipo] = futuro.result()
+                    except Exception as e:
+                        print(f"❌ Erro ao gerar documento '{tipo}': {e}")
+                        erros[tipo] = str(e)
+
+        data_geracao = timezone.now().isoformat()
+        novos = {}
+        for tipo in pendentes:
+            if tipo not in corpos:
+                continue
+            novos[tipo] = _montar_documento_medico(contexto, tipo, corpos[tipo])
+            documentos[tipo] = {'tipo': tipo, 'conteudo': novos[tipo], 'data_geracao': data_geracao}
+
+        if novos:
+            registros = [d for d in (consulta.documentos_gerados or []) if d.get('tipo') not in novos]
+            for tipo, conteudo in novos.items():
+                registros.append({'tipo': tipo, 'conteudo': conteudo, 'data_geracao': data_geracao, 'editado': False, 'medico': medico_nome})
+            consulta.documentos_gerados = registros
+            consulta.save(update_fields=['documentos_gerados'])
+            for tipo in novos:
+                registrar_evento_auditoria(**_evento_auditoria_documento(consulta, tipo, False, medico_nome))
 
-        documento_final = (
-            f"{cabecalho}"
-            f"{corpo_documento}\n\n\n"
-            f"{local_e_data}\n\n"
-            f"{assinatura_bloco}"
-        )
-        
         return {
-            'sucesso': True,
-            'tipo': tipo_documento,
-            'conteudo': documento_final.strip(),
-            'data_geracao': timezone.now().isoformat()
+            'sucesso': bool(documentos),
+            'documentos': documentos,
+            'erros': erros,
+            'gerados': len(novos),
+            'erro': '; '.join(f"{t}: {m}" for t, m in erros.items()) if not documentos else None
         }
-    
+
     except Consulta.DoesNotExist:
         return {'sucesso': False, 'erro': 'Consulta não encontrada'}
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
-        print(f"❌ ERRO COMPLETO ao gerar documento:\n{error_detail}")
+        print(f"❌ ERRO COMPLETO ao gerar documentos:\n{error_detail}")
         return {'sucesso': False, 'erro': str(e)}
 
-def transcrever_audio_geral_com_gemini(audio_base64, audio_formato="webm"):
+
+def gerar_documento_medico_sync(consulta_id, tipo_documento, medico_nome, medico_crm, forcar=False):
+    """
+    Gera documento médico baseado na consulta - VERSÃO SÍNCRONA
+    
+    Args:
+        consulta_id: ID da consulta
+        tipo_documento: 'atestado', 'anamnese', 'evolucao', 'prescricao', 'relatorio'
+        medico_nome: Nome do médico (com Dr.)
+        medico_crm: CRM do médico
+        forcar: ignora o documento já gerado e gera novamente
+    
+    Returns:
+        dict com documento gerado
+    """
+    resultado = gerar_documentos_medicos_lote(consulta_id, [tipo_documento or ''], medico_nome, medico_crm, forcar=forcar)
+    if not resultado.get('sucesso'):
+        return {'sucesso': False, 'erro': resultado.get('erro') or 'Erro desconhecido na IA.'}
+
+    documento = resultado['documentos'][tipo_documento.lower()]
+    return {'sucesso': True, **documento}
+
+@Metricas.medir_funcao_ia
+def transcrever_audio_geral_com_gemini(audio_base64, audio_formato="webm", clinica_id=None):
     """
     Transcreve um clipe de áudio geral usando a API Gemini.
     
     Args:
         audio_base64: String do áudio codificado em base64.
         audio_formato: Formato do áudio (ex: 'webm').
+        clinica_id: Clínica solicitante (limite de chamadas simultâneas por clínica).
     
     Returns:
         Dicionário com o resultado da transcrição.
     """
     try:
-        if not Config.GEMINI_API_KEY or not genai:
+        if not RegistroIA.disponivel():
             raise Exception("API Gemini não configurada")
 
-        genai.configure(api_key=Config.GEMINI_API_KEY)
-        model = genai.GenerativeModel('gemini-2.5-pro')
-
         prompt = "Transcreva o áudio a seguir da forma mais literal e precisa possível. O áudio contém o ditado de um resultado de exame médico. Mantenha a formatação, pontuação e quebras de linha que forem ditadas."
 
         audio_bytes = base64.b64decode(audio_base64)
         
         request_options = {"timeout": 120}
-        response = model.generate_content(
+        response = RegistroIA.gerar(
+            'transcricao_geral',
             [prompt, {"mime_type": f"audio/{audio_formato}", "data": audio_bytes}],
+            clinica_id=clinica_id,
             request_options=request_options
         )
 
@@ -2978,14 +5504,23 @@ def transcrever_audio_geral_com_gemini(audio_base64, audio_formato="webm"):
 # VIEWSETS - CLÍNICAS E USUÁRIOS
 # ============================================
 
-import requests
-
 class EvolutionManager:
     """Gerenciador de integração com Evolution API (WhatsApp)"""
     
     BASE_URL = "http://localhost:8081"  # URL do container Evolution
     API_KEY = "intellimed-global-api-key-secret" # Mesma chave do .env do Evolution
 
+    # Conexões reaproveitadas entre chamadas (webhook responde várias mensagens por minuto)
+    http = SessaoHTTP(
+        timeouts={
+            '/instance/connectionState/': (3, 5),
+            '/instance/fetchInstances': (3, 5),
+        },
+        timeout_padrao=(Config.HTTP_TIMEOUT_CONEXAO, Config.HTTP_TIMEOUT_LEITURA),
+        tentativas=Config.HTTP_TENTATIVAS,
+        pool_maxsize=int(os.getenv('EVOLUTION_HTTP_POOL', Config.HTTP_POOL_MAXSIZE)),
+    )
+
     @classmethod
     def _get_headers(cls):
         return {
@@ -3004,7 +5539,7 @@ class EvolutionManager:
             "integration": "WHATSAPP-BAILEYS"
         }
         try:
-            response = requests.post(url, json=data, headers=cls._get_headers(), timeout=10)
+            response = cls.http.post(url, json=data, headers=cls._get_headers())
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -3014,7 +5549,7 @@ class EvolutionManager:
         """Solicita conexão (gera QR Code)"""
         url = f"{cls.BASE_URL}/instance/connect/{instance_name}"
         try:
-            response = requests.get(url, headers=cls._get_headers(), timeout=10)
+            response = cls.http.get(url, headers=cls._get_headers())
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -3025,7 +5560,7 @@ class EvolutionManager:
         url = f"{cls.BASE_URL}/instance/delete/{instance_name}"
         try:
             # Evolution v2 retorna 200 mesmo se não existir
-            requests.delete(url, headers=cls._get_headers(), timeout=10)
+            cls.http.delete(url, headers=cls._get_headers())
             return True
         except:
             return False
@@ -3035,7 +5570,7 @@ class EvolutionManager:
         """Verifica o estado real da conexão (open, close, connecting)"""
         url = f"{cls.BASE_URL}/instance/connectionState/{instance_name}"
         try:
-            response = requests.get(url, headers=cls._get_headers(), timeout=5)
+            response = cls.http.get(url, headers=cls._get_headers())
             return response.json()
         except:
             return {}
@@ -3054,7 +5589,7 @@ class EvolutionManager:
             }
         }
         try:
-            response = requests.post(url, json=data, headers=cls._get_headers(), timeout=10)
+            response = cls.http.post(url, json=data, headers=cls._get_headers())
             return response.json()
         except Exception as e:
             return {"error": str(e)}
@@ -3064,7 +5599,7 @@ class EvolutionManager:
         """Lista todas as instâncias ativas"""
         url = f"{cls.BASE_URL}/instance/fetchInstances"
         try:
-            response = requests.get(url, headers=cls._get_headers(), timeout=5)
+            response = cls.http.get(url, headers=cls._get_headers())
             return response.json()
         except Exception as e:
             return []
@@ -3085,46 +5620,281 @@ class EvolutionManager:
             }
         }
         try:
-            requests.post(url, json=payload, headers=cls._get_headers(), timeout=10)
+            cls.http.post(url, json=payload, headers=cls._get_headers())
             return True
         except:
             return False
 
+def agenda_livre_para_prompt(clinica_id):
+    """Horários livres dos médicos nos próximos WHATSAPP_AGENDA_DIAS dias, em texto curto para o prompt."""
+    dias_semana = ['seg', 'ter', 'qua', 'qui', 'sex', 'sáb', 'dom']
+    medicos = [u for u in Usuario.objects.filter(clinica_id=clinica_id, status='ativo').order_by('nome_completo') if 'medico' in u.funcoes]
+    if not medicos:
+        return "(nenhum médico cadastrado)"
+    
+    hoje = timezone.localdate()
+    agenda = AgendaDisponibilidade(clinica_id, medicos, hoje, hoje + timedelta(days=Config.WHATSAPP_AGENDA_DIAS - 1))
+    especialidades = {m.id: m.especialidade for m in medicos}
+    linhas = []
+    for medico in agenda.resumo():
+        especialidade = especialidades.get(medico['medico_id'])
+        linhas.append(f"- {medico['medico_nome']}" + (f" ({especialidade})" if especialidade else '') + ':')
+        dias = [d for d in medico['dias'] if d['horarios']]
+        for dia in dias:
+            horarios = dia['horarios'][:Config.WHATSAPP_AGENDA_HORARIOS_POR_DIA]
+            extra = dia['total_livres'] - len(horarios)
+            data_formatada = date.fromisoformat(dia['data']).strftime('%d/%m')
+            linhas.append(f"  {dias_semana[dia['dia_semana']]} {data_formatada}: {', '.join(horarios)}" + (f" (+{extra})" if extra > 0 else ''))
+        if not dias:
+            linhas.append("  sem horários livres no período")
+    return '\n'.join(linhas)
+
 # Função auxiliar para processar texto com IA (Secretária)
 def processar_resposta_ia_secretaria(clinica, texto_paciente, numero_paciente):
     """
-    Usa o Gemini para agir como secretária da clínica.
+    Usa o Gemini para agir como secretária da clínica, com a memória da conversa
+    (ConversaWhatsApp) e os horários livres reais da agenda no prompt.
     """
-    if not Config.configure_gemini():
+    if not RegistroIA.disponivel():
         return "Desculpe, estou passando por uma manutenção momentânea. Por favor, ligue para nós."
 
-    # Buscar contexto básico (pode ser expandido depois com horários reais)
     nome_clinica = clinica.nome
+    conversa, _ = ConversaWhatsApp.objects.get_or_create(clinica_id=clinica.id, numero=numero_paciente)
+    
+    try:
+        agenda = agenda_livre_para_prompt(clinica.id)
+    except Exception as e:
+        print(f"⚠️ Falha ao montar agenda para a secretária ({nome_clinica}): {e}")
+        agenda = "(agenda indisponível no momento; diga que a equipe confirmará o horário)"
     
     # Prompt da Secretária
     prompt = f"""
     Você é a secretária virtual da clínica "{nome_clinica}". 
     Seu tom é profissional, acolhedor e eficiente.
+    Agora são {timezone.localtime().strftime('%d/%m/%Y %H:%M')}.
+    
+    Resumo do atendimento anterior com este número ({numero_paciente}):
+    {conversa.resumo or '(primeiro contato)'}
     
-    O cliente (número {numero_paciente}) disse: "{texto_paciente}"
+    Mensagens recentes:
+    {conversa.historico_formatado() or '(nenhuma)'}
+    
+    Horários livres na agenda:
+    {agenda}
+    
+    O cliente acabou de dizer: "{texto_paciente}"
     
     Instruções:
     1. Responda de forma curta e direta (ideal para WhatsApp).
-    2. Se o cliente quiser agendar, peça o nome completo e qual especialidade/médico deseja (simule que você vai verificar a agenda).
-    3. Se for uma dúvida simples, responda.
-    4. Se for emergência, peça para ligar para o 192 ou ir ao hospital.
-    5. Nunca invente dados médicos.
+    2. Use o resumo e as mensagens recentes; não peça de novo o que o paciente já informou.
+    3. Para agendar, ofereça somente horários da lista acima (2 ou 3 opções do médico/especialidade pedidos). Quando o paciente escolher, confirme nome completo, médico, dia e hora e diga que a equipe vai confirmar o agendamento.
+    4. Se for uma dúvida simples, responda.
+    5. Se for emergência, peça para ligar para o 192 ou ir ao hospital.
+    6. Nunca invente dados médicos nem horários.
     
     Responda como se estivesse no WhatsApp:
     """
     
     try:
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
-        return response.text
+        response = RegistroIA.gerar('secretaria', prompt, clinica_id=clinica.id)
+        resposta = response.text
     except Exception as e:
         print(f"Erro na IA Secretária: {e}")
         return "Olá! Recebi sua mensagem, mas tive uma pequena falha técnica. Poderia repetir, por favor?"
+    
+    # Relê a conversa travada: um resumo (compactar) pode ter sido gravado enquanto a IA respondia
+    with transaction.atomic():
+        conversa = ConversaWhatsApp.objects.select_for_update().get(pk=conversa.pk)
+        conversa.adicionar('paciente', texto_paciente)
+        conversa.adicionar('secretaria', resposta)
+        conversa.save(update_fields=['historico', 'atualizada_em'])
+    return resposta
+
+class FilaWhatsApp:
+    """
+    Respostas da secretária virtual geradas fora do webhook.
+    
+    O webhook só grava a mensagem (idempotente por key.id) e a coloca aqui; um
+    despachante aguarda WHATSAPP_JANELA_SEGUNDOS de silêncio do mesmo remoteJid
+    (no máximo WHATSAPP_ESPERA_MAXIMA_SEGUNDOS desde a primeira mensagem) e
+    entrega o bloco inteiro a um pool de WHATSAPP_TRABALHADORES threads, que
+    chamam a IA uma vez e enviam uma única resposta. Cada conversa tem no
+    máximo uma resposta em andamento, o que mantém a ordem das mensagens.
+    A fila é por processo; a deduplicação, por estar no banco, vale para todos.
+    Cada mensagem guarda o PID do processo que a enfileirou: ao iniciar, a fila
+    assume as pendentes recentes de processos que não existem mais (reinício ou
+    queda), que de outra forma nunca seriam respondidas.
+    """
+
+    _trava = threading.Condition()
+    _conversas = {}        # (instancia, remote_jid) -> mensagens acumuladas aguardando resposta
+    _em_andamento = set()  # conversas com resposta sendo gerada/enviada
+    _compactando = set()   # conversas com resumo da memória em andamento
+    _executor = None
+    _pid = None
+
+    @classmethod
+    def registrar(cls, clinica, instancia, mensagem_id, remote_jid, texto):
+        """Grava e enfileira a mensagem. Retorna False se ela já tinha sido recebida."""
+        from django.db import IntegrityError
+        cls.iniciar()
+        try:
+            with transaction.atomic():
+                MensagemWhatsApp.objects.create(
+                    clinica_id=clinica.id, mensagem_id=mensagem_id, instancia=instancia,
+                    remote_jid=remote_jid, texto=texto, processo=os.getpid()
+                )
+        except IntegrityError:
+            return False
+        
+        cls._enfileirar(clinica.id, instancia, remote_jid, mensagem_id, texto)
+        return True
+
+    @classmethod
+    def _enfileirar(cls, clinica_id, instancia, remote_jid, mensagem_id, texto):
+        import time
+        agora = time.monotonic()
+        with cls._trava:
+            conversa = cls._conversas.setdefault((instancia, remote_jid), {
+                'clinica_id': clinica_id, 'textos': [], 'ids': [], 'primeira': agora,
+            })
+            conversa['textos'].append(texto)
+            conversa['ids'].append(mensagem_id)
+            conversa['ultima'] = agora
+            cls._trava.notify()
+        Metricas.ajustar_gauge('intellimed_whatsapp_fila', 1)
+
+    @classmethod
+    def iniciar(cls):
+        """Sobe o despachante e o pool neste processo (uma vez) e retoma pendentes órfãs."""
+        with cls._trava:
+            if cls._pid == os.getpid():
+                return
+            from concurrent.futures import ThreadPoolExecutor
+            cls._pid = os.getpid()
+            cls._conversas = {}
+            cls._em_andamento = set()
+            cls._compactando = set()
+            cls._executor = ThreadPoolExecutor(max_workers=Config.WHATSAPP_TRABALHADORES, thread_name_prefix='whatsapp')
+            threading.Thread(target=cls._despachar, name='whatsapp-fila', daemon=True).start()
+        cls._retomar_pendentes()
+
+    @staticmethod
+    def _processo_vivo(pid):
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except (PermissionError, OSError):
+            return True
+        return True
+
+    @classmethod
+    def _retomar_pendentes(cls):
+        """
+        Reenfileira as mensagens pendentes dos últimos WHATSAPP_RETOMAR_MINUTOS cujo
+        processo dono morreu. A troca de dono é um UPDATE condicional por processo
+        antigo, então dois processos subindo juntos não assumem a mesma mensagem.
+        """
+        meu_pid = os.getpid()
+        try:
+            pendentes = MensagemWhatsApp.objects.filter(
+                status='pendente',
+                recebida_em__gte=timezone.now() - timedelta(minutes=Config.WHATSAPP_RETOMAR_MINUTOS)
+            ).exclude(processo=meu_pid).order_by('recebida_em')
+            orfas = {}
+            for mensagem in pendentes:
+                if not cls._processo_vivo(mensagem.processo):
+                    orfas.setdefault(mensagem.processo, []).append(mensagem)
+            
+            retomadas = 0
+            for pid_antigo, mensagens in orfas.items():
+                assumidas = MensagemWhatsApp.objects.filter(
+                    id__in=[m.id for m in mensagens], status='pendente', processo=pid_antigo
+                ).update(processo=meu_pid)
+                if assumidas != len(mensagens):
+                    # Outro processo assumiu parte delas ao mesmo tempo; fica só com as que são nossas
+                    meus_ids = set(MensagemWhatsApp.objects.filter(
+                        id__in=[m.id for m in mensagens], processo=meu_pid
+                    ).values_list('id', flat=True))
+                    mensagens = [m for m in mensagens if m.id in meus_ids]
+                for m in mensagens:
+                    cls._enfileirar(m.clinica_id, m.instancia, m.remote_jid, m.mensagem_id, m.texto)
+                retomadas += len(mensagens)
+            if retomadas:
+                print(f"🔁 WhatsApp: {retomadas} mensagem(ns) pendente(s) retomada(s) após reinício")
+        except Exception as e:
+            print(f"⚠️ Falha ao retomar mensagens pendentes do WhatsApp: {e}")
+
+    @classmethod
+    def _prazo(cls, conversa):
+        return min(conversa['ultima'] + Config.WHATSAPP_JANELA_SEGUNDOS,
+                   conversa['primeira'] + Config.WHATSAPP_ESPERA_MAXIMA_SEGUNDOS)
+
+    @classmethod
+    def _despachar(cls):
+        import time
+        while True:
+            with cls._trava:
+                agora = time.monotonic()
+                aguardando = [chave for chave in cls._conversas if chave not in cls._em_andamento]
+                for chave in aguardando:
+                    if cls._prazo(cls._conversas[chave]) <= agora:
+                        cls._em_andamento.add(chave)
+                        cls._executor.submit(cls._responder, chave, cls._conversas.pop(chave))
+                prazos = [cls._prazo(c) for chave, c in cls._conversas.items() if chave not in cls._em_andamento]
+                cls._trava.wait(timeout=max(min(prazos) - agora, 0.05) if prazos else None)
+
+    @classmethod
+    def _responder(cls, chave, conversa):
+        from django.db import close_old_connections
+        instancia, remote_jid = chave
+        status_final = 'erro'
+        clinica_id = None
+        try:
+            close_old_connections()
+            clinica = Clinica.objects.get(id=conversa['clinica_id'])
+            texto = '\n'.join(conversa['textos'])
+            print(f"🤖 Respondendo {len(conversa['ids'])} mensagem(ns) de {remote_jid} na {instancia}")
+            resposta_ia = processar_resposta_ia_secretaria(clinica, texto, remote_jid.split('@')[0])
+            clinica_id = clinica.id
+            if EvolutionManager.send_text(instancia, remote_jid, resposta_ia):
+                status_final = 'respondida'
+        except Exception as e:
+            print(f"❌ Erro ao responder WhatsApp de {remote_jid}: {e}")
+        finally:
+            try:
+                MensagemWhatsApp.objects.filter(mensagem_id__in=conversa['ids']).update(
+                    status=status_final, respondida_em=timezone.now()
+                )
+            except Exception as e:
+                print(f"⚠️ Falha ao atualizar status das mensagens de {remote_jid}: {e}")
+            close_old_connections()
+            Metricas.ajustar_gauge('intellimed_whatsapp_fila', -len(conversa['ids']))
+            with cls._trava:
+                cls._em_andamento.discard(chave)
+                cls._trava.notify()
+                # Resumo da conversa (se a janela estourou) em tarefa própria, com a conversa já liberada
+                if clinica_id is not None and chave not in cls._compactando:
+                    cls._compactando.add(chave)
+                    cls._executor.submit(cls._compactar, chave, clinica_id)
+
+    @classmethod
+    def _compactar(cls, chave, clinica_id):
+        from django.db import close_old_connections
+        try:
+            close_old_connections()
+            conversa_memoria = ConversaWhatsApp.objects.filter(clinica_id=clinica_id, numero=chave[1].split('@')[0]).first()
+            if conversa_memoria:
+                conversa_memoria.compactar()
+        except Exception as e:
+            print(f"⚠️ Falha ao compactar conversa de {chave[1]}: {e}")
+        finally:
+            close_old_connections()
+            with cls._trava:
+                cls._compactando.discard(chave)
 
 @csrf_exempt
 @api_view(['POST'])
@@ -3185,14 +5955,15 @@ def evolution_webhook_view(request, instance_name):
         # --- CÉREBRO DA IA ---
         print(f"📩 Mensagem recebida na {instance_name} de {number}: {text_body}")
         
-        # Processar resposta com IA (Executa em thread ou sync rápido por enquanto)
-        # Idealmente seria assíncrono (Celery/Redis), mas vamos manter simples no arquivo único
-        resposta_ia = processar_resposta_ia_secretaria(clinica, text_body, number)
-        
-        # Enviar resposta
-        EvolutionManager.send_text(instance_name, remote_jid, resposta_ia)
+        # A resposta é gerada e enviada pela FilaWhatsApp; o webhook só confirma o recebimento
+        import hashlib
+        mensagem_id = key.get('id') or hashlib.sha256(
+            f"{instance_name}:{remote_jid}:{message_data.get('messageTimestamp')}:{text_body}".encode()
+        ).hexdigest()
+        if not FilaWhatsApp.registrar(clinica, instance_name, mensagem_id, remote_jid, text_body):
+            return Response({'status': 'duplicate'})
         
-        return Response({'status': 'processed'})
+        return Response({'status': 'queued'})
 
     except Exception as e:
         print(f"❌ Erro no Webhook: {str(e)}")
@@ -3214,10 +5985,18 @@ class ClinicaViewSet(viewsets.ModelViewSet):
         """Apenas super_admin vê todas as clínicas, outros veem a sua"""
         user = self.request.user
         if 'super_admin' in user.get('funcoes', []):
-            return Clinica.objects.all()
+            return Clinica.objects.select_related('assinatura__plano')
         else:
             clinica_id = user.get('clinica_id')
-            return Clinica.objects.filter(id=clinica_id) if clinica_id else Clinica.objects.none()
+            return Clinica.objects.select_related('assinatura__plano').filter(id=clinica_id) if clinica_id else Clinica.objects.none()
+    
+    def list(self, request, *args, **kwargs):
+        """Lista as clínicas calculando consumo e usuários de todas em lote."""
+        clinicas = list(self.filter_queryset(self.get_queryset()))
+        context = self.get_serializer_context()
+        context['estatisticas_clinicas'] = ClinicaSerializer.estatisticas_em_lote(clinicas)
+        serializer = self.get_serializer(clinicas, many=True, context=context)
+        return Response(serializer.data)
     
     def perform_create(self, serializer):
         if 'super_admin' not in self.request.user.get('funcoes', []):
@@ -3225,6 +6004,17 @@ class ClinicaViewSet(viewsets.ModelViewSet):
         instance = serializer.save()
         popular_categorias_padrao(instance.id)
 
+    def perform_update(self, serializer):
+        """Suspender/inativar a clínica derruba na hora as sessões de todos os seus usuários."""
+        status_anterior = serializer.instance.status
+        clinica = serializer.save()
+        if clinica.status != 'ativo' and clinica.status != status_anterior:
+            RevogacaoTokens.revogar('clinica', clinica.id)
+
+    def perform_destroy(self, instance):
+        RevogacaoTokens.revogar('clinica', instance.id)
+        instance.delete()
+
     def partial_update(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)
@@ -3393,11 +6183,11 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         user = self.request.user
         
         if 'super_admin' in user.get('funcoes', []):
-            return Usuario.objects.exclude(id=user.get('sub'))
+            return Usuario.objects.select_related('clinica').exclude(id=user.get('sub'))
         else:
             clinica_id = user.get('clinica_id')
             if clinica_id:
-                return Usuario.objects.filter(clinica_id=clinica_id)
+                return Usuario.objects.select_related('clinica').filter(clinica_id=clinica_id)
             return Usuario.objects.none()
 
     def perform_create(self, serializer):
@@ -3434,6 +6224,22 @@ class UsuarioViewSet(viewsets.ModelViewSet):
                     raise PermissionDenied("A clínica não possui um plano de assinatura ativo para adicionar médicos.")
 
         serializer.save()
+
+    def perform_update(self, serializer):
+        """
+        Revoga os tokens do usuário quando ele é desativado ou quando mudam
+        funções, clínica ou senha (o token carrega funções e clínica).
+        """
+        instance = serializer.instance
+        antes = (instance.status, sorted(instance.funcoes or []), instance.clinica_id, instance.password)
+        usuario = serializer.save()
+        depois = (usuario.status, sorted(usuario.funcoes or []), usuario.clinica_id, usuario.password)
+        if antes != depois and (usuario.status != 'ativo' or antes[1:] != depois[1:]):
+            RevogacaoTokens.revogar('usuario', usuario.id)
+
+    def perform_destroy(self, instance):
+        RevogacaoTokens.revogar('usuario', instance.id)
+        instance.delete()
     
     @action(detail=True, methods=['patch', 'options'], authentication_classes=[], permission_classes=[])
     def alterar_status(self, request, pk=None):
@@ -3452,8 +6258,7 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         token = auth_header.split(' ')[1]
     
         try:
-            import jwt
-            payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=[Config.JWT_ALGORITHM])
+            payload = JWTAuthentication.validar_token(token)
             clinica_id = payload.get('clinica_id')
         except:
             return Response({'erro': 'Token inválido ou expirado'}, status=401)
@@ -3481,6 +6286,57 @@ class UsuarioViewSet(viewsets.ModelViewSet):
 # VIEW DE LOGIN
 # ============================================
 
+class UltimoLoginPendente:
+    """
+    Acumula os last_login em memória e grava todos de uma vez a cada
+    LAST_LOGIN_INTERVALO_SEGUNDOS (um único UPDATE), para que picos de login
+    não disputem o lock de escrita do SQLite a cada requisição.
+    """
+
+    _lock = threading.Lock()
+    _pendentes = {}
+    _pid = None
+
+    @classmethod
+    def registrar(cls, usuario_id, momento):
+        with cls._lock:
+            if cls._pid != os.getpid():
+                import atexit
+                cls._pid = os.getpid()
+                cls._pendentes = {}
+                threading.Thread(target=cls._laco, name='last-login', daemon=True).start()
+                atexit.register(cls.descarregar)
+            cls._pendentes[usuario_id] = momento
+
+    @classmethod
+    def descarregar(cls):
+        from django.db import close_old_connections
+        from django.db.models import Case, When, Value, DateTimeField
+
+        with cls._lock:
+            pendentes, cls._pendentes = cls._pendentes, {}
+        if not pendentes:
+            return
+        try:
+            Usuario.objects.filter(id__in=list(pendentes)).update(last_login=Case(
+                *[When(id=usuario_id, then=Value(momento)) for usuario_id, momento in pendentes.items()],
+                output_field=DateTimeField()
+            ))
+        except Exception as e:
+            print(f"⚠️ Falha ao gravar last_login de {len(pendentes)} usuário(s): {e}")
+            with cls._lock:
+                for usuario_id, momento in pendentes.items():
+                    cls._pendentes.setdefault(usuario_id, momento)
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def _laco(cls):
+        import time
+        while True:
+            time.sleep(Config.LAST_LOGIN_INTERVALO_SEGUNDOS)
+            cls.descarregar()
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login_view(request):
@@ -3500,6 +6356,8 @@ def login_view(request):
     try:
         usuario = Usuario.objects.select_related('clinica').get(email=email)
     except Usuario.DoesNotExist:
+        # Mesmo custo de um login real, para não revelar quais e-mails existem
+        HashSenha.simular_verificacao(password)
         return Response({'mensagem': 'Email ou senha incorretos'}, status=401)
     
     if not usuario.check_password(password):
@@ -3515,7 +6373,7 @@ def login_view(request):
             return Response({'mensagem': f'Acesso negado. A clínica "{usuario.clinica.nome}" está com status "{usuario.clinica.get_status_display()}".'}, status=403)
 
     usuario.last_login = timezone.now()
-    usuario.save(update_fields=['last_login'])
+    UltimoLoginPendente.registrar(usuario.id, usuario.last_login)
     
     token = usuario.generate_jwt_token()
     clinica_nome = usuario.clinica.nome if usuario.clinica else None
@@ -3779,6 +6637,42 @@ class AgendamentoSerializer(serializers.ModelSerializer):
         return data
 
 
+class HorarioAtendimentoSerializer(serializers.ModelSerializer):
+    """Serializer para os turnos de atendimento dos médicos"""
+    
+    dia_semana_display = serializers.CharField(source='get_dia_semana_display', read_only=True)
+    medico_nome = serializers.CharField(source='medico.nome_completo', read_only=True)
+    
+    class Meta:
+        model = HorarioAtendimento
+        fields = [
+            'id', 'medico', 'medico_nome', 'dia_semana', 'dia_semana_display',
+            'hora_inicio', 'hora_fim', 'duracao_minutos', 'ativo'
+        ]
+        read_only_fields = ['id', 'medico_nome', 'dia_semana_display']
+    
+    def validate_medico(self, value):
+        request = self.context.get('request')
+        if request and hasattr(request, 'user') and value.clinica_id != request.user.get('clinica_id'):
+            raise serializers.ValidationError("Médico não pertence a esta clínica")
+        if 'medico' not in (value.funcoes or []):
+            raise serializers.ValidationError("O usuário selecionado não tem a função de médico.")
+        return value
+    
+    def validate_duracao_minutos(self, value):
+        if not 5 <= value <= 480:
+            raise serializers.ValidationError("Duração deve estar entre 5 e 480 minutos")
+        return value
+    
+    def validate(self, data):
+        """Mesmas regras de HorarioAtendimento.clean, como erro 400 em vez de ValidationError do Django"""
+        hora_inicio = data.get('hora_inicio', getattr(self.instance, 'hora_inicio', None))
+        hora_fim = data.get('hora_fim', getattr(self.instance, 'hora_fim', None))
+        if hora_inicio and hora_fim and hora_fim <= hora_inicio:
+            raise serializers.ValidationError({'hora_fim': 'O fim do turno deve ser depois do início'})
+        return data
+
+
 class AgendamentoListSerializer(serializers.ModelSerializer):
     """Serializer simplificado para listagem de agendamentos"""
     
@@ -3862,6 +6756,12 @@ class ConsultaSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError("Paciente não pertence a esta clínica")
         return value
     
+    def validate_audio_consulta(self, value):
+        """Referências a arquivo ('arquivo:...') só são gravadas pelo upload em partes."""
+        if value and value.startswith(AUDIO_ARQUIVO_PREFIXO):
+            raise serializers.ValidationError("Envie o áudio pelo upload em partes")
+        return value
+    
 class ConsultaListSerializer(serializers.ModelSerializer):
     """Serializer simplificado para listagem de consultas"""
     
@@ -4414,6 +7314,48 @@ class PacienteViewSet(viewsets.ModelViewSet):
         
         return Response({'duplicado': existe})
     
+    @action(detail=False, methods=['post'], url_path='importar')
+    def importar(self, request):
+        """
+        Importação em massa de pacientes (CSV ou XLSX, primeira linha = cabeçalho)
+        POST /api/pacientes/importar/  (multipart: arquivo=<planilha>)
+        Query params opcionais: simular=true (só valida), encoding=latin-1 (CSV legado)
+        """
+        import zipfile
+        from django.db import DatabaseError
+        
+        arquivo = request.FILES.get('arquivo')
+        if not arquivo:
+            return Response({'erro': 'Arquivo é obrigatório'}, status=400)
+        
+        simular = request.query_params.get('simular', '').lower() in ('1', 'true', 'sim')
+        importacao = ImportacaoPacientes(request.user.get('clinica_id'), simular=simular)
+        
+        try:
+            if arquivo.name.lower().endswith('.xlsx'):
+                linhas = ImportacaoPacientes.linhas_xlsx(arquivo)
+            elif arquivo.name.lower().endswith(('.csv', '.txt')):
+                linhas = ImportacaoPacientes.linhas_csv(arquivo.file, request.query_params.get('encoding', 'utf-8-sig'))
+            else:
+                return Response({'erro': 'Formato não suportado. Use CSV ou XLSX.'}, status=400)
+            resultado = importacao.executar(linhas)
+        except ImportError:
+            return Response({'erro': 'Importação de XLSX requer o pacote openpyxl. Envie o arquivo em CSV.'}, status=400)
+        except (UnicodeDecodeError, LookupError):
+            return Response({'erro': 'Não foi possível ler o CSV. Tente novamente com ?encoding=latin-1',
+                             'importados': 0, 'linhas_lidas': importacao.total_linhas}, status=400)
+        except zipfile.BadZipFile:
+            return Response({'erro': 'Arquivo XLSX inválido ou corrompido', 'importados': 0}, status=400)
+        except DatabaseError as e:
+            print(f"❌ Importação de pacientes interrompida na gravação (clínica {importacao.clinica_id}): {e}")
+            return Response({'erro': 'Falha ao gravar os pacientes; os lotes anteriores foram mantidos',
+                             'importados': importacao.importados,
+                             'ultima_linha_gravada': importacao.ultima_linha_gravada}, status=500)
+        
+        print(f"📥 Importação de pacientes (clínica {importacao.clinica_id}): {resultado['importados']} importados, "
+              f"{resultado['duplicados']} duplicados, {resultado['invalidos']} inválidos")
+        return Response(resultado, status=200 if simular else 201)
+    
     @action(detail=False, methods=['get'], url_path='inativos')
     def listar_inativos(self, request):
         """
@@ -4546,11 +7488,145 @@ class MedicoViewSet(viewsets.ReadOnlyModelViewSet):
         return Usuario.objects.filter(id__in=medicos_ids).order_by('nome_completo')
         # --- FIM DA CORREÇÃO ---
 
+class HorarioAtendimentoViewSet(viewsets.ModelViewSet):
+    """
+    Turnos de atendimento (expediente) dos médicos, usados no cálculo de horários livres.
+    GET/POST /api/horarios-atendimento/?medico_id=
+    """
+    serializer_class = HorarioAtendimentoSerializer
+    permission_classes = [IsAuthenticated, IsSecretariaOrAbove]
+    authentication_classes = [JWTAuthentication]
+    pagination_class = None
+    
+    def get_queryset(self):
+        clinica_id = self.request.user.get('clinica_id')
+        queryset = HorarioAtendimento.objects.select_related('medico').filter(clinica_id=clinica_id)
+        medico_id = self.request.query_params.get('medico_id')
+        if medico_id:
+            queryset = queryset.filter(medico_id=medico_id)
+        return queryset
+    
+    def perform_create(self, serializer):
+        serializer.save(clinica_id=self.request.user.get('clinica_id'))
+
+# ============================================
+# EXPORTAÇÃO DE LISTAGENS (CSV/XLSX)
+# ============================================
+
+class ExportacaoMixin:
+    """
+    Adiciona GET /exportar/?formato=csv|xlsx a um ViewSet, com os mesmos filtros
+    da listagem (get_queryset + busca/ordenação). As linhas são lidas com
+    values_list().iterator(), então a memória não cresce com o período exportado:
+    o CSV sai direto no StreamingHttpResponse e o XLSX é montado em modo
+    write_only num arquivo temporário e enviado em blocos.
+    
+    Cada ViewSet define colunas_exportacao = [(cabeçalho, campo_ou_lookup), ...]
+    e nome_exportacao (prefixo do arquivo).
+    """
+    
+    colunas_exportacao = []
+    nome_exportacao = 'exportacao'
+    TAMANHO_BLOCO_EXPORTACAO = 2000
+    
+    def _linhas_exportacao(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        campos = [campo for _, campo in self.colunas_exportacao]
+        # Campos com choices saem com o rótulo (ex.: "a_receber" -> "A Receber")
+        rotulos = {}
+        for indice, campo in enumerate(campos):
+            if '__' not in campo:
+                choices = queryset.model._meta.get_field(campo).choices
+                if choices:
+                    rotulos[indice] = dict(choices)
+        
+        for linha in queryset.values_list(*campos).iterator(chunk_size=self.TAMANHO_BLOCO_EXPORTACAO):
+            if rotulos:
+                linha = [rotulos[i].get(v, v) if i in rotulos else v for i, v in enumerate(linha)]
+            yield linha
+    
+    @staticmethod
+    def _valor_csv(valor):
+        """Formato que o Excel em pt-BR abre sem conversão"""
+        if valor is None:
+            return ''
+        if isinstance(valor, Decimal):
+            return f"{valor:.2f}".replace('.', ',')
+        if isinstance(valor, datetime):
+            return timezone.localtime(valor).strftime('%d/%m/%Y %H:%M') if timezone.is_aware(valor) else valor.strftime('%d/%m/%Y %H:%M')
+        if isinstance(valor, date):
+            return valor.strftime('%d/%m/%Y')
+        if hasattr(valor, 'strftime'):
+            return valor.strftime('%H:%M')
+        return valor
+    
+    def _exportar_csv(self, nome_arquivo):
+        import csv
+        from django.http import StreamingHttpResponse
+        
+        class _Eco:
+            def write(self, valor):
+                return valor
+        
+        escritor = csv.writer(_Eco(), delimiter=';')
+        
+        def gerar():
+            yield '\ufeff' + escritor.writerow([cabecalho for cabecalho, _ in self.colunas_exportacao])
+            for linha in self._linhas_exportacao():
+                yield escritor.writerow([self._valor_csv(v) for v in linha])
+        
+        resposta = StreamingHttpResponse(gerar(), content_type='text/csv; charset=utf-8')
+        resposta['Content-Disposition'] = f'attachment; filename="{nome_arquivo}.csv"'
+        return resposta
+    
+    def _exportar_xlsx(self, nome_arquivo):
+        import tempfile
+        import openpyxl
+        from django.http import FileResponse
+        
+        planilha = openpyxl.Workbook(write_only=True)
+        aba = planilha.create_sheet(self.nome_exportacao[:31])
+        aba.append([cabecalho for cabecalho, _ in self.colunas_exportacao])
+        for linha in self._linhas_exportacao():
+            aba.append([
+                timezone.localtime(v).replace(tzinfo=None) if isinstance(v, datetime) and timezone.is_aware(v) else v
+                for v in linha
+            ])
+        
+        # O XLSX é um zip e só fica completo no save; vai para disco e é enviado em blocos
+        temporario = tempfile.TemporaryFile()
+        planilha.save(temporario)
+        temporario.seek(0)
+        return FileResponse(
+            temporario,
+            as_attachment=True,
+            filename=f'{nome_arquivo}.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    
+    @action(detail=False, methods=['get'], url_path='exportar')
+    def exportar(self, request):
+        """
+        Exporta a listagem filtrada
+        GET /api/<recurso>/exportar/?formato=csv|xlsx&<mesmos filtros da listagem>
+        """
+        formato = request.query_params.get('formato', 'csv').lower()
+        nome_arquivo = f"{self.nome_exportacao}_{timezone.localtime().strftime('%Y%m%d_%H%M')}"
+        
+        if formato == 'csv':
+            return self._exportar_csv(nome_arquivo)
+        if formato == 'xlsx':
+            try:
+                return self._exportar_xlsx(nome_arquivo)
+            except ImportError:
+                return Response({'erro': 'Exportação em XLSX requer o pacote openpyxl. Use formato=csv.'}, status=400)
+        return Response({'erro': 'Formato inválido. Use csv ou xlsx.'}, status=400)
+
 # ============================================
 # VIEWSET AGENDAMENTO
 # ============================================
 
-class AgendamentoViewSet(viewsets.ModelViewSet):
+class AgendamentoViewSet(ExportacaoMixin, viewsets.ModelViewSet):
     """
     ViewSet para CRUD de Agendamentos
     
@@ -4571,6 +7647,14 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
     
     ordering = ['data', 'hora']
     
+    nome_exportacao = 'agendamentos'
+    colunas_exportacao = [
+        ('ID', 'id'), ('Data', 'data'), ('Hora', 'hora'), ('Paciente', 'paciente_nome'),
+        ('CPF', 'paciente_cpf'), ('Convênio', 'convenio'), ('Médico', 'medico_responsavel__nome_completo'),
+        ('Serviço', 'servico'), ('Tipo', 'tipo'), ('Valor', 'valor'), ('Status', 'status'),
+        ('Observações', 'observacoes'),
+    ]
+    
     def perform_create(self, serializer):
         """Injeta o clinica_id do usuário logado antes de salvar."""
         clinica_id = self.request.user.get('clinica_id')
@@ -4647,7 +7731,7 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         
         Consulta.objects.filter(agendamento=instance).delete()
-        Receita.objects.filter(agendamento=instance).delete()
+        excluir_lancamentos_com_estorno(Receita.objects.filter(agendamento=instance), request.user.get('sub'), request.user.get('nome'))
         
         self.perform_destroy(instance)
         
@@ -4690,6 +7774,94 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
             'total': queryset.count()
         })
     
+    @action(detail=False, methods=['post'], url_path='lote')
+    def lote(self, request):
+        """
+        Cria vários agendamentos de uma vez
+        POST /api/agendamentos/lote/
+        
+        Recorrência (campos comuns + regra):
+            {"paciente": 12, "medico_responsavel": 3, "servico": "Consulta", "tipo": "Revisão",
+             "recorrencia": {"data_inicio": "2025-10-07", "dias_semana": [1], "hora": "14:00", "semanas": 12}}
+        Lista explícita (ex.: migração de agenda):
+            {"itens": [{"paciente": 12, "data": "2025-10-07", "hora": "14:00", ...}, ...]}
+        
+        Por padrão é tudo ou nada; envie "parcial": true para gravar os itens válidos
+        e receber os conflitos/erros no resultado de cada item.
+        """
+        dados = request.data
+        base = {campo: dados[campo] for campo in AgendamentoLote.CAMPOS if campo in dados}
+        
+        if dados.get('recorrencia'):
+            try:
+                itens = AgendamentoLote.expandir_recorrencia(base, dados['recorrencia'])
+            except (KeyError, TypeError, ValueError) as e:
+                return Response({'erro': f'Regra de recorrência inválida: {e}'}, status=400)
+        else:
+            itens = dados.get('itens', [])
+            if not isinstance(itens, list) or not all(isinstance(item, dict) for item in itens):
+                return Response({'erro': '"itens" deve ser uma lista de objetos de agendamento'}, status=400)
+            itens = [{**base, **item} for item in itens]
+        
+        if not itens:
+            return Response({'erro': 'Nenhum agendamento a criar. Envie "itens" ou "recorrencia".'}, status=400)
+        if len(itens) > AgendamentoLote.MAXIMO_ITENS:
+            return Response({'erro': f'Máximo de {AgendamentoLote.MAXIMO_ITENS} agendamentos por lote'}, status=400)
+        
+        parcial = str(dados.get('parcial', '')).lower() in ('1', 'true', 'sim')
+        criados, resultados = AgendamentoLote(request.user.get('clinica_id'), itens).executar(parcial=parcial)
+        
+        resposta = {
+            'total': len(itens),
+            'criados': criados,
+            'conflitos': sum(1 for r in resultados if r.get('status') == 'conflito'),
+            'invalidos': sum(1 for r in resultados if r.get('status') == 'invalido'),
+            'itens': resultados,
+        }
+        if criados:
+            return Response(resposta, status=201)
+        return Response({'erro': 'Nenhum agendamento foi criado', **resposta}, status=409 if resposta['conflitos'] else 400)
+    
+    @action(detail=False, methods=['get'], url_path='horarios-livres')
+    def horarios_livres(self, request):
+        """
+        Horários livres por médico e dia, conforme o expediente de cada médico
+        GET /api/agendamentos/horarios-livres/?data_inicio=2025-10-06&dias=7&medico_id=3,5
+        (data_fim pode substituir dias; máximo de 31 dias por chamada)
+        """
+        user = request.user
+        clinica_id = user.get('clinica_id')
+        funcoes = user.get('funcoes', [])
+        
+        try:
+            data_inicio = date.fromisoformat(request.query_params.get('data_inicio') or date.today().isoformat())
+            if request.query_params.get('data_fim'):
+                data_fim = date.fromisoformat(request.query_params['data_fim'])
+            else:
+                data_fim = data_inicio + timedelta(days=int(request.query_params.get('dias', 7)) - 1)
+            ids_pedidos = [int(i) for i in request.query_params.get('medico_id', '').split(',') if i.strip()]
+        except ValueError:
+            return Response({'erro': 'Parâmetros inválidos. Use datas AAAA-MM-DD e medico_id numérico.'}, status=400)
+        
+        if data_fim < data_inicio:
+            return Response({'erro': 'data_fim deve ser igual ou posterior a data_inicio'}, status=400)
+        if (data_fim - data_inicio).days + 1 > AgendaDisponibilidade.MAXIMO_DIAS:
+            return Response({'erro': f'Intervalo máximo de {AgendaDisponibilidade.MAXIMO_DIAS} dias'}, status=400)
+        
+        medicos = [u for u in Usuario.objects.filter(clinica_id=clinica_id, status='ativo').order_by('nome_completo') if 'medico' in u.funcoes]
+        # Médico sem função administrativa só consulta a própria agenda (mesma regra da listagem)
+        if not any(f in funcoes for f in ['admin', 'secretaria']):
+            ids_pedidos = [int(user.get('sub'))]
+        if ids_pedidos:
+            medicos = [m for m in medicos if m.id in ids_pedidos]
+        
+        agenda = AgendaDisponibilidade(clinica_id, medicos, data_inicio, data_fim)
+        return Response({
+            'data_inicio': data_inicio.isoformat(),
+            'data_fim': data_fim.isoformat(),
+            'medicos': agenda.resumo(),
+        })
+    
     @action(detail=False, methods=['get'])
     def verificar_disponibilidade(self, request):
         """
@@ -4703,7 +7875,7 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
             return Response({'erro': 'Data e hora são obrigatórios'}, status=400)
         
         clinica_id = request.user.get('clinica_id')
-        disponivel = Agendamento.verificar_disponibilidade(clinica_id, data, hora)
+        disponivel = Agendamento.verificar_disponibilidade(clinica_id, data, hora, request.query_params.get('medico_id'))
         
         return Response({
             'disponivel': disponivel,
@@ -4727,8 +7899,7 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         token = auth_header.split(' ')[1]
         
         try:
-            import jwt
-            payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=[Config.JWT_ALGORITHM])
+            payload = JWTAuthentication.validar_token(token)
             clinica_id = payload.get('clinica_id')
         except:
             return Response({'erro': 'Token inválido ou expirado'}, status=401)
@@ -4749,7 +7920,7 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
         status_antigo = agendamento.status
         
         if status_antigo == 'Realizado' and novo_status != 'Realizado':
-            Receita.objects.filter(agendamento=agendamento).delete()
+            excluir_lancamentos_com_estorno(Receita.objects.filter(agendamento=agendamento), payload.get('sub'), payload.get('nome'))
             print(f"INFO: Receita vinculada ao agendamento {agendamento.id} foi excluída devido à reversão de status.")
             
         agendamento.status = novo_status
@@ -4796,6 +7967,143 @@ class AgendamentoViewSet(viewsets.ModelViewSet):
             }
         })
 
+# ============================================
+# UPLOAD DE ÁUDIO EM PARTES (RETOMÁVEL)
+# ============================================
+
+AUDIO_UPLOAD_DIR = os.path.join(Config.BASE_DIR, os.getenv('AUDIO_UPLOAD_DIR', 'intellimed_uploads'))
+# Cada parte precisa caber no DATA_UPLOAD_MAX_MEMORY_SIZE padrão do Django (2,5 MB)
+AUDIO_UPLOAD_CHUNK_MAX = int(os.getenv('AUDIO_UPLOAD_CHUNK_MAX', 2 * 1024 * 1024))
+AUDIO_UPLOAD_TAMANHO_MAX = int(os.getenv('AUDIO_UPLOAD_TAMANHO_MAX', 300 * 1024 * 1024))
+AUDIO_UPLOAD_VALIDADE_HORAS = int(os.getenv('AUDIO_UPLOAD_VALIDADE_HORAS', 24))
+# Áudios concluídos ficam em disco; a consulta guarda só a referência 'arquivo:<caminho relativo>'
+AUDIO_CONSULTA_DIR = os.path.join(Config.BASE_DIR, os.getenv('AUDIO_CONSULTA_DIR', 'intellimed_audios'))
+AUDIO_ARQUIVO_PREFIXO = 'arquivo:'
+
+_audio_upload_locks = {}
+_audio_upload_locks_guard = threading.Lock()
+
+def _audio_upload_lock(upload_id):
+    """Lock por upload, para que duas partes do mesmo upload não sejam gravadas ao mesmo tempo."""
+    with _audio_upload_locks_guard:
+        return _audio_upload_locks.setdefault(upload_id, threading.Lock())
+
+def _audio_upload_caminhos(clinica_id, upload_id):
+    """Retorna (arquivo de dados, arquivo de metadados) do upload."""
+    if not re.fullmatch(r'[0-9a-f]{32}', upload_id or ''):
+        raise ValueError('upload_id inválido')
+    pasta = os.path.join(AUDIO_UPLOAD_DIR, str(int(clinica_id)))
+    return os.path.join(pasta, f"{upload_id}.part"), os.path.join(pasta, f"{upload_id}.json")
+
+def _audio_upload_ler_meta(clinica_id, upload_id):
+    _, meta_path = _audio_upload_caminhos(clinica_id, upload_id)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def _audio_upload_gravar_meta(clinica_id, upload_id, meta):
+    _, meta_path = _audio_upload_caminhos(clinica_id, upload_id)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+def _audio_upload_estado(clinica_id, upload_id, meta):
+    """Estado do upload; o offset é sempre o tamanho real já gravado em disco."""
+    dados_path, _ = _audio_upload_caminhos(clinica_id, upload_id)
+    offset = os.path.getsize(dados_path) if os.path.exists(dados_path) else 0
+    return {
+        'upload_id': upload_id,
+        'offset': offset,
+        'tamanho_total': meta.get('tamanho_total'),
+        'audio_formato': meta.get('audio_formato'),
+        'tamanho_chunk_max': AUDIO_UPLOAD_CHUNK_MAX,
+        'expira_em': meta.get('expira_em'),
+    }
+
+def _audio_upload_remover(clinica_id, upload_id):
+    for caminho in _audio_upload_caminhos(clinica_id, upload_id):
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+    with _audio_upload_locks_guard:
+        _audio_upload_locks.pop(upload_id, None)
+
+def _audio_consulta_caminho(referencia, clinica_id):
+    """Caminho absoluto de uma referência 'arquivo:...', sempre dentro da pasta da clínica."""
+    relativo = referencia[len(AUDIO_ARQUIVO_PREFIXO):]
+    base = os.path.realpath(os.path.join(AUDIO_CONSULTA_DIR, str(int(clinica_id))))
+    caminho = os.path.realpath(os.path.join(AUDIO_CONSULTA_DIR, relativo))
+    if os.path.commonpath([base, caminho]) != base:
+        raise ValueError('Referência de áudio inválida')
+    return caminho
+
+def _audio_consulta_guardar(clinica_id, consulta_id, upload_id, dados_path, audio_formato):
+    """Move o arquivo do upload para o armazenamento definitivo e retorna a referência."""
+    import shutil
+    relativo = os.path.join(str(int(clinica_id)), f"{int(consulta_id)}_{upload_id}.{audio_formato}")
+    destino = os.path.join(AUDIO_CONSULTA_DIR, relativo)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    shutil.move(dados_path, destino)
+    return AUDIO_ARQUIVO_PREFIXO + relativo.replace(os.sep, '/')
+
+def _audio_consulta_remover_arquivo(valor, clinica_id):
+    """Apaga o arquivo de um áudio substituído (valores em base64 não têm arquivo)."""
+    if not isinstance(valor, str) or not valor.startswith(AUDIO_ARQUIVO_PREFIXO):
+        return
+    try:
+        os.remove(_audio_consulta_caminho(valor, clinica_id))
+    except (FileNotFoundError, ValueError):
+        pass
+
+def ler_audio_consulta(valor, clinica_id):
+    """Retorna os bytes do áudio da consulta, seja base64, data URL ou referência a arquivo da clínica."""
+    if valor.startswith(AUDIO_ARQUIVO_PREFIXO):
+        with open(_audio_consulta_caminho(valor, clinica_id), 'rb') as f:
+            return f.read()
+    if valor.startswith('data:'):
+        valor = valor.split(',', 1)[1]
+    return base64.b64decode(valor)
+
+def _audio_arquivo_para_data_url(dados_path, audio_formato):
+    """Codifica o arquivo em base64 por blocos, sem carregar o áudio inteiro de uma vez."""
+    bloco = 3 * 256 * 1024  # múltiplo de 3: os pedaços em base64 concatenam sem padding
+    partes = [f"data:audio/{audio_formato};base64,"]
+    with open(dados_path, 'rb') as f:
+        while True:
+            dados = f.read(bloco)
+            if not dados:
+                break
+            partes.append(base64.b64encode(dados).decode('ascii'))
+    return ''.join(partes)
+
+def limpar_uploads_audio_expirados():
+    """Remove uploads de áudio abandonados (executado pelo agendador)."""
+    if not os.path.isdir(AUDIO_UPLOAD_DIR):
+        return 0
+    agora = timezone.now()
+    removidos = 0
+    for pasta_clinica in os.listdir(AUDIO_UPLOAD_DIR):
+        if not pasta_clinica.isdigit():
+            continue
+        pasta = os.path.join(AUDIO_UPLOAD_DIR, pasta_clinica)
+        for nome in os.listdir(pasta):
+            if not nome.endswith('.json'):
+                continue
+            upload_id = nome[:-5]
+            meta = _audio_upload_ler_meta(pasta_clinica, upload_id) or {}
+            expira_em = meta.get('expira_em')
+            if not expira_em or datetime.fromisoformat(expira_em) <= agora:
+                _audio_upload_remover(pasta_clinica, upload_id)
+                removidos += 1
+    if removidos:
+        print(f"🧹 Uploads de áudio: {removidos} upload(s) expirado(s) removido(s)")
+    return removidos
+
 # ============================================
 # VIEWSET CONSULTA COMPLETO
 # ============================================
@@ -4906,13 +8214,143 @@ class ConsultaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], url_path='salvar-audio')
     def salvar_audio(self, request, pk=None):
         consulta = self.get_object()
-        audio_base64 = request.data.get('audio_base64')
-        if not audio_base64:
-            return Response({'erro': 'Nenhum áudio fornecido.'}, status=status.HTTP_400_BAD_REQUEST)
-        consulta.audio_consulta = audio_base64
-        consulta.audio_formato = request.data.get('audio_formato', 'webm')
-        consulta.status = 'gravando' 
-        consulta.save(update_fields=['audio_consulta', 'audio_formato', 'status'])
+        audio_base64 = request.data.get('audio_base64')
+        if not audio_base64:
+            return Response({'erro': 'Nenhum áudio fornecido.'}, status=status.HTTP_400_BAD_REQUEST)
+        if audio_base64.startswith(AUDIO_ARQUIVO_PREFIXO):
+            return Response({'erro': 'Áudio inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+        audio_anterior = consulta.audio_consulta
+        consulta.audio_consulta = audio_base64
+        consulta.audio_formato = request.data.get('audio_formato', 'webm')
+        consulta.status = 'gravando' 
+        consulta.save(update_fields=['audio_consulta', 'audio_formato', 'status'])
+        _audio_consulta_remover_arquivo(audio_anterior, consulta.clinica_id)
+        serializer = self.get_serializer(consulta)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'], url_path='audio-upload')
+    def iniciar_upload_audio(self, request, pk=None):
+        """
+        Inicia um upload de áudio em partes. As partes são enviadas em seguida com
+        PUT .../audio-upload/{upload_id}/ (corpo binário, cabeçalho Upload-Offset).
+        """
+        consulta = self.get_object()
+        clinica_id = request.user.get('clinica_id')
+        audio_formato = re.sub(r'[^a-z0-9]', '', str(request.data.get('audio_formato', 'webm')).lower()) or 'webm'
+        try:
+            tamanho_total = int(request.data['tamanho_total']) if request.data.get('tamanho_total') else None
+        except (TypeError, ValueError):
+            return Response({'erro': 'tamanho_total inválido'}, status=status.HTTP_400_BAD_REQUEST)
+        if tamanho_total is not None and not (0 < tamanho_total <= AUDIO_UPLOAD_TAMANHO_MAX):
+            return Response({'erro': f'O áudio deve ter no máximo {AUDIO_UPLOAD_TAMANHO_MAX} bytes'}, status=status.HTTP_400_BAD_REQUEST)
+        sha256 = (request.data.get('sha256') or '').lower() or None
+
+        upload_id = secrets.token_hex(16)
+        meta = {
+            'consulta_id': consulta.id,
+            'clinica_id': clinica_id,
+            'audio_formato': audio_formato,
+            'tamanho_total': tamanho_total,
+            'sha256': sha256,
+            'expira_em': (timezone.now() + timedelta(hours=AUDIO_UPLOAD_VALIDADE_HORAS)).isoformat(),
+        }
+        _audio_upload_gravar_meta(clinica_id, upload_id, meta)
+        dados_path, _ = _audio_upload_caminhos(clinica_id, upload_id)
+        open(dados_path, 'wb').close()
+        return Response(_audio_upload_estado(clinica_id, upload_id, meta), status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get', 'put'], url_path=r'audio-upload/(?P<upload_id>[0-9a-f]{32})')
+    def upload_audio_parte(self, request, pk=None, upload_id=None):
+        """
+        GET: offset atual (para retomar após falha de rede).
+        PUT: grava uma parte no offset informado em Upload-Offset. O cabeçalho
+        opcional Upload-Checksum (sha256 hex da parte) é verificado antes de gravar.
+        """
+        import hashlib
+        consulta = self.get_object()
+        clinica_id = request.user.get('clinica_id')
+        meta = _audio_upload_ler_meta(clinica_id, upload_id)
+        if not meta or meta.get('consulta_id') != consulta.id:
+            return Response({'erro': 'Upload não encontrado ou expirado'}, status=status.HTTP_404_NOT_FOUND)
+
+        if request.method == 'GET':
+            return Response(_audio_upload_estado(clinica_id, upload_id, meta))
+
+        try:
+            offset = int(request.META.get('HTTP_UPLOAD_OFFSET', request.query_params.get('offset', '')))
+        except ValueError:
+            return Response({'erro': 'Cabeçalho Upload-Offset obrigatório'}, status=status.HTTP_400_BAD_REQUEST)
+
+        parte = request.body
+        if not parte:
+            return Response({'erro': 'Parte vazia'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(parte) > AUDIO_UPLOAD_CHUNK_MAX:
+            return Response({'erro': f'Cada parte deve ter no máximo {AUDIO_UPLOAD_CHUNK_MAX} bytes'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        checksum = request.META.get('HTTP_UPLOAD_CHECKSUM', '').lower()
+        if checksum and hashlib.sha256(parte).hexdigest() != checksum:
+            return Response({'erro': 'Checksum da parte não confere', **_audio_upload_estado(clinica_id, upload_id, meta)}, status=status.HTTP_400_BAD_REQUEST)
+
+        dados_path, _ = _audio_upload_caminhos(clinica_id, upload_id)
+        with _audio_upload_lock(upload_id):
+            atual = os.path.getsize(dados_path)
+            if offset + len(parte) <= atual:
+                # Reenvio de uma parte já gravada (resposta anterior perdida na rede)
+                with open(dados_path, 'rb') as f:
+                    f.seek(offset)
+                    if f.read(len(parte)) == parte:
+                        return Response(_audio_upload_estado(clinica_id, upload_id, meta))
+            if offset != atual:
+                return Response({'erro': 'Offset divergente; retome a partir do offset informado', **_audio_upload_estado(clinica_id, upload_id, meta)}, status=status.HTTP_409_CONFLICT)
+            limite = meta.get('tamanho_total') or AUDIO_UPLOAD_TAMANHO_MAX
+            if atual + len(parte) > limite:
+                return Response({'erro': 'A parte ultrapassa o tamanho total do upload'}, status=status.HTTP_400_BAD_REQUEST)
+            with open(dados_path, 'ab') as f:
+                f.write(parte)
+
+        return Response(_audio_upload_estado(clinica_id, upload_id, meta))
+
+    @action(detail=True, methods=['post'], url_path=r'audio-upload/(?P<upload_id>[0-9a-f]{32})/concluir')
+    def concluir_upload_audio(self, request, pk=None, upload_id=None):
+        """
+        Valida tamanho e checksum do arquivo completo e grava o áudio na consulta.
+        Com {"transcrever": true} a transcrição é disparada em seguida.
+        """
+        import hashlib
+        consulta = self.get_object()
+        clinica_id = request.user.get('clinica_id')
+        meta = _audio_upload_ler_meta(clinica_id, upload_id)
+        if not meta or meta.get('consulta_id') != consulta.id:
+            return Response({'erro': 'Upload não encontrado ou expirado'}, status=status.HTTP_404_NOT_FOUND)
+
+        dados_path, _ = _audio_upload_caminhos(clinica_id, upload_id)
+        with _audio_upload_lock(upload_id):
+            estado = _audio_upload_estado(clinica_id, upload_id, meta)
+            if not estado['offset']:
+                return Response({'erro': 'Nenhuma parte recebida', **estado}, status=status.HTTP_400_BAD_REQUEST)
+            if meta.get('tamanho_total') and estado['offset'] != meta['tamanho_total']:
+                return Response({'erro': 'Upload incompleto', **estado}, status=status.HTTP_409_CONFLICT)
+
+            sha256 = (request.data.get('sha256') or meta.get('sha256') or '').lower()
+            if sha256:
+                h = hashlib.sha256()
+                with open(dados_path, 'rb') as f:
+                    for bloco in iter(lambda: f.read(1024 * 1024), b''):
+                        h.update(bloco)
+                if h.hexdigest() != sha256:
+                    return Response({'erro': 'Checksum do arquivo não confere', **estado}, status=status.HTTP_400_BAD_REQUEST)
+
+            audio_anterior = consulta.audio_consulta
+            consulta.audio_consulta = _audio_consulta_guardar(clinica_id, consulta.id, upload_id, dados_path, meta['audio_formato'])
+            consulta.audio_formato = meta['audio_formato']
+            consulta.status = 'gravando'
+            consulta.save(update_fields=['audio_consulta', 'audio_formato', 'status'])
+            _audio_upload_remover(clinica_id, upload_id)
+            _audio_consulta_remover_arquivo(audio_anterior, consulta.clinica_id)
+
+        if str(request.data.get('transcrever', '')).lower() in ('1', 'true'):
+            return self.transcrever_audio_action(request, pk=pk)
+
         serializer = self.get_serializer(consulta)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -4941,11 +8379,46 @@ class ConsultaViewSet(viewsets.ModelViewSet):
             return Response({'erro': 'Tipo de documento não fornecido'}, status=400)
         if not consulta.medico_responsavel:
             return Response({'erro': 'Consulta sem médico responsável definido'}, status=400)
-        resultado = gerar_documento_medico_sync(consulta.id, tipo, consulta.medico_responsavel, consulta.medico_crm or '')
+        forcar = str(request.data.get('regerar', '')).lower() in ('1', 'true')
+        resultado = gerar_documento_medico_sync(consulta.id, tipo, consulta.medico_responsavel, consulta.medico_crm or '', forcar=forcar)
         if resultado['sucesso']:
-            return Response({'mensagem': 'Documento gerado com sucesso', 'documento': {'tipo': resultado['tipo'], 'conteudo': resultado['conteudo'], 'data_geracao': resultado['data_geracao']}})
+            response = Response({'mensagem': 'Documento gerado com sucesso', 'documento': {'tipo': resultado['tipo'], 'conteudo': resultado['conteudo'], 'data_geracao': resultado['data_geracao']}})
+            # Documento já existente não consome o limite do plano
+            if resultado.get('from_cache'):
+                response.consumo_ia_unidades = 0
+            return response
         else:
             return Response({'erro': 'Erro ao gerar documento', 'detalhes': resultado['erro']}, status=500)
+
+    @verificar_limite_ia(tipo_consumo='documento_medico_ia')
+    @action(detail=True, methods=['post'], url_path='gerar-documentos')
+    def gerar_documentos(self, request, pk=None):
+        """Gera vários tipos de documento da consulta em uma única requisição à IA."""
+        consulta = self.get_object()
+        tipos = request.data.get('tipos')
+        if isinstance(tipos, str):
+            tipos = [t.strip() for t in tipos.split(',')]
+        if not tipos or not isinstance(tipos, list):
+            return Response({'erro': 'Informe a lista de tipos de documento em "tipos"'}, status=400)
+        if not consulta.medico_responsavel:
+            return Response({'erro': 'Consulta sem médico responsável definido'}, status=400)
+        forcar = str(request.data.get('regerar', '')).lower() in ('1', 'true')
+        resultado = gerar_documentos_medicos_lote(
+            consulta.id, tipos, consulta.medico_responsavel, consulta.medico_crm or '', forcar=forcar,
+            maximo_novos=getattr(request, 'cota_ia_restante', None)
+        )
+        if resultado.get('limite_excedido'):
+            return Response({'erro': resultado['erro']}, status=status.HTTP_403_FORBIDDEN)
+        if not resultado['sucesso']:
+            return Response({'erro': 'Erro ao gerar documentos', 'detalhes': resultado['erro']}, status=500)
+        response = Response({
+            'mensagem': f"{len(resultado['documentos'])} documento(s) gerado(s)",
+            'documentos': list(resultado['documentos'].values()),
+            'erros': resultado['erros']
+        })
+        # Documentos já existentes não consomem o limite do plano
+        response.consumo_ia_unidades = resultado['gerados']
+        return response
     
     @action(detail=True, methods=['post'], url_path='salvar-documento')
     def salvar_documento(self, request, pk=None):
@@ -4960,12 +8433,13 @@ class ConsultaViewSet(viewsets.ModelViewSet):
         encontrado = False
         for i, doc in enumerate(consulta.documentos_gerados):
             if doc.get('tipo') == tipo:
-                consulta.documentos_gerados[i] = {'tipo': tipo, 'data_geracao': timezone.now().isoformat(), 'editado': True, 'medico': consulta.medico_responsavel}
+                consulta.documentos_gerados[i] = {'tipo': tipo, 'conteudo': conteudo, 'data_geracao': timezone.now().isoformat(), 'editado': True, 'medico': consulta.medico_responsavel}
                 encontrado = True
                 break
         if not encontrado:
-            consulta.documentos_gerados.append({'tipo': tipo, 'data_geracao': timezone.now().isoformat(), 'editado': True, 'medico': consulta.medico_responsavel})
+            consulta.documentos_gerados.append({'tipo': tipo, 'conteudo': conteudo, 'data_geracao': timezone.now().isoformat(), 'editado': True, 'medico': consulta.medico_responsavel})
         consulta.save()
+        registrar_evento_auditoria(**_evento_auditoria_documento(consulta, tipo, True, request.user.get('nome')))
         serializer = ConsultaSerializer(consulta, context={'request': request})
         return Response({'mensagem': 'Documento salvo com sucesso', 'consulta': serializer.data})
     
@@ -5048,7 +8522,8 @@ class ExameViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         clinica_id = self.request.user.get('clinica_id')
-        serializer.save(clinica_id=clinica_id)
+        exame = serializer.save(clinica_id=clinica_id)
+        registrar_evento_auditoria(**_evento_auditoria_exame(exame, 'exame_gerado'))
     
     @verificar_limite_ia(tipo_consumo='laudo_exame_ia')
     @action(detail=False, methods=['post'], url_path='upload-ia')
@@ -5106,23 +8581,34 @@ class ExameViewSet(viewsets.ModelViewSet):
             
             if resultado['sucesso']:
                 exame.refresh_from_db()
+                registrar_evento_auditoria(**_evento_auditoria_exame(exame, 'exame_gerado'))
                 serializer = ExameSerializer(exame, context={'request': request})
-                return Response({
+                response = Response({
                     'mensagem': 'Exame interpretado com sucesso',
                     'exame': serializer.data,
-                    'tempo_processamento': resultado['tempo_processamento']
+                    'tempo_processamento': resultado['tempo_processamento'],
+                    'from_cache': resultado.get('from_cache', False)
                 }, status=201)
+                if resultado.get('from_cache') and not Config.IA_CACHE_HIT_CONSOME_COTA:
+                    response.consumo_ia_unidades = 0
+                return response
             else:
-                exame.delete()
+                # O arquivo enviado fica guardado (status erro_ia) para nova tentativa em interpretar-ia
+                exame.refresh_from_db()
+                registrar_evento_auditoria(**_evento_auditoria_exame(exame, 'exame_gerado'))
                 return Response({
                     'erro': 'Erro ao interpretar exame com IA',
-                    'detalhes': resultado.get('erro', 'Erro desconhecido')
+                    'detalhes': resultado.get('erro', 'Erro desconhecido'),
+                    'exame_id': exame.id,
                 }, status=500)
         except Exception as e:
-            exame.delete()
+            Exame.objects.filter(id=exame.id).update(status='erro_ia', erro_ia=str(e))
+            exame.refresh_from_db()
+            registrar_evento_auditoria(**_evento_auditoria_exame(exame, 'exame_gerado'))
             return Response({
                 'erro': 'Erro crítico durante a chamada de interpretação',
-                'detalhes': str(e)
+                'detalhes': str(e),
+                'exame_id': exame.id,
             }, status=500)
 
     @verificar_limite_ia(tipo_consumo='laudo_exame_ia')
@@ -5134,19 +8620,16 @@ class ExameViewSet(viewsets.ModelViewSet):
         if exame.status in ['processando_ia']:
             return Response({'erro': 'Exame já está sendo processado'}, status=400)
         
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            resultado = loop.run_until_complete(interpretar_exame_com_gemini(exame.id))
-            if resultado['sucesso']:
-                exame.refresh_from_db()
-                serializer = ExameSerializer(exame, context={'request': request})
-                return Response({'mensagem': 'Exame interpretado com sucesso', 'exame': serializer.data})
-            else:
-                return Response({'erro': 'Erro ao interpretar exame', 'detalhes': resultado['erro']}, status=500)
-        finally:
-            loop.close()
+        resultado = interpretar_exame_com_gemini(exame.id)
+        if resultado['sucesso']:
+            exame.refresh_from_db()
+            serializer = ExameSerializer(exame, context={'request': request})
+            response = Response({'mensagem': 'Exame interpretado com sucesso', 'exame': serializer.data, 'from_cache': resultado.get('from_cache', False)})
+            if resultado.get('from_cache') and not Config.IA_CACHE_HIT_CONSOME_COTA:
+                response.consumo_ia_unidades = 0
+            return response
+        else:
+            return Response({'erro': 'Erro ao interpretar exame', 'detalhes': resultado['erro']}, status=500)
 
     @action(detail=True, methods=['post'], url_path='revisar-medico')
     def revisar_medico(self, request, pk=None):
@@ -5175,6 +8658,7 @@ class ExameViewSet(viewsets.ModelViewSet):
             exame.interpretacao_ia += revisao_texto
         
         exame.save()
+        registrar_evento_auditoria(**_evento_auditoria_exame(exame, 'exame_editado'))
         serializer = ExameSerializer(exame, context={'request': request})
         return Response({'mensagem': 'Revisão médica adicionada com sucesso', 'exame': serializer.data})
     
@@ -5277,7 +8761,7 @@ class CategoriaDespesaViewSet(viewsets.ModelViewSet):
 # VIEWSET RECEITA
 # ============================================
 
-class ReceitaViewSet(viewsets.ModelViewSet):
+class ReceitaViewSet(ExportacaoMixin, viewsets.ModelViewSet):
     """
     ViewSet para CRUD de Receitas
     """
@@ -5288,6 +8772,15 @@ class ReceitaViewSet(viewsets.ModelViewSet):
     ordering_fields = ['data_vencimento', 'valor']
     ordering = ['-data_vencimento']
     
+    nome_exportacao = 'receitas'
+    colunas_exportacao = [
+        ('ID', 'id'), ('Descrição', 'descricao'), ('Categoria', 'categoria__nome'),
+        ('Paciente', 'paciente__nome_completo'), ('Valor', 'valor'), ('Vencimento', 'data_vencimento'),
+        ('Recebimento', 'data_recebimento'), ('Status', 'status'), ('Forma de pagamento', 'forma_pagamento'),
+        ('Cadastrado por', 'usuario_cadastro_nome'), ('Recebido por', 'usuario_recebimento_nome'),
+        ('Observações', 'observacoes'),
+    ]
+    
     def get_queryset(self):
         clinica_id = self.request.user.get('clinica_id')
         Receita.atualizar_status_vencidos(clinica_id)
@@ -5337,7 +8830,7 @@ class ReceitaViewSet(viewsets.ModelViewSet):
             data_operacao_recebimento = timezone.now()
 
         # Salva o objeto no banco de dados injetando os campos de auditoria
-        serializer.save(
+        receita = serializer.save(
             clinica_id=clinica_id,
             usuario_cadastro_id=usuario_cadastro_id,
             usuario_cadastro_nome=usuario_cadastro_nome,
@@ -5345,6 +8838,8 @@ class ReceitaViewSet(viewsets.ModelViewSet):
             usuario_recebimento_nome=usuario_recebimento_nome,
             data_operacao_recebimento=data_operacao_recebimento
         )
+        if receita.status == 'recebida':
+            registrar_evento_auditoria(**_evento_auditoria_financeiro(receita))
     
     def partial_update(self, request, *args, **kwargs):
         """
@@ -5354,7 +8849,9 @@ class ReceitaViewSet(viewsets.ModelViewSet):
         
         # Se está marcando como recebida, registrar auditoria
         if 'status' in request.data and request.data['status'] == 'recebida':
+            import copy
             user = request.user
+            anterior = copy.copy(instance)
             instance.status = 'recebida'
             instance.data_recebimento = request.data.get('data_recebimento', date.today())
             instance.forma_pagamento = request.data.get('forma_pagamento', instance.forma_pagamento)
@@ -5372,6 +8869,7 @@ class ReceitaViewSet(viewsets.ModelViewSet):
                 'usuario_recebimento_nome',
                 'data_operacao_recebimento'
             ])
+            registrar_alteracao_financeira(anterior, instance, user.get('sub'), user.get('nome'))
             
             serializer = self.get_serializer(instance)
             return Response(serializer.data)
@@ -5379,13 +8877,24 @@ class ReceitaViewSet(viewsets.ModelViewSet):
         # Para outras atualizações, usar o método padrão
         return super().partial_update(request, *args, **kwargs)
     
+    def perform_update(self, serializer):
+        """Edição comum: estorna/registra o recebimento se o status, o valor ou a data mudaram."""
+        import copy
+        anterior = copy.copy(serializer.instance)
+        receita = serializer.save()
+        registrar_alteracao_financeira(anterior, receita, self.request.user.get('sub'), self.request.user.get('nome'))
+    
+    def perform_destroy(self, instance):
+        user = self.request.user
+        excluir_lancamentos_com_estorno(Receita.objects.filter(pk=instance.pk), user.get('sub'), user.get('nome'))
+    
     @action(detail=True, methods=['post'])
     def receber(self, request, pk=None):
         receita = self.get_object()
         data_recebimento = request.data.get('data_recebimento', date.today())
         forma_pagamento = request.data.get('forma_pagamento')
         if not forma_pagamento: return Response({'erro': 'Forma de pagamento não fornecida'}, status=400)
-        receita.marcar_como_recebida(data_recebimento, forma_pagamento)
+        receita.marcar_como_recebida(data_recebimento, forma_pagamento, request.user.get('sub'), request.user.get('nome'))
         serializer = ReceitaSerializer(receita, context={'request': request})
         return Response(serializer.data)
     
@@ -5435,6 +8944,7 @@ class ReceitaViewSet(viewsets.ModelViewSet):
             data_operacao_recebimento=timezone.now()
         )
         # ▲▲▲ FIM DA CORREÇÃO ▲▲▲
+        registrar_evento_auditoria(**_evento_auditoria_financeiro(receita))
         
         serializer = ReceitaSerializer(receita, context={'request': request})
         return Response(serializer.data, status=201)
@@ -5452,7 +8962,7 @@ class ReceitaViewSet(viewsets.ModelViewSet):
 # VIEWSET DESPESA
 # ============================================
 
-class DespesaViewSet(viewsets.ModelViewSet):
+class DespesaViewSet(ExportacaoMixin, viewsets.ModelViewSet):
     """
     ViewSet para CRUD de Despesas
     """
@@ -5463,6 +8973,15 @@ class DespesaViewSet(viewsets.ModelViewSet):
     ordering_fields = ['data_vencimento', 'valor']
     ordering = ['-data_vencimento']
     
+    nome_exportacao = 'despesas'
+    colunas_exportacao = [
+        ('ID', 'id'), ('Descrição', 'descricao'), ('Categoria', 'categoria__nome'),
+        ('Fornecedor', 'fornecedor'), ('Valor', 'valor'), ('Vencimento', 'data_vencimento'),
+        ('Pagamento', 'data_pagamento'), ('Status', 'status'), ('Forma de pagamento', 'forma_pagamento'),
+        ('Cadastrado por', 'usuario_cadastro_nome'), ('Pago por', 'usuario_pagamento_nome'),
+        ('Observações', 'observacoes'),
+    ]
+    
     def get_queryset(self):
         clinica_id = self.request.user.get('clinica_id')
         Despesa.atualizar_status_vencidos(clinica_id)
@@ -5505,7 +9024,7 @@ class DespesaViewSet(viewsets.ModelViewSet):
             usuario_pagamento_nome = user.get('nome')
             data_operacao_pagamento = timezone.now()
 
-        serializer.save(
+        despesa = serializer.save(
             clinica_id=clinica_id,
             usuario_cadastro_id=usuario_cadastro_id,
             usuario_cadastro_nome=usuario_cadastro_nome,
@@ -5513,6 +9032,8 @@ class DespesaViewSet(viewsets.ModelViewSet):
             usuario_pagamento_nome=usuario_pagamento_nome,
             data_operacao_pagamento=data_operacao_pagamento
         )
+        if despesa.status == 'paga':
+            registrar_evento_auditoria(**_evento_auditoria_financeiro(despesa))
     
     def partial_update(self, request, *args, **kwargs):
         """
@@ -5522,7 +9043,9 @@ class DespesaViewSet(viewsets.ModelViewSet):
         
         # Se está marcando como paga, registrar auditoria
         if 'status' in request.data and request.data['status'] == 'paga':
+            import copy
             user = request.user
+            anterior = copy.copy(instance)
             instance.status = 'paga'
             instance.data_pagamento = request.data.get('data_pagamento', date.today())
             instance.forma_pagamento = request.data.get('forma_pagamento', instance.forma_pagamento)
@@ -5540,6 +9063,7 @@ class DespesaViewSet(viewsets.ModelViewSet):
                 'usuario_pagamento_nome',
                 'data_operacao_pagamento'
             ])
+            registrar_alteracao_financeira(anterior, instance, user.get('sub'), user.get('nome'))
             
             serializer = self.get_serializer(instance)
             return Response(serializer.data)
@@ -5547,13 +9071,24 @@ class DespesaViewSet(viewsets.ModelViewSet):
         # Para outras atualizações, usar o método padrão
         return super().partial_update(request, *args, **kwargs)
     
+    def perform_update(self, serializer):
+        """Edição comum: estorna/registra o pagamento se o status, o valor ou a data mudaram."""
+        import copy
+        anterior = copy.copy(serializer.instance)
+        despesa = serializer.save()
+        registrar_alteracao_financeira(anterior, despesa, self.request.user.get('sub'), self.request.user.get('nome'))
+    
+    def perform_destroy(self, instance):
+        user = self.request.user
+        excluir_lancamentos_com_estorno(Despesa.objects.filter(pk=instance.pk), user.get('sub'), user.get('nome'))
+    
     @action(detail=True, methods=['post'])
     def pagar(self, request, pk=None):
         despesa = self.get_object()
         data_pagamento = request.data.get('data_pagamento', date.today())
         forma_pagamento = request.data.get('forma_pagamento')
         if not forma_pagamento: return Response({'erro': 'Forma de pagamento não fornecida'}, status=400)
-        despesa.marcar_como_paga(data_pagamento, forma_pagamento)
+        despesa.marcar_como_paga(data_pagamento, forma_pagamento, request.user.get('sub'), request.user.get('nome'))
         serializer = DespesaSerializer(despesa, context={'request': request})
         return Response(serializer.data)
 
@@ -6351,6 +9886,7 @@ class TranscricaoConsumer(AsyncWebsocketConsumer):
         )
         
         await self.accept()
+        Metricas.ajustar_gauge('intellimed_websocket_conexoes', 1, consumer='transcricao')
         
         # Enviar confirmação de conexão
         await self.send(text_data=json.dumps({
@@ -6360,6 +9896,7 @@ class TranscricaoConsumer(AsyncWebsocketConsumer):
     
     async def disconnect(self, close_code):
         """Desconectar WebSocket"""
+        Metricas.ajustar_gauge('intellimed_websocket_conexoes', -1, consumer='transcricao')
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -6457,6 +9994,7 @@ router = DefaultRouter()
 router.register(r'pacientes', PacienteViewSet, basename='paciente')
 router.register(r'medicos', MedicoViewSet, basename='medico')
 router.register(r'agendamentos', AgendamentoViewSet, basename='agendamento')
+router.register(r'horarios-atendimento', HorarioAtendimentoViewSet, basename='horario-atendimento')
 router.register(r'consultas', ConsultaViewSet, basename='consulta')
 router.register(r'exames', ExameViewSet, basename='exame')
 router.register(r'faturamento/categorias/receitas', CategoriaReceitaViewSet, basename='categoria-receita')
@@ -6598,7 +10136,7 @@ def transcrever_audio_view(request):
     if not audio_base64:
         return Response({'erro': 'Nenhum áudio fornecido.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    resultado = transcrever_audio_geral_com_gemini(audio_base64, audio_formato)
+    resultado = transcrever_audio_geral_com_gemini(audio_base64, audio_formato, request.user.get('clinica_id'))
 
     if resultado['sucesso']:
         return Response({'texto': resultado['texto']}, status=status.HTTP_200_OK)
@@ -6606,129 +10144,84 @@ def transcrever_audio_view(request):
         return Response({'erro': resultado['erro']}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def _cursor_auditoria(evento):
+    """Cursor opaco apontando para depois do evento (timestamp + id)."""
+    return base64.urlsafe_b64encode(f"{evento.timestamp.isoformat()}|{evento.id}".encode()).decode()
+
+
+def _pagina_auditoria(queryset, request, limite_padrao, limite_maximo=200):
+    """
+    Uma página de eventos, do mais recente para o mais antigo, começando após
+    o ?cursor= recebido. Retorna (eventos, proximo_cursor); proximo_cursor é
+    None na última página. Levanta ValueError para cursor/limite inválidos.
+    """
+    from django.db.models import Q
+
+    try:
+        limite = min(max(int(request.GET.get('limite', limite_padrao)), 1), limite_maximo)
+    except (TypeError, ValueError):
+        raise ValueError('Parâmetro "limite" inválido')
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            momento, evento_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            momento, evento_id = datetime.fromisoformat(momento), int(evento_id)
+        except (ValueError, UnicodeDecodeError):
+            raise ValueError('Cursor inválido')
+        queryset = queryset.filter(Q(timestamp__lt=momento) | Q(timestamp=momento, id__lt=evento_id))
+
+    eventos = list(queryset.order_by('-timestamp', '-id')[:limite + 1])
+    proximo_cursor = _cursor_auditoria(eventos[limite - 1]) if len(eventos) > limite else None
+    return eventos[:limite], proximo_cursor
+
+
+def _eventos_financeiros(request, clinica_id):
+    """Eventos financeiros da clínica, filtrados por ?mes=&ano= (data de recebimento/pagamento)."""
+    eventos = EventoAuditoria.objects.filter(clinica_id=clinica_id, categoria='financeiro')
+    mes = request.GET.get('mes')
+    ano = request.GET.get('ano')
+    if mes and ano:
+        eventos = eventos.filter(data_referencia__month=int(mes), data_referencia__year=int(ano))
+    return eventos
+
+
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 def auditoria_recente_view(request):
     """
     Retorna um log de eventos recentes para auditoria (Exames e Documentos).
-    GET /api/auditoria/recente/
+    GET /api/auditoria/recente/?limite=40&cursor=...
+    O cursor da próxima página vem no cabeçalho X-Proximo-Cursor.
     """
-    from django.db.models import Q
-    from datetime import datetime
-    from django.utils import timezone
-
     clinica_id = request.user.get('clinica_id')
     if not clinica_id:
         return Response({"erro": "Usuário sem clínica vinculada."}, status=400)
 
-    limite_eventos = 40  # Aumentado para garantir captura de ambos os tipos
-    eventos = []
-
-    def to_aware_datetime(ts):
-        if ts is None: return None
-        if isinstance(ts, str):
-            try:
-                ts_str = ts.split('+')[0].split('Z')[0]
-                dt_obj = datetime.fromisoformat(ts_str)
-                return timezone.make_aware(dt_obj)
-            except (ValueError, TypeError): return None
-        if timezone.is_naive(ts): return timezone.make_aware(ts)
-        return ts
-
-    # 1. Exames Gerados (criados)
-    exames_criados = Exame.objects.filter(
-        clinica_id=clinica_id
-    ).select_related('paciente').order_by('-data_cadastro')[:limite_eventos]
-    for exame in exames_criados:
-        ts = to_aware_datetime(exame.data_cadastro)
-        if ts:
-            # ▼▼▼ CORREÇÃO APLICADA AQUI ▼▼▼
-            # Prioriza o tipo identificado pela IA e usa o tipo manual como fallback.
-            tipo_exame_display = exame.tipo_exame_identificado_ia or exame.get_tipo_exame_display()
-            # ▲▲▲ FIM DA CORREÇÃO ▲▲▲
-
-            eventos.append({
-                'timestamp': ts, 'tipo_evento': 'Exame Gerado',
-                'paciente_nome': exame.paciente.nome_completo if exame.paciente else 'N/A',
-                'usuario_nome': exame.medico_solicitante or 'Sistema',
-                'detalhes': f"Tipo: {tipo_exame_display}"
-            })
-
-    # 2. Exames Editados (revisados)
-    exames_revisados = Exame.objects.filter(
-        clinica_id=clinica_id, revisado_por_medico=True, data_revisao__isnull=False
-    ).select_related('paciente').order_by('-data_revisao')[:limite_eventos]
-    for exame in exames_revisados:
-        ts = to_aware_datetime(exame.data_revisao)
-        if ts:
-            # ▼▼▼ CORREÇÃO APLICADA AQUI ▼▼▼
-            tipo_exame_display = exame.tipo_exame_identificado_ia or exame.get_tipo_exame_display()
-            # ▲▲▲ FIM DA CORREÇÃO ▲▲▲
-
-            eventos.append({
-                'timestamp': ts, 'tipo_evento': 'Exame Editado',
-                'paciente_nome': exame.paciente.nome_completo if exame.paciente else 'N/A',
-                'usuario_nome': exame.medico_revisor_nome or 'Não identificado',
-                'detalhes': f"Revisão do Laudo de {tipo_exame_display}"
-            })
-
-    # 3. Documentos Gerados/Editados (Lógica Simplificada e Corrigida)
-    consultas_com_docs = Consulta.objects.filter(
-        clinica_id=clinica_id
-    ).select_related('paciente').order_by('-data_atualizacao')[:limite_eventos]
-    
-    doc_fields = {
-        'atestado_medico': 'Atestado', 'anamnese_documento': 'Anamnese',
-        'evolucao_medica': 'Evolução', 'prescricao_documento': 'Prescrição',
-        'relatorio_medico': 'Relatório'
-    }
-
-    for consulta in consultas_com_docs:
-        # Verifica se há algum documento nos campos de texto
-        for field_name, doc_type in doc_fields.items():
-            if getattr(consulta, field_name):
-                ts = to_aware_datetime(consulta.data_atualizacao)
-                if ts:
-                    # Verifica se o documento foi editado (olhando o JSON)
-                    editado = False
-                    if isinstance(consulta.documentos_gerados, list):
-                        for doc_json in consulta.documentos_gerados:
-                            if doc_json.get('tipo') == doc_type.lower() and doc_json.get('editado'):
-                                editado = True
-                                break
-                    
-                    eventos.append({
-                        'timestamp': ts,
-                        'tipo_evento': 'Documento Editado' if editado else 'Documento Gerado',
-                        'paciente_nome': consulta.paciente.nome_completo if consulta.paciente else 'N/A',
-                        'usuario_nome': consulta.medico_responsavel or 'Sistema',
-                        'detalhes': f"Tipo: {doc_type}"
-                    })
-
-    # Ordenar todos os eventos
-    eventos_ordenados = sorted(eventos, key=lambda x: x['timestamp'], reverse=True)
-
-    # Remover duplicatas e formatar
-    eventos_finais = []
-    vistos = set()
-    limite_final = 20
-    for evento in eventos_ordenados:
-        if len(eventos_finais) >= limite_final * 2: # Limite para processamento
-            break
-        chave = (evento['timestamp'].strftime('%Y-%m-%d %H:%M'), evento['tipo_evento'], evento['paciente_nome'], evento['detalhes'])
-        if chave not in vistos:
-            eventos_finais.append({
-                'data': evento['timestamp'].strftime('%d/%m/%Y'),
-                'hora': evento['timestamp'].strftime('%H:%M'),
-                'tipo_evento': evento['tipo_evento'],
-                'paciente_nome': evento['paciente_nome'],
-                'usuario_nome': evento['usuario_nome'],
-                'detalhes': evento['detalhes']
-            })
-            vistos.add(chave)
+    try:
+        eventos, proximo_cursor = _pagina_auditoria(
+            EventoAuditoria.objects.filter(clinica_id=clinica_id, categoria='clinico'), request, limite_padrao=40
+        )
+    except ValueError as e:
+        return Response({'erro': str(e)}, status=400)
+
+    resultado = []
+    for evento in eventos:
+        momento = timezone.localtime(evento.timestamp)
+        resultado.append({
+            'data': momento.strftime('%d/%m/%Y'),
+            'hora': momento.strftime('%H:%M'),
+            'tipo_evento': evento.get_tipo_display(),
+            'paciente_nome': evento.paciente_nome or 'N/A',
+            'usuario_nome': evento.usuario_nome,
+            'detalhes': evento.detalhes,
+        })
 
-    return Response(eventos_finais)
+    response = Response(resultado)
+    if proximo_cursor:
+        response['X-Proximo-Cursor'] = proximo_cursor
+    return response
 
 
 @api_view(['GET'])
@@ -6737,11 +10230,10 @@ def auditoria_recente_view(request):
 def auditoria_financeira_view(request):
     """
     Retorna auditoria financeira com receitas recebidas e despesas pagas
-    GET /api/auditoria/financeira/?mes=10&ano=2025
+    GET /api/auditoria/financeira/?mes=10&ano=2025&limite=200&cursor=...
     """
     try:
-        # A importação precisa estar aqui para a função get_sort_key funcionar
-        from datetime import datetime
+        from django.db.models import Sum, Q
 
         user = request.user
         clinica_id = user.get('clinica_id')
@@ -6749,108 +10241,53 @@ def auditoria_financeira_view(request):
         if not clinica_id:
             return Response({'erro': 'Clínica não identificada'}, status=400)
         
-        # Parâmetros opcionais de filtro
-        mes = request.GET.get('mes')
-        ano = request.GET.get('ano')
-        
-        # Query base para receitas recebidas
-        receitas_query = Receita.objects.filter(
-            clinica_id=clinica_id,
-            status='recebida'
-        ).select_related('categoria', 'paciente')
-        
-        # Query base para despesas pagas
-        despesas_query = Despesa.objects.filter(
-            clinica_id=clinica_id,
-            status='paga'
-        ).select_related('categoria')
-        
-        # Aplicar filtros se fornecidos
-        if mes and ano:
-            from django.db.models import Q
-            receitas_query = receitas_query.filter(
-                data_recebimento__month=int(mes),
-                data_recebimento__year=int(ano)
-            )
-            despesas_query = despesas_query.filter(
-                data_pagamento__month=int(mes),
-                data_pagamento__year=int(ano)
-            )
-        
-        # Ordenar por data
-        receitas = receitas_query.order_by('-data_recebimento')[:100]
-        despesas = despesas_query.order_by('-data_pagamento')[:100]
+        eventos_query = _eventos_financeiros(request, clinica_id)
+        try:
+            eventos, proximo_cursor = _pagina_auditoria(eventos_query, request, limite_padrao=200)
+        except ValueError as e:
+            return Response({'erro': str(e)}, status=400)
         
-        # Montar lista de auditoria
         auditoria = []
+        for evento in eventos:
+            dados = evento.dados or {}
+            receita = evento.tipo in EventoAuditoria.TIPOS_RECEITA
+            item = {
+                'id': evento.objeto_id,
+                'tipo': evento.objeto_tipo,
+                'tipo_display': evento.get_tipo_display(),
+                'descricao': evento.detalhes,
+                'categoria': dados.get('categoria') or 'Sem categoria',
+                'categoria_cor': dados.get('categoria_cor') or ('#4CAF50' if receita else '#F44336'),
+                'valor': float(evento.valor or 0) if receita else -float(evento.valor or 0),
+                'data_operacao': evento.data_referencia.strftime('%d/%m/%Y') if evento.data_referencia else 'N/A',
+                'data_hora_operacao': timezone.localtime(evento.timestamp).strftime('%d/%m/%Y às %H:%M') if dados.get('hora_registrada', True) else 'Não registrado',
+                'forma_pagamento': dados.get('forma_pagamento') or 'Não informado',
+                'usuario_id': evento.usuario_id,
+                'usuario_nome': evento.usuario_nome or 'Não identificado',
+                'observacoes': dados.get('observacoes', ''),
+            }
+            if receita:
+                item['paciente'] = dados.get('paciente') or 'N/A'
+            else:
+                item['fornecedor'] = dados.get('fornecedor') or 'N/A'
+            auditoria.append(item)
         
-        # Processar receitas
-        for r in receitas:
-            auditoria.append({
-                'id': r.id,
-                'tipo': 'receita',
-                'tipo_display': 'Receita',
-                'descricao': r.descricao,
-                'categoria': r.categoria.nome if r.categoria else 'Sem categoria',
-                'categoria_cor': r.categoria.cor if r.categoria else '#4CAF50',
-                'valor': float(r.valor),
-                'data_operacao': r.data_recebimento.strftime('%d/%m/%Y') if r.data_recebimento else 'N/A',
-                'data_hora_operacao': r.data_operacao_recebimento.strftime('%d/%m/%Y às %H:%M') if r.data_operacao_recebimento else 'Não registrado',
-                'forma_pagamento': r.forma_pagamento or 'Não informado',
-                'usuario_id': r.usuario_recebimento_id,
-                'usuario_nome': r.usuario_recebimento_nome or 'Não identificado',
-                'paciente': r.paciente.nome_completo if r.paciente else 'N/A',
-                'observacoes': r.observacoes or '',
-            })
-        
-        # Processar despesas
-        for d in despesas:
-            auditoria.append({
-                'id': d.id,
-                'tipo': 'despesa',
-                'tipo_display': 'Despesa',
-                'descricao': d.descricao,
-                'categoria': d.categoria.nome if d.categoria else 'Sem categoria',
-                'categoria_cor': d.categoria.cor if d.categoria else '#F44336',
-                'valor': -float(d.valor),
-                'data_operacao': d.data_pagamento.strftime('%d/%m/%Y') if d.data_pagamento else 'N/A',
-                'data_hora_operacao': d.data_operacao_pagamento.strftime('%d/%m/%Y às %H:%M') if d.data_operacao_pagamento else 'Não registrado',
-                'forma_pagamento': d.forma_pagamento or 'Não informado',
-                'usuario_id': d.usuario_pagamento_id,
-                'usuario_nome': d.usuario_pagamento_nome or 'Não identificado',
-                'fornecedor': d.fornecedor or 'N/A',
-                'observacoes': d.observacoes or '',
-            })
-        
-        # ▼▼▼ CORREÇÃO APLICADA AQUI ▼▼▼
-        # A função agora sempre retorna um objeto datetime, evitando o TypeError.
-        def get_sort_key(item):
-            data_str = item['data_hora_operacao']
-            if data_str == 'Não registrado':
-                # Retorna um objeto datetime real para comparação correta
-                return datetime.min
-            try:
-                # Converte a string de data para um objeto datetime
-                return datetime.strptime(data_str, '%d/%m/%Y às %H:%M')
-            except (ValueError, TypeError):
-                # Fallback para qualquer outro caso inesperado
-                return datetime.min
-        # ▲▲▲ FIM DA CORREÇÃO ▲▲▲
-
-        auditoria_ordenada = sorted(auditoria, key=get_sort_key, reverse=True)
-        
-        # Calcular totais
-        total_receitas = sum(item['valor'] for item in auditoria if item['tipo'] == 'receita')
-        total_despesas = abs(sum(item['valor'] for item in auditoria if item['tipo'] == 'despesa'))
-        saldo = total_receitas - total_despesas
+        # Totais do período inteiro (não só da página)
+        totais = eventos_query.aggregate(
+            receitas=Sum('valor', filter=Q(tipo__in=EventoAuditoria.TIPOS_RECEITA)),
+            despesas=Sum('valor', filter=Q(tipo__in=EventoAuditoria.TIPOS_DESPESA)),
+        )
+        total_receitas = float(totais['receitas'] or 0)
+        total_despesas = float(totais['despesas'] or 0)
         
         return Response({
-            'auditoria': auditoria_ordenada,
-            'total_itens': len(auditoria_ordenada),
+            'auditoria': auditoria,
+            'total_itens': len(auditoria),
+            'proximo_cursor': proximo_cursor,
             'resumo': {
                 'total_receitas': total_receitas,
                 'total_despesas': total_despesas,
-                'saldo': saldo,
+                'saldo': total_receitas - total_despesas,
             }
         })
         
@@ -6867,7 +10304,7 @@ def auditoria_financeira_view(request):
 def auditoria_faturamento_view(request):
     """
     Retorna histórico de receitas recebidas e despesas pagas para auditoria
-    GET /api/faturamento/auditoria/
+    GET /api/faturamento/auditoria/?limite=200&cursor=...
     """
     try:
         user = request.user
@@ -6876,63 +10313,37 @@ def auditoria_faturamento_view(request):
         if not clinica_id:
             return Response({'erro': 'Clínica não identificada'}, status=400)
         
-        # Buscar receitas recebidas
-        receitas = Receita.objects.filter(
-            clinica_id=clinica_id,
-            status='recebida'
-        ).select_related('categoria', 'paciente').order_by('-data_recebimento')[:100]
-        
-        # Buscar despesas pagas
-        despesas = Despesa.objects.filter(
-            clinica_id=clinica_id,
-            status='paga'
-        ).select_related('categoria').order_by('-data_pagamento')[:100]
+        try:
+            eventos, proximo_cursor = _pagina_auditoria(_eventos_financeiros(request, clinica_id), request, limite_padrao=200)
+        except ValueError as e:
+            return Response({'erro': str(e)}, status=400)
         
-        # Montar lista combinada
         historico = []
-        
-        for receita in receitas:
-            historico.append({
-                'id': receita.id,
-                'tipo': 'receita',
-                'tipo_display': 'Receita',
-                'descricao': receita.descricao,
-                'categoria': receita.categoria.nome if receita.categoria else 'Sem categoria',
-                'valor': float(receita.valor),
-                'data_operacao': receita.data_recebimento.strftime('%d/%m/%Y') if receita.data_recebimento else '',
-                'data_hora_operacao': receita.data_operacao_recebimento.strftime('%d/%m/%Y %H:%M') if receita.data_operacao_recebimento else 'Não registrado',
-                'forma_pagamento': receita.forma_pagamento or 'Não informado',
-                'usuario_id': receita.usuario_recebimento_id,
-                'usuario_nome': receita.usuario_recebimento_nome or 'Não registrado',
-                'paciente': receita.paciente.nome_completo if receita.paciente else 'N/A',
-            })
-        
-        for despesa in despesas:
-            historico.append({
-                'id': despesa.id,
-                'tipo': 'despesa',
-                'tipo_display': 'Despesa',
-                'descricao': despesa.descricao,
-                'categoria': despesa.categoria.nome if despesa.categoria else 'Sem categoria',
-                'valor': float(despesa.valor),
-                'data_operacao': despesa.data_pagamento.strftime('%d/%m/%Y') if despesa.data_pagamento else '',
-                'data_hora_operacao': despesa.data_operacao_pagamento.strftime('%d/%m/%Y %H:%M') if despesa.data_operacao_pagamento else 'Não registrado',
-                'forma_pagamento': despesa.forma_pagamento or 'Não informado',
-                'usuario_id': despesa.usuario_pagamento_id,
-                'usuario_nome': despesa.usuario_pagamento_nome or 'Não registrado',
-                'fornecedor': despesa.fornecedor or 'N/A',
-            })
-        
-        # Ordenar por data de operação (mais recentes primeiro)
-        historico_ordenado = sorted(
-            historico,
-            key=lambda x: x['data_hora_operacao'] if x['data_hora_operacao'] != 'Não registrado' else '',
-            reverse=True
-        )
+        for evento in eventos:
+            dados = evento.dados or {}
+            item = {
+                'id': evento.objeto_id,
+                'tipo': evento.objeto_tipo,
+                'tipo_display': evento.get_tipo_display(),
+                'descricao': evento.detalhes,
+                'categoria': dados.get('categoria') or 'Sem categoria',
+                'valor': float(evento.valor or 0),
+                'data_operacao': evento.data_referencia.strftime('%d/%m/%Y') if evento.data_referencia else '',
+                'data_hora_operacao': timezone.localtime(evento.timestamp).strftime('%d/%m/%Y %H:%M') if dados.get('hora_registrada', True) else 'Não registrado',
+                'forma_pagamento': dados.get('forma_pagamento') or 'Não informado',
+                'usuario_id': evento.usuario_id,
+                'usuario_nome': evento.usuario_nome or 'Não registrado',
+            }
+            if evento.tipo in EventoAuditoria.TIPOS_RECEITA:
+                item['paciente'] = dados.get('paciente') or 'N/A'
+            else:
+                item['fornecedor'] = dados.get('fornecedor') or 'N/A'
+            historico.append(item)
         
         return Response({
-            'historico': historico_ordenado,
-            'total_itens': len(historico_ordenado)
+            'historico': historico,
+            'total_itens': len(historico),
+            'proximo_cursor': proximo_cursor,
         })
         
     except Exception as e:
@@ -6976,6 +10387,7 @@ def definir_nova_senha_view(request):
     usuario.set_password(nova_senha)
     usuario.precisa_alterar_senha = False
     usuario.save(update_fields=['password', 'precisa_alterar_senha'])
+    RevogacaoTokens.revogar('usuario', usuario.id)
 
     return Response({'mensagem': 'Senha alterada com sucesso! Você já pode fazer o login com sua nova senha.'}, status=status.HTTP_200_OK)
 
@@ -7037,6 +10449,349 @@ def _gerar_dados_backup(clinica_id):
         }
     }
 
+# ============================================
+# ARQUIVO DE BACKUP COMPACTADO (FORMATO 2.0)
+# ============================================
+# Estrutura em disco:
+#   intellimed_backups/
+#     manifest_clinica_{id}.json                  -> índice dos snapshots (usado pelo histórico)
+#     blobs/clinica_{id}/ab/abcdef...{.gz|.zst}   -> arquivos base64 deduplicados entre snapshots
+#     backup_intellimed_clinica_{id}_{ts}.tar
+#         manifest.json                           -> versão, compressão e checksums
+#         dados/{modelo}.ndjson.{gz|zst}          -> um registro JSON por linha
+#         blobs/{sha256}.{gz|zst}                 -> só nos arquivos autossuficientes (download/e-mail)
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+BACKUP_DIR = 'intellimed_backups'
+BACKUP_FORMATO = 'intellimed-backup'
+BACKUP_FORMATO_VERSAO = '2.0'
+BACKUP_BLOB_PREFIXO = 'blob:sha256:'
+BACKUP_BLOB_MIN_BYTES = 1024
+# Snapshots automáticos mantidos por clínica (0 = todos); os mais antigos saem na limpeza diária
+BACKUP_SNAPSHOTS_MANTIDOS = int(os.getenv('BACKUP_SNAPSHOTS_MANTIDOS', 0))
+# Blob sem referência só é apagado depois deste prazo (um snapshot pode estar sendo gravado)
+BACKUP_BLOB_CARENCIA_HORAS = int(os.getenv('BACKUP_BLOB_CARENCIA_HORAS', 24))
+
+# Campos com arquivos em base64 que vão para a seção de blobs
+BACKUP_CAMPOS_BLOB = {
+    'consultas': ['audio_consulta'],
+    'exames': ['arquivo_exame'],
+}
+
+def _backup_compressao():
+    """Usa zstd quando disponível, senão gzip."""
+    return 'zstd' if zstd is not None else 'gzip'
+
+def _backup_extensao(compressao):
+    return '.zst' if compressao == 'zstd' else '.gz'
+
+def _backup_comprimir(conteudo, compressao):
+    import gzip
+    if compressao == 'zstd':
+        return zstd.ZstdCompressor(level=10).compress(conteudo)
+    return gzip.compress(conteudo, compresslevel=6, mtime=0)
+
+def _backup_descomprimir(conteudo, compressao):
+    import gzip
+    if compressao == 'zstd':
+        if zstd is None:
+            raise ValueError('Backup compactado com zstd, mas o pacote zstandard não está instalado.')
+        return zstd.ZstdDecompressor().decompress(conteudo)
+    return gzip.decompress(conteudo)
+
+def _backup_hash_valido(sha):
+    return isinstance(sha, str) and re.fullmatch(r'[0-9a-f]{64}', sha) is not None
+
+def _backup_blobs_dir(clinica_id):
+    return os.path.join(BACKUP_DIR, 'blobs', f'clinica_{clinica_id}')
+
+def _backup_caminho_blob(clinica_id, sha, compressao):
+    return os.path.join(_backup_blobs_dir(clinica_id), sha[:2], sha + _backup_extensao(compressao))
+
+def _backup_manifest_path(clinica_id):
+    return os.path.join(BACKUP_DIR, f'manifest_clinica_{clinica_id}.json')
+
+def _backup_separar_blobs(dados):
+    """
+    Substitui os campos base64 grandes por referências 'blob:sha256:<hash>'.
+    Retorna (dados_sem_blobs, {hash: bytes}).
+    """
+    import hashlib
+    blobs = {}
+    resultado = {}
+    for modelo, registros in dados.items():
+        campos = BACKUP_CAMPOS_BLOB.get(modelo, [])
+        novos_registros = []
+        for registro in registros:
+            registro = dict(registro)
+            for campo in campos:
+                valor = registro.get(campo)
+                if isinstance(valor, str) and valor.startswith(AUDIO_ARQUIVO_PREFIXO):
+                    # Áudio guardado em disco entra no backup como data URL, para o backup ser autossuficiente
+                    try:
+                        valor = _audio_arquivo_para_data_url(_audio_consulta_caminho(valor, registro.get('clinica_id')), registro.get('audio_formato') or 'webm')
+                    except (OSError, ValueError, TypeError) as e:
+                        print(f"⚠️ Backup: áudio {valor} não encontrado ({e})")
+                        valor = None
+                    registro[campo] = valor
+                if isinstance(valor, str) and len(valor) >= BACKUP_BLOB_MIN_BYTES:
+                    conteudo = valor.encode('utf-8')
+                    sha = hashlib.sha256(conteudo).hexdigest()
+                    blobs[sha] = conteudo
+                    registro[campo] = BACKUP_BLOB_PREFIXO + sha
+            novos_registros.append(registro)
+        resultado[modelo] = novos_registros
+    return resultado, blobs
+
+def _backup_resolver_blobs(dados, carregar_blob):
+    """Troca as referências de blob pelo conteúdo original."""
+    for modelo, campos in BACKUP_CAMPOS_BLOB.items():
+        for registro in dados.get(modelo, []):
+            for campo in campos:
+                valor = registro.get(campo)
+                if isinstance(valor, str) and valor.startswith(BACKUP_BLOB_PREFIXO):
+                    registro[campo] = carregar_blob(valor[len(BACKUP_BLOB_PREFIXO):])
+    return dados
+
+def _gerar_arquivo_backup(backup_data, blobs, incluir_blobs, destino):
+    """
+    Grava o arquivo .tar do backup (dados em NDJSON compactado por modelo + manifest)
+    no arquivo binário `destino`, membro a membro, sem montar o .tar em memória.
+    Retorna o manifest.
+    """
+    import io
+    import tarfile
+    import hashlib
+
+    compressao = _backup_compressao()
+    extensao = _backup_extensao(compressao)
+    manifest = {
+        'formato': BACKUP_FORMATO,
+        'version': BACKUP_FORMATO_VERSAO,
+        'compressao': compressao,
+        'timestamp': backup_data['timestamp'],
+        'clinica_id': backup_data['clinica_id'],
+        'modelos': {},
+        'blobs': {sha: {'bytes': len(conteudo)} for sha, conteudo in blobs.items()},
+        'blobs_incluidos': incluir_blobs,
+    }
+
+    def adicionar(tar, nome, conteudo):
+        info = tarfile.TarInfo(name=nome)
+        info.size = len(conteudo)
+        info.mtime = int(timezone.now().timestamp())
+        tar.addfile(info, io.BytesIO(conteudo))
+
+    with tarfile.open(fileobj=destino, mode='w') as tar:
+        for modelo, registros in backup_data['dados'].items():
+            ndjson = ''.join(json.dumps(r, ensure_ascii=False, default=str) + '\n' for r in registros).encode('utf-8')
+            comprimido = _backup_comprimir(ndjson, compressao)
+            arquivo = f'dados/{modelo}.ndjson{extensao}'
+            manifest['modelos'][modelo] = {
+                'arquivo': arquivo,
+                'registros': len(registros),
+                'sha256': hashlib.sha256(ndjson).hexdigest(),
+                'bytes': len(comprimido),
+            }
+            adicionar(tar, arquivo, comprimido)
+
+        if incluir_blobs:
+            for sha, conteudo in blobs.items():
+                adicionar(tar, f'blobs/{sha}{extensao}', _backup_comprimir(conteudo, compressao))
+
+        adicionar(tar, 'manifest.json', json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    return manifest
+
+def _backup_arquivo_autossuficiente(backup_data, destino):
+    """Grava em `destino` o .tar com os blobs embutidos (download e anexo de e-mail)."""
+    dados, blobs = _backup_separar_blobs(backup_data['dados'])
+    return _gerar_arquivo_backup(dict(backup_data, dados=dados), blobs, True, destino)
+
+def _ler_arquivo_backup(conteudo, clinica_id=None):
+    """
+    Lê um arquivo .tar de backup e devolve o dicionário no mesmo formato de
+    _gerar_dados_backup. Blobs ausentes no arquivo são buscados no repositório
+    local da clínica. Lança ValueError se o arquivo estiver corrompido.
+    """
+    import io
+    import tarfile
+    import hashlib
+
+    try:
+        tar = tarfile.open(fileobj=io.BytesIO(conteudo), mode='r:')
+    except tarfile.TarError as e:
+        raise ValueError(f'Arquivo de backup inválido: {e}')
+
+    with tar:
+        def ler_membro(nome):
+            try:
+                membro = tar.extractfile(nome)
+            except KeyError:
+                return None
+            return membro.read() if membro else None
+
+        manifest_bytes = ler_membro('manifest.json')
+        if manifest_bytes is None:
+            raise ValueError('Manifest não encontrado no arquivo de backup.')
+        manifest = json.loads(manifest_bytes.decode('utf-8'))
+        if manifest.get('formato') != BACKUP_FORMATO:
+            raise ValueError('Formato de backup desconhecido.')
+
+        compressao = manifest.get('compressao', 'gzip')
+        extensao = _backup_extensao(compressao)
+        dados = {}
+        for modelo, info in manifest.get('modelos', {}).items():
+            comprimido = ler_membro(info['arquivo'])
+            if comprimido is None:
+                raise ValueError(f"Dados de '{modelo}' ausentes no arquivo de backup.")
+            ndjson = _backup_descomprimir(comprimido, compressao)
+            if hashlib.sha256(ndjson).hexdigest() != info.get('sha256'):
+                raise ValueError(f"Checksum inválido para '{modelo}'. O arquivo pode estar corrompido.")
+            dados[modelo] = [json.loads(linha) for linha in ndjson.decode('utf-8').splitlines() if linha]
+
+        def carregar_blob(sha):
+            if not _backup_hash_valido(sha):
+                raise ValueError('Referência de blob inválida no backup.')
+            comprimido = ler_membro(f'blobs/{sha}{extensao}')
+            if comprimido is None and clinica_id is not None:
+                caminho = _backup_caminho_blob(clinica_id, sha, compressao)
+                if os.path.exists(caminho):
+                    with open(caminho, 'rb') as f:
+                        comprimido = f.read()
+            if comprimido is None:
+                raise ValueError(f'Blob {sha[:12]} não encontrado para este backup.')
+            bruto = _backup_descomprimir(comprimido, compressao)
+            if hashlib.sha256(bruto).hexdigest() != sha:
+                raise ValueError(f'Checksum inválido para o blob {sha[:12]}.')
+            return bruto.decode('utf-8')
+
+        _backup_resolver_blobs(dados, carregar_blob)
+
+    return {
+        'version': manifest.get('version'),
+        'timestamp': manifest.get('timestamp'),
+        'clinica_id': manifest.get('clinica_id'),
+        'dados': dados,
+    }
+
+def _salvar_snapshot_backup(clinica_id, backup_data):
+    """
+    Salva um snapshot no servidor: os blobs vão para o repositório compartilhado
+    da clínica (só os novos são gravados) e o índice manifest_clinica_{id}.json
+    recebe a nova entrada. Retorna (caminho_do_arquivo, entrada_do_indice).
+    """
+    import hashlib
+
+    dados, blobs = _backup_separar_blobs(backup_data['dados'])
+    snapshot = dict(backup_data, dados=dados)
+    compressao = _backup_compressao()
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    blobs_novos = 0
+    for sha, bruto in blobs.items():
+        caminho = _backup_caminho_blob(clinica_id, sha, compressao)
+        if os.path.exists(caminho):
+            # Renova o mtime: a limpeza de blobs órfãos respeita a carência a partir dele
+            os.utime(caminho)
+            continue
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho + '.tmp', 'wb') as f:
+            f.write(_backup_comprimir(bruto, compressao))
+        os.replace(caminho + '.tmp', caminho)
+        blobs_novos += 1
+
+    filename = f"backup_intellimed_clinica_{clinica_id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.tar"
+    filepath = os.path.join(BACKUP_DIR, filename)
+    with open(filepath + '.tmp', 'wb') as f:
+        manifest = _gerar_arquivo_backup(snapshot, blobs, False, f)
+    os.replace(filepath + '.tmp', filepath)
+
+    sha_arquivo = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            sha_arquivo.update(bloco)
+
+    entrada = {
+        'filename': filename,
+        'timestamp': manifest['timestamp'],
+        'version': manifest['version'],
+        'compressao': compressao,
+        'tamanho_bytes': os.path.getsize(filepath),
+        'sha256': sha_arquivo.hexdigest(),
+        'registros': {modelo: info['registros'] for modelo, info in manifest['modelos'].items()},
+        'blobs': sorted(blobs.keys()),
+        'blobs_novos': blobs_novos,
+    }
+
+    indice = _ler_indice_backups(clinica_id)
+    indice['snapshots'].append(entrada)
+    _gravar_indice_backups(clinica_id, indice)
+
+    return filepath, entrada
+
+def _gravar_indice_backups(clinica_id, indice):
+    manifest_path = _backup_manifest_path(clinica_id)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def _ler_indice_backups(clinica_id):
+    """Lê o índice de snapshots da clínica (sem abrir os arquivos de backup)."""
+    manifest_path = _backup_manifest_path(clinica_id)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                indice = json.load(f)
+            indice.setdefault('snapshots', [])
+            return indice
+        except (ValueError, OSError) as e:
+            print(f"    ⚠️  Índice de backups da clínica {clinica_id} ilegível: {e}")
+    return {'formato': BACKUP_FORMATO, 'clinica_id': clinica_id, 'snapshots': []}
+
+def limpar_blobs_backup_orfaos():
+    """
+    Limpeza dos backups no servidor (executada pelo agendador): aplica
+    BACKUP_SNAPSHOTS_MANTIDOS, tira do índice os snapshots cujo arquivo sumiu e
+    apaga os blobs que nenhum snapshot restante referencia (após a carência).
+    """
+    import time
+    pasta_blobs = os.path.join(BACKUP_DIR, 'blobs')
+    if not os.path.isdir(pasta_blobs):
+        return 0
+    limite_mtime = time.time() - BACKUP_BLOB_CARENCIA_HORAS * 3600
+    removidos = 0
+    for pasta_clinica in os.listdir(pasta_blobs):
+        if not pasta_clinica.startswith('clinica_') or not pasta_clinica[len('clinica_'):].isdigit():
+            continue
+        clinica_id = int(pasta_clinica[len('clinica_'):])
+        indice = _ler_indice_backups(clinica_id)
+        snapshots = [s for s in indice['snapshots'] if os.path.exists(os.path.join(BACKUP_DIR, s['filename']))]
+        if BACKUP_SNAPSHOTS_MANTIDOS and len(snapshots) > BACKUP_SNAPSHOTS_MANTIDOS:
+            for antigo in snapshots[:-BACKUP_SNAPSHOTS_MANTIDOS]:
+                os.remove(os.path.join(BACKUP_DIR, antigo['filename']))
+            snapshots = snapshots[-BACKUP_SNAPSHOTS_MANTIDOS:]
+        if len(snapshots) != len(indice['snapshots']):
+            indice['snapshots'] = snapshots
+            _gravar_indice_backups(clinica_id, indice)
+
+        referenciados = {sha for s in snapshots for sha in s.get('blobs', [])}
+        for raiz, _, arquivos in os.walk(os.path.join(pasta_blobs, pasta_clinica)):
+            for nome in arquivos:
+                sha = nome.split('.', 1)[0]
+                caminho = os.path.join(raiz, nome)
+                if sha in referenciados or os.path.getmtime(caminho) > limite_mtime:
+                    continue
+                os.remove(caminho)
+                removidos += 1
+    if removidos:
+        print(f"🧹 Backups: {removidos} blob(s) sem referência removido(s)")
+    return removidos
+
 def executar_backup_automatico():
     """Tarefa agendada para rodar backups automáticos."""
     print(f"[{timezone.now()}]  scheduler: Iniciando verificação de backups automáticos...")
@@ -7076,58 +10831,163 @@ def _enviar_backup_por_email(clinica):
         else:
              return
 
+    import time
+    inicio = time.perf_counter()
+    resultado = 'erro'
     try:
+        from django.core.mail import EmailMultiAlternatives
+
         backup_data = _gerar_dados_backup(clinica.id)
-        backup_content = json.dumps(backup_data, ensure_ascii=False, indent=2)
-        
-        # ▼▼▼ NOVA LÓGICA DE SALVAMENTO LOCAL ADICIONADA AQUI ▼▼▼
-        # Garante que o diretório de backups exista
-        backup_dir = 'intellimed_backups'
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        # Cria um nome de arquivo padronizado com timestamp completo
-        filename = f"backup_intellimed_clinica_{clinica.id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.json"
-        filepath = os.path.join(backup_dir, filename)
 
+        # Snapshot local: dados compactados + blobs deduplicados entre snapshots
         try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(backup_content)
-            print(f"    ✓ Backup local da clínica {clinica.id} salvo em: {filepath}")
+            filepath, entrada = _salvar_snapshot_backup(clinica.id, backup_data)
+            print(f"    ✓ Backup local da clínica {clinica.id} salvo em: {filepath} "
+                  f"({entrada['tamanho_bytes']} bytes, {entrada['blobs_novos']} blob(s) novo(s))")
         except Exception as e:
             print(f"    ✗ ERRO CRÍTICO ao salvar backup local para clínica {clinica.id}: {e}")
             # Não continua se não conseguir salvar o arquivo
             return
-        # ▲▲▲ FIM DA NOVA LÓGICA ▲▲▲
 
         # Enviar por e-mail (se houver e-mail configurado)
         if clinica.backup_email_notificacao:
-            send_mail(
+            import tempfile
+            filename = os.path.basename(filepath)
+
+            email = EmailMultiAlternatives(
                 subject=f'IntelliMed - Backup Automático da sua Clínica ({timezone.now().strftime("%d/%m/%Y")})',
-                message=f'Olá,\n\nSegue em anexo o backup automático dos dados da sua clínica "{clinica.nome}".\n\nGuarde este arquivo em um local seguro.\n\nAtenciosamente,\nEquipe IntelliMed.',
+                body=f'Olá,\n\nSegue em anexo o backup automático dos dados da sua clínica "{clinica.nome}".\n\nGuarde este arquivo em um local seguro.\n\nAtenciosamente,\nEquipe IntelliMed.',
                 from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[clinica.backup_email_notificacao],
-                fail_silently=False,
-                html_message=f'<p>Olá,</p><p>Segue em anexo o backup automático dos dados da sua clínica "{clinica.nome}".</p><p>Guarde este arquivo em um local seguro.</p><p>Atenciosamente,<br>Equipe IntelliMed.</p>'
-            ).attach(filename, backup_content, 'application/json')
+                to=[clinica.backup_email_notificacao],
+            )
+            email.attach_alternative(f'<p>Olá,</p><p>Segue em anexo o backup automático dos dados da sua clínica "{clinica.nome}".</p><p>Guarde este arquivo em um local seguro.</p><p>Atenciosamente,<br>Equipe IntelliMed.</p>', 'text/html')
+            # O anexo precisa ser autossuficiente (com os blobs); é montado em disco e só lido no envio
+            with tempfile.TemporaryDirectory() as pasta:
+                caminho_anexo = os.path.join(pasta, filename)
+                with open(caminho_anexo, 'wb') as f:
+                    _backup_arquivo_autossuficiente(backup_data, f)
+                email.attach_file(caminho_anexo, 'application/x-tar')
+                email.send(fail_silently=False)
             print(f"    ✓ Backup da clínica {clinica.id} enviado para {clinica.backup_email_notificacao}")
         
         # Atualiza a data do último backup
         clinica.backup_ultimo_realizado = timezone.now()
         clinica.save(update_fields=['backup_ultimo_realizado'])
+        resultado = 'sucesso'
 
     except Exception as e:
         print(f"    ✗ ERRO ao gerar ou enviar e-mail de backup para clínica {clinica.id}: {e}")
+    finally:
+        Metricas.observar('intellimed_backup_duracao_segundos', time.perf_counter() - inicio, origem='automatico', resultado=resultado)
 
 
 # NO ARQUIVO: main.py
 # Substitua a função 'backup_restaurar_view' inteira por esta versão corrigida:
 
+def _perform_restore_from_data(clinica_id, dados_backup):
+    """
+    Apaga os dados da clínica e recria a partir do dicionário 'dados' de um backup.
+    Usuários nunca são apagados, apenas mapeados pelo CPF. Retorna o resumo da restauração.
+    """
+    with transaction.atomic():
+        # Limpeza segura: APAGA APENAS DADOS, NUNCA USUÁRIOS
+        Despesa.objects.filter(clinica_id=clinica_id).delete()
+        Receita.objects.filter(clinica_id=clinica_id).delete()
+        Exame.objects.filter(clinica_id=clinica_id).delete()
+        Consulta.objects.filter(clinica_id=clinica_id).delete()
+        Agendamento.objects.filter(clinica_id=clinica_id).delete()
+        Paciente.objects.filter(clinica_id=clinica_id).delete()
+        CategoriaDespesa.objects.filter(clinica_id=clinica_id).delete()
+        CategoriaReceita.objects.filter(clinica_id=clinica_id).delete()
+        # Os eventos apontam para os ids antigos; são refeitos a partir dos dados restaurados no fim
+        EventoAuditoria.objects.filter(clinica_id=clinica_id).delete()
+        
+        id_map = {
+            'categorias_receita': {}, 'categorias_despesa': {}, 'pacientes': {},
+            'agendamentos': {}, 'consultas': {}, 'usuarios': {}
+        }
+        
+        # 1. Mapear os usuários existentes sem apagá-los
+        usuarios_existentes = Usuario.objects.filter(clinica_id=clinica_id)
+        usuarios_existentes_por_cpf = {u.cpf: u for u in usuarios_existentes}
+        for usuario_do_backup in dados_backup.get('usuarios', []):
+            cpf_backup = usuario_do_backup.get('cpf')
+            old_id = usuario_do_backup.get('id')
+            if cpf_backup in usuarios_existentes_por_cpf:
+                id_map['usuarios'][old_id] = usuarios_existentes_por_cpf[cpf_backup]
+        
+        # 2. Função auxiliar para limpar dados de cada registro
+        def clean_dict(data_dict, *keys_to_remove):
+            for key in keys_to_remove:
+                data_dict.pop(key, None)
+            return data_dict
+
+        # 3. Restaurar cada modelo, limpando os dados antes de criar
+        for data in dados_backup.get('categorias_receita', []):
+            old_id = data.get('id')
+            clean_dict(data, 'id', 'clinica_id', 'data_cadastro')
+            id_map['categorias_receita'][old_id] = CategoriaReceita.objects.create(clinica_id=clinica_id, **data)
+        
+        for data in dados_backup.get('categorias_despesa', []):
+            old_id = data.get('id')
+            clean_dict(data, 'id', 'clinica_id', 'data_cadastro')
+            id_map['categorias_despesa'][old_id] = CategoriaDespesa.objects.create(clinica_id=clinica_id, **data)
+        
+        for data in dados_backup.get('pacientes', []):
+            old_id = data.get('id')
+            clean_dict(data, 'id', 'clinica_id', 'idade', 'endereco_completo', 'sexo_display', 'convenio_display', 'data_cadastro', 'data_atualizacao')
+            id_map['pacientes'][old_id] = Paciente.objects.create(clinica_id=clinica_id, **data)
+
+        for data in dados_backup.get('agendamentos', []):
+            old_id = data.get('id')
+            paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
+            if not paciente_obj: continue
+            medico_obj = id_map['usuarios'].get(data.pop('medico_responsavel', None))
+            clean_dict(data, 'id', 'clinica_id', 'paciente_id', 'paciente_nome', 'paciente_cpf', 'status_display', 'servico_display', 'medico_responsavel_nome', 'data_cadastro', 'data_atualizacao')
+            id_map['agendamentos'][old_id] = Agendamento.objects.create(clinica_id=clinica_id, paciente=paciente_obj, medico_responsavel=medico_obj, **data)
+
+        for data in dados_backup.get('consultas', []):
+            old_id = data.get('id')
+            paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
+            agendamento_obj = id_map['agendamentos'].get(data.pop('agendamento', None))
+            if not paciente_obj: continue
+            clean_dict(data, 'id', 'clinica_id', 'paciente_nome', 'paciente_cpf', 'tipo_consulta_display', 'status_display', 'data_cadastro', 'data_atualizacao', 'data_inicio_atendimento', 'data_fim_atendimento')
+            id_map['consultas'][old_id] = Consulta.objects.create(clinica_id=clinica_id, paciente=paciente_obj, agendamento=agendamento_obj, **data)
+
+        for data in dados_backup.get('exames', []):
+            old_id = data.get('id')
+            paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
+            consulta_obj = id_map['consultas'].get(data.pop('consulta', None))
+            if not paciente_obj: continue
+            clean_dict(data, 'id', 'clinica_id', 'paciente_nome', 'tipo_exame_display', 'status_display', 'data_cadastro', 'data_atualizacao', 'data_revisao')
+            Exame.objects.create(clinica_id=clinica_id, paciente=paciente_obj, consulta=consulta_obj, **data)
+
+        for data in dados_backup.get('receitas', []):
+            old_id = data.get('id')
+            paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
+            categoria_obj = id_map['categorias_receita'].get(data.pop('categoria', None))
+            agendamento_obj = id_map['agendamentos'].get(data.pop('agendamento', None))
+            clean_dict(data, 'id', 'clinica_id', 'categoria_nome', 'status_display', 'paciente_nome', 'data_cadastro', 'data_atualizacao')
+            Receita.objects.create(clinica_id=clinica_id, paciente=paciente_obj, categoria=categoria_obj, agendamento=agendamento_obj, **data)
+        
+        for data in dados_backup.get('despesas', []):
+            old_id = data.get('id')
+            categoria_obj = id_map['categorias_despesa'].get(data.pop('categoria', None))
+            clean_dict(data, 'id', 'clinica_id', 'categoria_nome', 'status_display', 'data_cadastro', 'data_atualizacao')
+            Despesa.objects.create(clinica_id=clinica_id, categoria=categoria_obj, **data)
+        
+        eventos_auditoria = popular_auditoria_historica(clinica_id)
+        
+        resumo = { 'usuarios': len(id_map['usuarios']), 'pacientes': len(id_map['pacientes']), 'agendamentos': len(id_map['agendamentos']), 'consultas': len(id_map['consultas']), 'exames': len(dados_backup.get('exames', [])), 'receitas': len(dados_backup.get('receitas', [])), 'despesas': len(dados_backup.get('despesas', [])), 'eventos_auditoria': eventos_auditoria }
+
+    return resumo
+
 @api_view(['POST'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated, IsAdminOrMedico])
 def backup_restaurar_view(request):
     """
-    Restaurar dados a partir de arquivo de backup JSON
+    Restaurar dados a partir de arquivo de backup (.tar no formato 2.0 ou JSON legado)
     POST /api/backup/restaurar/
     """
     try:
@@ -7136,20 +10996,23 @@ def backup_restaurar_view(request):
         
         arquivo = request.FILES['backup_file']
 
-        if not arquivo.name.endswith('.json'):
-            return Response({'erro': 'Apenas arquivos JSON'}, status=400)
+        if not arquivo.name.endswith(('.json', '.tar')):
+            return Response({'erro': 'Apenas arquivos de backup .tar ou .json'}, status=400)
         
+        clinica_id_usuario_logado = request.user.get('clinica_id')
+
         try:
-            conteudo = arquivo.read().decode('utf-8')
-            dados = json.loads(conteudo)
+            if arquivo.name.endswith('.tar'):
+                dados = _ler_arquivo_backup(arquivo.read(), clinica_id=clinica_id_usuario_logado)
+            else:
+                conteudo = arquivo.read().decode('utf-8')
+                dados = json.loads(conteudo)
         except Exception as e:
-            return Response({'erro': f'Arquivo JSON inválido: {e}'}, status=400)
+            return Response({'erro': f'Arquivo de backup inválido: {e}'}, status=400)
         
         if 'clinica_id' not in dados or 'dados' not in dados:
             return Response({'erro': 'Estrutura de backup inválida'}, status=400)
         
-        clinica_id_usuario_logado = request.user.get('clinica_id')
-        
         if not clinica_id_usuario_logado:
             return Response({'erro': 'Super admins não podem restaurar backups de clínicas. Use um usuário administrador da clínica.'}, status=403)
         
@@ -7157,94 +11020,7 @@ def backup_restaurar_view(request):
         if clinica_id_backup != clinica_id_usuario_logado:
             return Response({'erro': 'Este arquivo de backup pertence a outra clínica.'}, status=403)
 
-        with transaction.atomic():
-            # Limpeza segura: APAGA APENAS DADOS, NUNCA USUÁRIOS
-            Despesa.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            Receita.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            Exame.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            Consulta.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            Agendamento.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            Paciente.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            CategoriaDespesa.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            CategoriaReceita.objects.filter(clinica_id=clinica_id_usuario_logado).delete()
-            
-            id_map = {
-                'categorias_receita': {}, 'categorias_despesa': {}, 'pacientes': {},
-                'agendamentos': {}, 'consultas': {}, 'usuarios': {}
-            }
-            
-            dados_backup = dados.get('dados', {})
-
-            # 1. Mapear os usuários existentes sem apagá-los
-            usuarios_existentes = Usuario.objects.filter(clinica_id=clinica_id_usuario_logado)
-            usuarios_existentes_por_cpf = {u.cpf: u for u in usuarios_existentes}
-            for usuario_do_backup in dados_backup.get('usuarios', []):
-                cpf_backup = usuario_do_backup.get('cpf')
-                old_id = usuario_do_backup.get('id')
-                if cpf_backup in usuarios_existentes_por_cpf:
-                    id_map['usuarios'][old_id] = usuarios_existentes_por_cpf[cpf_backup]
-            
-            # 2. Função auxiliar para limpar dados de cada registro
-            def clean_dict(data_dict, *keys_to_remove):
-                for key in keys_to_remove:
-                    data_dict.pop(key, None)
-                return data_dict
-
-            # 3. Restaurar cada modelo, limpando os dados antes de criar
-            for data in dados_backup.get('categorias_receita', []):
-                old_id = data.get('id')
-                clean_dict(data, 'id', 'clinica_id', 'data_cadastro')
-                id_map['categorias_receita'][old_id] = CategoriaReceita.objects.create(clinica_id=clinica_id_usuario_logado, **data)
-            
-            for data in dados_backup.get('categorias_despesa', []):
-                old_id = data.get('id')
-                clean_dict(data, 'id', 'clinica_id', 'data_cadastro')
-                id_map['categorias_despesa'][old_id] = CategoriaDespesa.objects.create(clinica_id=clinica_id_usuario_logado, **data)
-            
-            for data in dados_backup.get('pacientes', []):
-                old_id = data.get('id')
-                clean_dict(data, 'id', 'clinica_id', 'idade', 'endereco_completo', 'sexo_display', 'convenio_display', 'data_cadastro', 'data_atualizacao')
-                id_map['pacientes'][old_id] = Paciente.objects.create(clinica_id=clinica_id_usuario_logado, **data)
-
-            for data in dados_backup.get('agendamentos', []):
-                old_id = data.get('id')
-                paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
-                if not paciente_obj: continue
-                medico_obj = id_map['usuarios'].get(data.pop('medico_responsavel', None))
-                clean_dict(data, 'id', 'clinica_id', 'paciente_id', 'paciente_nome', 'paciente_cpf', 'status_display', 'servico_display', 'medico_responsavel_nome', 'data_cadastro', 'data_atualizacao')
-                id_map['agendamentos'][old_id] = Agendamento.objects.create(clinica_id=clinica_id_usuario_logado, paciente=paciente_obj, medico_responsavel=medico_obj, **data)
-
-            for data in dados_backup.get('consultas', []):
-                old_id = data.get('id')
-                paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
-                agendamento_obj = id_map['agendamentos'].get(data.pop('agendamento', None))
-                if not paciente_obj: continue
-                clean_dict(data, 'id', 'clinica_id', 'paciente_nome', 'paciente_cpf', 'tipo_consulta_display', 'status_display', 'data_cadastro', 'data_atualizacao', 'data_inicio_atendimento', 'data_fim_atendimento')
-                id_map['consultas'][old_id] = Consulta.objects.create(clinica_id=clinica_id_usuario_logado, paciente=paciente_obj, agendamento=agendamento_obj, **data)
-
-            for data in dados_backup.get('exames', []):
-                old_id = data.get('id')
-                paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
-                consulta_obj = id_map['consultas'].get(data.pop('consulta', None))
-                if not paciente_obj: continue
-                clean_dict(data, 'id', 'clinica_id', 'paciente_nome', 'tipo_exame_display', 'status_display', 'data_cadastro', 'data_atualizacao', 'data_revisao')
-                Exame.objects.create(clinica_id=clinica_id_usuario_logado, paciente=paciente_obj, consulta=consulta_obj, **data)
-
-            for data in dados_backup.get('receitas', []):
-                old_id = data.get('id')
-                paciente_obj = id_map['pacientes'].get(data.pop('paciente', None))
-                categoria_obj = id_map['categorias_receita'].get(data.pop('categoria', None))
-                agendamento_obj = id_map['agendamentos'].get(data.pop('agendamento', None))
-                clean_dict(data, 'id', 'clinica_id', 'categoria_nome', 'status_display', 'paciente_nome', 'data_cadastro', 'data_atualizacao')
-                Receita.objects.create(clinica_id=clinica_id_usuario_logado, paciente=paciente_obj, categoria=categoria_obj, agendamento=agendamento_obj, **data)
-            
-            for data in dados_backup.get('despesas', []):
-                old_id = data.get('id')
-                categoria_obj = id_map['categorias_despesa'].get(data.pop('categoria', None))
-                clean_dict(data, 'id', 'clinica_id', 'categoria_nome', 'status_display', 'data_cadastro', 'data_atualizacao')
-                Despesa.objects.create(clinica_id=clinica_id_usuario_logado, categoria=categoria_obj, **data)
-            
-            resumo = { 'usuarios': len(id_map['usuarios']), 'pacientes': len(id_map['pacientes']), 'agendamentos': len(id_map['agendamentos']), 'consultas': len(id_map['consultas']), 'exames': len(dados_backup.get('exames', [])), 'receitas': len(dados_backup.get('receitas', [])), 'despesas': len(dados_backup.get('despesas', [])) }
+        resumo = _perform_restore_from_data(clinica_id_usuario_logado, dados.get('dados', {}))
 
         return Response({ 'mensagem': 'Backup restaurado com sucesso! Usuários existentes foram preservados.', 'data_backup': dados.get('timestamp'), 'resumo': resumo }, status=200)
         
@@ -7257,19 +11033,24 @@ def backup_restaurar_view(request):
 @authentication_classes([JWTAuthentication]) # <-- DECORADOR ADICIONADO
 @permission_classes([IsAuthenticated, IsAdminOrMedico]) # <-- DECORADOR ADICIONADO
 def backup_criar_view(request):
-    """Cria e retorna um backup JSON dos dados da clínica para download manual."""
+    """Cria e retorna um backup compactado (.tar autossuficiente) dos dados da clínica para download manual."""
     user = request.user
     clinica_id = user.get('clinica_id')
     if not clinica_id:
         return Response({'erro': 'Usuário não vinculado a uma clínica.'}, status=400)
 
-    backup_data = _gerar_dados_backup(clinica_id)
-    
-    response = JsonResponse(backup_data, safe=False, json_dumps_params={'ensure_ascii': False, 'indent': 2})
-    filename = f"backup_intellimed_clinica_{clinica_id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.json"
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    import tempfile
+    from django.http import FileResponse
+
+    # O .tar vai para um arquivo temporário e é enviado em blocos
+    temporario = tempfile.TemporaryFile()
+    with Metricas.cronometro('intellimed_backup_duracao_segundos', origem='manual'):
+        backup_data = _gerar_dados_backup(clinica_id)
+        _backup_arquivo_autossuficiente(backup_data, temporario)
+    temporario.seek(0)
     
-    return response
+    filename = f"backup_intellimed_clinica_{clinica_id}_{timezone.now().strftime('%Y%m%d_%H%M%S')}.tar"
+    return FileResponse(temporario, as_attachment=True, filename=filename, content_type='application/x-tar')
 
 @api_view(['POST', 'GET'])
 @authentication_classes([JWTAuthentication])
@@ -7314,28 +11095,46 @@ def backup_configurar_view(request):
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated, IsAdminOrMedico])
 def backup_historico_view(request):
-    """Lista os backups automáticos disponíveis no servidor para a clínica."""
+    """
+    Lista os backups automáticos disponíveis no servidor para a clínica.
+    Lê apenas o índice (manifest_clinica_{id}.json), sem abrir os arquivos.
+    """
     clinica_id = request.user.get('clinica_id')
-    backup_dir = 'intellimed_backups'
     historico = []
 
-    if not os.path.exists(backup_dir):
+    if not os.path.exists(BACKUP_DIR):
         return Response([])
 
     try:
-        for filename in os.listdir(backup_dir):
+        for snapshot in _ler_indice_backups(clinica_id)['snapshots']:
+            if not os.path.exists(os.path.join(BACKUP_DIR, snapshot['filename'])):
+                continue
+            dt_obj = timezone.localtime(datetime.fromisoformat(snapshot['timestamp']))
+            historico.append({
+                'filename': snapshot['filename'],
+                'timestamp': dt_obj.strftime('%d/%m/%Y às %H:%M:%S'),
+                'data_iso': dt_obj.isoformat(),
+                'tamanho_bytes': snapshot.get('tamanho_bytes'),
+                'registros': snapshot.get('registros', {}),
+            })
+
+        # Backups JSON do formato antigo (1.0), identificados apenas pelo nome do arquivo
+        for filename in os.listdir(BACKUP_DIR):
             if filename.startswith(f"backup_intellimed_clinica_{clinica_id}_") and filename.endswith(".json"):
                 try:
-                    timestamp_str = filename.split('_')[-1].replace('.json', '')
-                    dt_obj = datetime.strptime(timestamp_str, '%Y%m%d%H%M%S')
+                    timestamp_str = filename[len(f"backup_intellimed_clinica_{clinica_id}_"):].replace('.json', '')
+                    dt_obj = datetime.strptime(timestamp_str, '%Y%m%d_%H%M%S')
                     historico.append({
                         'filename': filename,
-                        'timestamp': dt_obj.strftime('%d/%m/%Y às %H:%M:%S')
+                        'timestamp': dt_obj.strftime('%d/%m/%Y às %H:%M:%S'),
+                        'data_iso': dt_obj.isoformat(),
+                        'tamanho_bytes': os.path.getsize(os.path.join(BACKUP_DIR, filename)),
+                        'registros': {},
                     })
                 except (ValueError, IndexError):
                     continue
         
-        historico.sort(key=lambda x: datetime.strptime(x['timestamp'], '%d/%m/%Y às %H:%M:%S'), reverse=True)
+        historico.sort(key=lambda x: x['data_iso'][:19], reverse=True)
         
         return Response(historico)
     except Exception as e:
@@ -7357,15 +11156,18 @@ def backup_restaurar_automatico_view(request):
     if not filename.startswith(f"backup_intellimed_clinica_{clinica_id}_"):
         return Response({'erro': 'Acesso negado. Este backup não pertence à sua clínica.'}, status=403)
 
-    backup_dir = 'intellimed_backups'
-    filepath = os.path.join(backup_dir, filename)
+    filepath = os.path.join(BACKUP_DIR, filename)
 
     if not os.path.exists(filepath):
         return Response({'erro': 'Arquivo de backup não encontrado no servidor.'}, status=404)
 
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            dados = json.load(f)
+        if filename.endswith('.tar'):
+            with open(filepath, 'rb') as f:
+                dados = _ler_arquivo_backup(f.read(), clinica_id=clinica_id)
+        else:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                dados = json.load(f)
         
         if dados.get('clinica_id') != clinica_id:
             return Response({'erro': 'Inconsistência de dados: O ID da clínica no arquivo não corresponde.'}, status=400)
@@ -7482,6 +11284,113 @@ def estatisticas_medico_view(request):
     except Exception as e:
         return Response({'erro': f'Ocorreu um erro: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# ============================================
+# PAINEL AGREGADO (BFF DO FRONTEND)
+# ============================================
+
+# Seções disponíveis: cada uma reaproveita o endpoint existente, com as mesmas
+# permissões e filtros (mes, ano, data_inicial, data_final, medico_id, periodo).
+PAINEL_SECOES = {
+    'dashboard': dashboard_principal,
+    'dados_clinica': dados_clinica_completo,
+    'dashboard_financeiro': dashboard_financeiro,
+    'auditoria_recente': auditoria_recente_view,
+    'auditoria_financeira': auditoria_financeira_view,
+    'estatisticas_medico': estatisticas_medico_view,
+    'pacientes_inativos': PacienteViewSet.as_view({'get': 'listar_inativos'}),
+    'medicos': MedicoViewSet.as_view({'get': 'list'}),
+}
+
+PAINEL_CACHE_TTL = int(os.getenv('PAINEL_CACHE_TTL', 30))
+
+@api_view(['GET'])
+@authentication_classes([JWTAuthentication])
+@permission_classes([IsAuthenticated])
+def painel_agregado_view(request):
+    """
+    Calcula várias seções do frontend em uma única requisição.
+    GET /api/painel/?secoes=dados_clinica,pacientes_inativos,medicos&mes=10&ano=2025
+
+    Os filtros da query string são compartilhados por todas as seções. O
+    resultado fica em cache por PAINEL_CACHE_TTL segundos, separado por clínica
+    e perfil de acesso (use atualizar=1 para ignorar o cache).
+
+    Resposta: {'secoes': {nome: {'status': http_status, 'dados': ...}}}
+    """
+    import copy
+    import hashlib
+    from django.core.cache import cache
+
+    clinica_id = request.user.get('clinica_id')
+    if not clinica_id:
+        return Response({'erro': 'Usuário não vinculado a uma clínica.'}, status=400)
+
+    secoes = [s.strip() for s in request.query_params.get('secoes', '').split(',') if s.strip()]
+    if not secoes:
+        return Response({'erro': 'Informe as seções desejadas em "secoes".', 'disponiveis': sorted(PAINEL_SECOES)}, status=400)
+    invalidas = [s for s in secoes if s not in PAINEL_SECOES]
+    if invalidas:
+        return Response({'erro': f"Seções inválidas: {', '.join(invalidas)}", 'disponiveis': sorted(PAINEL_SECOES)}, status=400)
+
+    filtros = {k: v for k, v in request.query_params.items() if k not in ('secoes', 'atualizar')}
+    chave_bruta = json.dumps({
+        'clinica_id': clinica_id,
+        'funcoes': sorted(request.user.get('funcoes') or []),
+        'secoes': sorted(set(secoes)),
+        'filtros': sorted(filtros.items()),
+    }, sort_keys=True)
+    cache_key = f"painel:{clinica_id}:{hashlib.sha256(chave_bruta.encode('utf-8')).hexdigest()}"
+
+    if request.query_params.get('atualizar') != '1':
+        resultado = cache.get(cache_key)
+        if resultado is not None:
+            response = Response(resultado)
+            response['X-Cache'] = 'HIT'
+            return response
+
+    resultado = {'secoes': {}}
+    todas_ok = True
+    for nome in dict.fromkeys(secoes):
+        sub_request = copy.copy(request._request)
+        sub_request.GET = request._request.GET.copy()
+        sub_request.GET.pop('secoes', None)
+        try:
+            sub_response = PAINEL_SECOES[nome](sub_request)
+            dados = sub_response.data if hasattr(sub_response, 'data') else json.loads(sub_response.content or b'null')
+            resultado['secoes'][nome] = {'status': sub_response.status_code, 'dados': dados}
+            todas_ok = todas_ok and sub_response.status_code < 400
+        except Exception as e:
+            print(f"⚠️  Painel: erro na seção '{nome}': {e}")
+            resultado['secoes'][nome] = {'status': 500, 'dados': {'erro': str(e)}}
+            todas_ok = False
+
+    # Só guarda em cache quando todas as seções responderam sem erro
+    if todas_ok and PAINEL_CACHE_TTL > 0:
+        cache.set(cache_key, resultado, PAINEL_CACHE_TTL)
+
+    response = Response(resultado)
+    response['X-Cache'] = 'MISS'
+    return response
+
+def metricas_view(request):
+    """
+    Métricas no formato texto do Prometheus, somadas entre todos os workers.
+    Expõe contadores por clínica: com METRICAS_TOKEN exige o token; sem ele, só
+    atende localhost sem cabeçalhos de proxy (um proxy local repassaria acessos externos).
+    """
+    if Metricas.TOKEN:
+        import hmac
+        autorizacao = request.headers.get('Authorization', '')
+        token = autorizacao[7:] if autorizacao.startswith('Bearer ') else request.GET.get('token', '')
+        if not hmac.compare_digest(token, Metricas.TOKEN):
+            return HttpResponse('Não autorizado\n', status=401, content_type='text/plain; charset=utf-8')
+    else:
+        local = request.META.get('REMOTE_ADDR') in ('127.0.0.1', '::1')
+        via_proxy = any(request.META.get(h) for h in ('HTTP_X_FORWARDED_FOR', 'HTTP_X_REAL_IP', 'HTTP_FORWARDED'))
+        if not local or via_proxy:
+            return HttpResponse('Defina METRICAS_TOKEN para acessar /metrics fora de localhost\n', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(Metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ============================================
 # URLS
 # ============================================
@@ -7510,6 +11419,7 @@ urlpatterns = [
     path('api/faturamento/auditoria/', auditoria_faturamento_view, name='auditoria_faturamento'),
 
     path('api/estatisticas/medico/', estatisticas_medico_view, name='estatisticas-medico'),
+    path('api/painel/', painel_agregado_view, name='painel-agregado'),
 
     # Rotas de Backup
     path('api/backup/criar/', backup_criar_view, name='backup-criar'),
@@ -7524,6 +11434,7 @@ urlpatterns = [
 
     # Health check
     path('api/health/', lambda request: JsonResponse({'status': 'ok'}), name='health'),
+    path('metrics', metricas_view, name='metrics'),
     path('api/auditoria/recente/', auditoria_recente_view, name='auditoria-recente'), 
     path('api/auditoria/financeira/', auditoria_financeira_view, name='auditoria-financeira'),
     
@@ -7580,12 +11491,17 @@ def run_server():
     print("  GET    /api/pacientes/                          - Listar pacientes")
     print("  POST   /api/pacientes/                          - Criar paciente")
     print("  GET    /api/pacientes/{id}/completo/            - Paciente com histórico completo")
+    print("  POST   /api/pacientes/importar/                 - Importar pacientes (CSV/XLSX)")
     
     print("\n📅 AGENDAMENTOS:")
     print("  GET    /api/agendamentos/                       - Listar agendamentos")
     print("  POST   /api/agendamentos/                       - Criar agendamento")
     print("  GET    /api/agendamentos/proximos/              - Próximos agendamentos")
     print("  GET    /api/agendamentos/agenda_dia/            - Agenda do dia específico")
+    print("  GET    /api/agendamentos/horarios-livres/       - Horários livres por médico (semana)")
+    print("  POST   /api/agendamentos/lote/                  - Agendamentos em lote / recorrentes")
+    print("  GET    /api/agendamentos/exportar/              - Exportar CSV/XLSX (também em receitas e despesas)")
+    print("  GET    /api/horarios-atendimento/               - Expediente dos médicos")
     print("  GET    /api/agendamentos/estatisticas_mes/      - Estatísticas mensais")
     
     print("\n🩺 CONSULTAS COM IA:")
@@ -7593,7 +11509,11 @@ def run_server():
     print("  POST   /api/consultas/{id}/iniciar-atendimento/ - Iniciar consulta")
     print("  POST   /api/consultas/{id}/enviar-audio/        - Enviar áudio da consulta")
     print("  POST   /api/consultas/{id}/transcrever/         - Transcrever com IA")
+    print("  POST   /api/consultas/{id}/audio-upload/        - Iniciar upload de áudio em partes")
+    print("  PUT    /api/consultas/{id}/audio-upload/{up}/   - Enviar parte (Upload-Offset)")
+    print("  POST   /api/consultas/{id}/audio-upload/{up}/concluir/ - Concluir upload")
     print("  POST   /api/consultas/{id}/gerar-documento/     - Gerar documento médico")
+    print("  POST   /api/consultas/{id}/gerar-documentos/    - Gerar vários documentos (lote)")
     print("  POST   /api/consultas/{id}/salvar-documento/    - Salvar documento editado")
     print("  GET    /api/consultas/{id}/documentos/          - Listar documentos da consulta")
     print("  POST   /api/consultas/{id}/finalizar/           - Finalizar consulta")
@@ -7613,6 +11533,7 @@ def run_server():
     print("\n📊 DASHBOARDS:")
     print("  GET    /api/dashboard/                          - Dashboard principal")
     print("  GET    /api/dados-clinica/                      - Dados completos da clínica")
+    print("  GET    /api/painel/?secoes=...                  - Várias seções em uma requisição")
     
     print("\n🎤 TRANSCRIÇÕES:")
     print("  GET    /api/transcricoes/                       - Listar transcrições")
@@ -7621,6 +11542,7 @@ def run_server():
     
     print("\n⚙️  OUTROS:")
     print("  GET    /api/health/                             - Health check")
+    print("  GET    /metrics                                 - Métricas (Prometheus)")
     
     print("\n" + "="*70)
     print(f"🚀 Servidor iniciando em http://{Config.HOST}:{Config.PORT}")
@@ -7640,6 +11562,9 @@ def run_server():
     print("  ✅ Dashboards e Relatórios")
     print("\nPressione CTRL+C para parar o servidor\n")
     
+    # Mensagens do WhatsApp que ficaram sem resposta na execução anterior
+    FilaWhatsApp.iniciar()
+    
     # Rodar servidor
     sys.argv = ['manage.py', 'runserver', f'{Config.HOST}:{Config.PORT}', '--noreload']
     execute_from_command_line(sys.argv)
@@ -7675,6 +11600,12 @@ def criar_tabelas_customizadas():
             Plano,
             AssinaturaClinica,
             ConsumoIA,
+            CacheResultadoIA,
+            EventoAuditoria,
+            EpocaToken,
+            HorarioAtendimento,
+            MensagemWhatsApp,
+            ConversaWhatsApp,
         ]
         
         for model in models_para_criar:
@@ -7718,6 +11649,9 @@ def inicializar_banco():
 
     # Popula os planos de assinatura padrão
     popular_planos_iniciais()
+
+    # Histórico de auditoria dos dados já existentes (somente na primeira vez)
+    popular_auditoria_historica()
     
     # Verificar se já existe super admin
     try:
@@ -7936,6 +11870,13 @@ if __name__ == '__main__':
     
     if precisa_inicializar:
         inicializar_banco()
+    else:
+        # Banco já existente: cria as tabelas de models novos e, na primeira vez, o histórico de auditoria
+        try:
+            criar_tabelas_customizadas()
+            popular_auditoria_historica()
+        except Exception as e:
+            print(f"⚠️  Erro ao atualizar tabelas: {e}")
     
     # ▼▼▼ LÓGICA DE INICIALIZAÇÃO DO AGENDADOR ATUALIZADA AQUI ▼▼▼
     try:
@@ -7967,6 +11908,36 @@ if __name__ == '__main__':
             replace_existing=True,
         )
         
+        # Limpeza diária das entradas expiradas do cache de IA
+        scheduler.add_job(
+            limpar_cache_ia_expirado,
+            trigger='cron',
+            hour=4,
+            minute=0,
+            id='limpeza_cache_ia_diaria',
+            max_instances=1,
+            replace_existing=True,
+        )
+        
+        scheduler.add_job(
+            limpar_blobs_backup_orfaos,
+            trigger='cron',
+            hour=5,
+            minute=0,
+            id='limpeza_blobs_backup',
+            max_instances=1,
+            replace_existing=True,
+        )
+        
+        scheduler.add_job(
+            limpar_uploads_audio_expirados,
+            trigger='cron',
+            minute=30,
+            id='limpeza_uploads_audio',
+            max_instances=1,
+            replace_existing=True,
+        )
+        
         scheduler.start()
         print("   ✅ Agendador iniciado. Verificação de backups agendada para as 03:00.")
         print("="*70)
@@ -7978,5 +11949,8 @@ if __name__ == '__main__':
     print("INTELLIMED - BACKEND API")
     print(f"\n🚀 Servidor iniciando na porta {Config.PORT}...")
     
+    # Mensagens do WhatsApp que ficaram sem resposta na execução anterior
+    FilaWhatsApp.iniciar()
+    
     sys.argv = ['manage.py', 'runserver', f'{Config.HOST}:{Config.PORT}', '--noreload']
     execute_from_command_line(sys.argv)
@@ -0,0 +1,55 @@
+"""
+IntelliMed - Sessão HTTP compartilhada
+Usada pelo backend (main.py), pelo frontend (frontend.py) e pelo painel
+administrativo (admin_panel_django.py); cada um passa os próprios padrões.
+"""
+
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SessaoHTTP(requests.Session):
+    """
+    requests.Session para uma instância por processo, compartilhada entre views
+    e threads: pool de conexões com keep-alive, retry de GETs em falhas
+    transitórias e timeout padrão escolhido pelo prefixo do caminho.
+
+    `timeouts` mapeia prefixos de caminho para timeouts; o prefixo mais longo
+    que casar com a URL vence. Um timeout explícito na chamada tem prioridade.
+    """
+
+    def __init__(self, timeouts=None, timeout_padrao=(5, 10), tentativas=2, pool_maxsize=10, pool_connections=2):
+        super().__init__()
+        retry = Retry(
+            total=tentativas,
+            connect=tentativas,
+            read=tentativas,
+            status=tentativas,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+        # A sessão é compartilhada entre usuários: nunca guardar cookies dos serviços chamados
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.timeouts = sorted((timeouts or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.timeout_padrao = timeout_padrao
+
+    def timeout_para(self, url):
+        caminho = urlsplit(url).path
+        for prefixo, timeout in self.timeouts:
+            if caminho.startswith(prefixo):
+                return timeout
+        return self.timeout_padrao
+
+    def request(self, method, url, *args, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout_para(url)
+        return super().request(method, url, *args, **kwargs)